@@ -0,0 +1,145 @@
+import asyncio
+import json
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+
+class AdmissionRejected(Exception):
+    """Raised when a budget is saturated and the caller should come back later"""
+
+    def __init__(self, budget: str, reason: str, retry_after_seconds: float):
+        super().__init__(f"{budget} budget {reason}")
+        self.budget = budget
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class Budget:
+    """Concurrency limit with a bounded FIFO wait queue and a queueing deadline"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout_seconds: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.active = 0
+        self.metrics = {"admitted": 0, "queue_full": 0, "timeout": 0}
+        self._waiters: deque = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.metrics[reason] += 1
+        # Roughly how long it takes a full queue to drain
+        return AdmissionRejected(self.name, reason, max(1.0, self.queue_timeout_seconds))
+
+    async def acquire(self) -> float:
+        """Take a slot, returning how long we waited for it"""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.metrics["admitted"] += 1
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full")
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+
+        def expire():
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                waiter.set_exception(self._reject("timeout"))
+
+        timer = loop.call_later(self.queue_timeout_seconds, expire)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # We were handed a slot just as we got cancelled, pass it on
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            timer.cancel()
+        self.metrics["admitted"] += 1
+        return loop.time() - started
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """Separate budgets per class of work, so one class can't starve the others"""
+
+    def __init__(self, budgets: Dict[str, Budget]):
+        self.budgets = budgets
+        self.wait_observer: Optional[Callable[[str, float], None]] = None
+
+    async def acquire(self, budget_name: str):
+        waited = await self.budgets[budget_name].acquire()
+        if self.wait_observer is not None:
+            self.wait_observer(budget_name, waited)
+
+    def release(self, budget_name: str):
+        self.budgets[budget_name].release()
+
+    @asynccontextmanager
+    async def slot(self, budget_name: str):
+        await self.acquire(budget_name)
+        try:
+            yield
+        finally:
+            self.release(budget_name)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting HTTP requests through their class budget
+
+    Requests that would have to wait longer than their class deadline, or that
+    find the queue full, get an immediate 503 with Retry-After. classify()
+    returns the budget for a request scope, or None to let it through.
+    """
+
+    def __init__(self, app, controller: AdmissionController, classify: Callable[[dict], Optional[str]]):
+        self.app = app
+        self.controller = controller
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        budget = self.classify(scope) if scope["type"] == "http" else None
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire(budget)
+        except AdmissionRejected as e:
+            body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(math.ceil(e.retry_after_seconds)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(budget)
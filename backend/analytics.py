@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import ExecutionTimeout, NetworkTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class AnalyticsReads:
+    """Time-budgeted reads for admin analytics, falling back when over budget
+
+    Each read gets max_time_ms, passed on to Mongo as maxTimeMS, so the
+    server abandons it instead of competing with live traffic. maxTimeMS
+    doesn't cover waiting for a pooled connection or for server selection,
+    so the whole read is also bounded client side, with some slack on top.
+
+    A read over budget is answered with its last good result, when one
+    is younger than max_stale_seconds, else with the read's fallback (a
+    cheaper estimate) or default. Callers report which fields were degraded.
+    """
+
+    def __init__(self, max_time_ms: int, max_stale_seconds: float = 3600, client_slack_seconds: float = 1.0):
+        self.max_time_ms = max_time_ms
+        self.max_stale_seconds = max_stale_seconds
+        self.client_slack_seconds = client_slack_seconds
+        # Read name -> (monotonic time, result)
+        self._last_good: Dict[Any, Tuple[float, Any]] = {}
+        # (read name, outcome) -> count
+        self.metrics: Counter = Counter()
+
+    async def read(
+        self,
+        name: str,
+        query: Callable[[int], Awaitable[Any]],
+        fallback: Optional[Callable[[], Awaitable[Any]]] = None,
+        default: Any = None,
+        key: Any = None
+    ) -> Tuple[Any, Optional[str]]:
+        """Run query(max_time_ms), returning (result, None) or (fallback result, reason)
+
+        `key` tells apart variants of one read, e.g. different projections;
+        the reason is "stale" or "fallback".
+        """
+        cache_key = (name, key)
+        try:
+            result = await asyncio.wait_for(
+                query(self.max_time_ms),
+                timeout=self.max_time_ms / 1000 + self.client_slack_seconds
+            )
+        except (ExecutionTimeout, NetworkTimeout, asyncio.TimeoutError) as e:
+            logger.warning(f"Analytics read {name} exceeded its {self.max_time_ms} ms budget: {str(e) or type(e).__name__}")
+            last_good = self._last_good.get(cache_key)
+            if last_good is not None and time.monotonic() - last_good[0] <= self.max_stale_seconds:
+                self.metrics[(name, "stale")] += 1
+                return last_good[1], "stale"
+            self.metrics[(name, "fallback")] += 1
+            return (await fallback() if fallback is not None else default), "fallback"
+        self._last_good[cache_key] = (time.monotonic(), result)
+        self.metrics[(name, "success")] += 1
+        return result, None
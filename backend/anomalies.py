@@ -0,0 +1,190 @@
+import logging
+import math
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EwmaStats:
+    """Exponentially weighted mean and variance of a series, in constant memory
+
+    Recent samples weigh most: with alpha 0.1 the last ~10 samples make up
+    two thirds of the estimate, so the baseline follows slow drifts (the
+    daily player curve) while a sudden departure stands out.
+    """
+
+    def __init__(self, alpha: float, mean: float = 0.0, variance: float = 0.0, count: int = 0):
+        self.alpha = alpha
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+
+    def update(self, value: float):
+        if self.count == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+        self.count += 1
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def zscore(self, value: float) -> float:
+        std = self.std
+        if std == 0:
+            return 0.0 if value == self.mean else math.copysign(math.inf, value - self.mean)
+        return (value - self.mean) / std
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"mean": self.mean, "variance": self.variance, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, alpha: float, state: Optional[Dict[str, Any]]) -> "EwmaStats":
+        return cls(alpha, **state) if state else cls(alpha)
+
+
+class ServerMonitor:
+    """Flags anomalies in a server's status polls as they come in
+
+    Keeps EWMA statistics of latency and players online and opens an event
+    when:
+    - latency_spike: latency is latency_zscore deviations above its mean,
+      and at least latency_min_ms above it;
+    - player_drop: the player count fell by drop_fraction of the previous
+      poll, and by at least drop_min players, from one poll to the next;
+    - offline: the server stopped answering.
+
+    Spikes and outages last until a poll is normal again, which closes the
+    event with ended_at; a drop is a single event. Each poll is judged
+    against the statistics before it, then added to them. Nothing is
+    flagged before warmup_samples polls. The statistics are saved after every
+    poll, so a new leader continues where the last one stopped without
+    reading any history.
+    """
+
+    def __init__(
+        self,
+        db,
+        server: str,
+        alpha: float = 0.1,
+        latency_zscore: float = 4.0,
+        latency_min_ms: float = 50.0,
+        drop_fraction: float = 0.5,
+        drop_min: int = 3,
+        warmup_samples: int = 20
+    ):
+        self.events = db.server_events
+        self.state = db.server_monitor_state
+        self.server = server
+        self.alpha = alpha
+        self.latency_zscore = latency_zscore
+        self.latency_min_ms = latency_min_ms
+        self.drop_fraction = drop_fraction
+        self.drop_min = drop_min
+        self.warmup_samples = warmup_samples
+        self.latency = EwmaStats(alpha)
+        self.players = EwmaStats(alpha)
+        self.last_players: Optional[int] = None
+        # Event kind -> id of its open event
+        self.open: Dict[str, str] = {}
+        self.metrics = {"latency_spike": 0, "player_drop": 0, "offline": 0}
+
+    async def setup(self):
+        await self.events.create_index([("started_at", -1)])
+        await self.events.create_index([("server", 1), ("kind", 1), ("started_at", -1)])
+
+    async def load(self):
+        """Restore the statistics left by the previous leader"""
+        state = await self.state.find_one({"_id": self.server})
+        state = state or {}
+        self.latency = EwmaStats.from_dict(self.alpha, state.get("latency"))
+        self.players = EwmaStats.from_dict(self.alpha, state.get("players"))
+        self.last_players = state.get("last_players")
+        self.open = state.get("open", {})
+
+    async def observe(self, latency: Optional[float], players_online: Optional[int], at: Optional[datetime] = None) -> List[dict]:
+        """Judge one poll, None values meaning the server didn't answer; returns the events opened"""
+        at = at or datetime.utcnow()
+        opened = []
+        if latency is None:
+            if "offline" not in self.open:
+                opened.append(await self._open("offline", at, {}))
+            # Players who were online before the outage aren't a drop later
+            self.last_players = None
+        else:
+            await self._close("offline", at)
+            opened.extend(await self._judge_latency(latency, at))
+            opened.extend(await self._judge_players(players_online, at))
+            self.latency.update(latency)
+            self.players.update(players_online)
+            self.last_players = players_online
+
+        await self.state.update_one({"_id": self.server}, {"$set": {
+            "latency": self.latency.to_dict(),
+            "players": self.players.to_dict(),
+            "last_players": self.last_players,
+            "open": self.open,
+            "observed_at": at,
+        }}, upsert=True)
+        return opened
+
+    async def _judge_latency(self, latency: float, at: datetime) -> List[dict]:
+        warm = self.latency.count >= self.warmup_samples
+        zscore = self.latency.zscore(latency)
+        if warm and zscore >= self.latency_zscore and latency - self.latency.mean >= self.latency_min_ms:
+            if "latency_spike" in self.open:
+                await self.events.update_one({"id": self.open["latency_spike"]}, {"$max": {"peak_ms": latency}})
+                return []
+            return [await self._open("latency_spike", at, {
+                "latency_ms": latency,
+                "peak_ms": latency,
+                "expected_ms": round(self.latency.mean, 2),
+                "std_ms": round(self.latency.std, 2),
+                # Infinite when latency never varied before
+                "zscore": round(zscore, 2) if math.isfinite(zscore) else None,
+            })]
+        await self._close("latency_spike", at)
+        return []
+
+    async def _judge_players(self, players_online: int, at: datetime) -> List[dict]:
+        if self.players.count < self.warmup_samples or self.last_players is None:
+            return []
+        dropped = self.last_players - players_online
+        if dropped >= self.drop_min and dropped >= self.drop_fraction * self.last_players:
+            event = await self._open("player_drop", at, {
+                "players_before": self.last_players,
+                "players_after": players_online,
+                "expected_players": round(self.players.mean, 2),
+                "std_players": round(self.players.std, 2),
+            }, instant=True)
+            return [event]
+        return []
+
+    async def _open(self, kind: str, at: datetime, details: Dict[str, Any], instant: bool = False) -> dict:
+        event = {"id": str(uuid.uuid4()), "server": self.server, "kind": kind, "started_at": at, "ended_at": at if instant else None, **details}
+        await self.events.insert_one(dict(event))
+        if not instant:
+            self.open[kind] = event["id"]
+        self.metrics[kind] += 1
+        logger.warning(f"Server anomaly on {self.server}: {kind} {details}")
+        return event
+
+    async def _close(self, kind: str, at: datetime):
+        event_id = self.open.pop(kind, None)
+        if event_id is not None:
+            await self.events.update_one({"id": event_id}, {"$set": {"ended_at": at}})
+
+    async def baseline(self) -> Dict[str, Any]:
+        """The statistics as last saved, for any process to report"""
+        state = await self.state.find_one({"_id": self.server}) or {}
+        baseline = {"server": self.server, "observed_at": state.get("observed_at")}
+        for metric in ("latency", "players"):
+            stats = EwmaStats.from_dict(self.alpha, state.get(metric))
+            baseline[metric] = {"mean": round(stats.mean, 2), "std": round(stats.std, 2), "samples": stats.count}
+        return baseline
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+class LogArchiver:
+    """Moves old log records from Mongo to date-partitioned Parquet files
+
+    Each collection is archived by its time field into
+    {directory}/{collection}/date=YYYY-MM-DD/part-<hash>.parquet, zstd
+    compressed (Parquet needs the pyarrow package). Records are moved a batch
+    at a time: the files are written first and the records deleted after, so
+    a crash in between only means the batch is archived again. Part files
+    are named after the records they hold, which makes that overwrite the
+    earlier copy instead of duplicating it.
+    """
+
+    def __init__(
+        self,
+        db,
+        directory: str,
+        collections: Dict[str, str],
+        max_age_days: float,
+        batch_size: int = 5000,
+        interval_seconds: float = 3600
+    ):
+        self.db = db
+        self.directory = Path(directory)
+        self.collections = collections
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.metrics = {"archived": 0, "batches": 0, "failures": 0}
+
+    async def setup(self):
+        for collection, time_field in self.collections.items():
+            await self.db[collection].create_index([(time_field, 1)])
+
+    async def run(self):
+        while True:
+            try:
+                archived = await self.archive()
+                if any(archived.values()):
+                    logger.info(f"Archived {archived}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics["failures"] += 1
+                logger.error(f"Log archival failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def archive(self) -> Dict[str, int]:
+        """Archive everything older than max_age_days, returning counts per collection"""
+        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+        return {collection: await self.archive_collection(collection, cutoff) for collection in self.collections}
+
+    async def archive_collection(self, collection: str, cutoff: datetime) -> int:
+        time_field = self.collections[collection]
+        archived = 0
+        while True:
+            records = await self.db[collection].find({time_field: {"$lt": cutoff}}).sort(
+                [(time_field, 1), ("_id", 1)]
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not records:
+                return archived
+            ids = [record.pop("_id") for record in records]
+            await asyncio.to_thread(self._write, collection, records)
+            await self.db[collection].delete_many({"_id": {"$in": ids}})
+            archived += len(records)
+            self.metrics["archived"] += len(records)
+            self.metrics["batches"] += 1
+            if len(records) < self.batch_size:
+                return archived
+
+    def _write(self, collection: str, records: List[Dict[str, Any]]):
+        time_field = self.collections[collection]
+        frame = pd.DataFrame.from_records(records)
+        frame[time_field] = pd.to_datetime(frame[time_field])
+        name = hashlib.blake2b("|".join(str(record.get("id")) for record in records).encode(), digest_size=12).hexdigest()
+        for day, part in frame.groupby(frame[time_field].dt.date):
+            partition = self._partition(collection, day)
+            partition.mkdir(parents=True, exist_ok=True)
+            path = partition / f"part-{name}.parquet"
+            # Readers never see half-written files
+            temporary = partition / f".{path.name}.{uuid.uuid4().hex}.tmp"
+            part.reset_index(drop=True).to_parquet(temporary, compression="zstd", index=False)
+            os.replace(temporary, path)
+
+    def _partition(self, collection: str, day: date) -> Path:
+        return self.directory / collection / f"date={day.isoformat()}"
+
+    def partitions(self, collection: str, start: Optional[date] = None, end: Optional[date] = None) -> List[Tuple[date, Path]]:
+        """Partitions of a collection between start and end inclusive, newest first"""
+        root = self.directory / collection
+        if not root.is_dir():
+            return []
+        partitions = []
+        for path in root.glob("date=*"):
+            try:
+                day = date.fromisoformat(path.name[len("date="):])
+            except ValueError:
+                continue
+            if (start is None or day >= start) and (end is None or day <= end):
+                partitions.append((day, path))
+        return sorted(partitions, reverse=True)
+
+    def query(
+        self,
+        collection: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        match: Optional[Dict[str, Any]] = None,
+        columns: Optional[Iterable[str]] = None,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Archived records in [start, end), newest first
+
+        Only partitions for dates in the range are opened, newest first, and
+        scanning stops once `limit` records matched. Blocking; run it in a
+        thread.
+        """
+        time_field = self.collections[collection]
+        match = match or {}
+        columns = None if columns is None else list(dict.fromkeys([*columns, time_field, *match]))
+        found: List[pd.DataFrame] = []
+        count = 0
+        for _, partition in self.partitions(collection, start.date() if start else None, end.date() if end else None):
+            for path in sorted(partition.glob("part-*.parquet")):
+                # Batches written at different times may not share all columns
+                available = pq.read_schema(path).names
+                frame = pd.read_parquet(path, columns=[column for column in columns if column in available] if columns else None)
+                mask = pd.Series(True, index=frame.index)
+                if start is not None:
+                    mask &= frame[time_field] >= start
+                if end is not None:
+                    mask &= frame[time_field] < end
+                for field, value in match.items():
+                    mask &= frame[field] == value if field in frame else False
+                frame = frame[mask]
+                if not frame.empty:
+                    found.append(frame)
+                    count += len(frame)
+            if count >= limit:
+                break
+        if not found:
+            return []
+        result = pd.concat(found).sort_values(time_field, ascending=False).head(limit)
+        result = result.astype(object).where(result.notna(), None)
+        return result.to_dict("records")
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Events after which we can no longer tell what changed
+FLUSH_EVENTS = {"drop", "rename", "dropDatabase", "invalidate"}
+
+
+class CacheInvalidator:
+    """Evicts cache entries on every instance when watched collections change
+
+    On a replica set each instance follows a change stream over the watched
+    collections and hands every event to the collection's handler. On a
+    standalone server, writers call bump() to increase a per-collection
+    version, and instances poll those versions and flush the whole cache for
+    a collection whose version moved. A handler receives the change event, or
+    None when everything cached for that collection must go.
+    """
+
+    def __init__(self, db, handlers: Dict[str, Callable[[Optional[dict]], None]], poll_interval_seconds: float = 1.0):
+        self.db = db
+        self.handlers = handlers
+        self.poll_interval_seconds = poll_interval_seconds
+        self.mode: Optional[str] = None
+        self.resume_token = None
+        self.metrics = {"events": 0, "flushes": 0, "stream_restarts": 0}
+        self._versions: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def detect_mode(self) -> str:
+        try:
+            hello = await self.db.client.admin.command("hello")
+        except Exception:
+            return "polling"
+        return "change_stream" if hello.get("setName") or hello.get("msg") == "isdbgrid" else "polling"
+
+    async def run(self):
+        self.mode = await self.detect_mode()
+        logger.info(f"Cache invalidation using {self.mode}")
+        if self.mode == "change_stream":
+            await self._follow_change_stream()
+        else:
+            await self._poll_versions()
+
+    async def bump(self, collection: str):
+        """Record a write to a watched collection (only needed without change streams)"""
+        if self.mode == "change_stream":
+            return
+        await self.db.cache_versions.update_one({"_id": collection}, {"$inc": {"version": 1}}, upsert=True)
+
+    def _flush(self, collection: Optional[str] = None):
+        self.metrics["flushes"] += 1
+        for name, handler in self.handlers.items():
+            if collection is None or name == collection:
+                handler(None)
+
+    async def _follow_change_stream(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.handlers)}}}]
+        while True:
+            try:
+                async with self.db.watch(pipeline, resume_after=self.resume_token) as stream:
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        self.metrics["events"] += 1
+                        collection = change.get("ns", {}).get("coll")
+                        if change["operationType"] in FLUSH_EVENTS:
+                            self._flush(collection)
+                        elif collection in self.handlers:
+                            self.handlers[collection](change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # ChangeStreamHistoryLost and friends: the token is too old to
+                # resume from, so start over with empty caches
+                logger.warning(f"Change stream cannot resume ({e}), restarting from now")
+                self.resume_token = None
+                self._flush()
+            except PyMongoError as e:
+                logger.warning(f"Change stream interrupted ({e}), resuming")
+            self.metrics["stream_restarts"] += 1
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    async def _poll_versions(self):
+        while True:
+            try:
+                versions = {collection: 0 for collection in self.handlers}
+                async for doc in self.db.cache_versions.find({"_id": {"$in": list(self.handlers)}}):
+                    versions[doc["_id"]] = doc.get("version", 0)
+                # The first read only establishes the baseline
+                for collection, version in versions.items():
+                    if collection in self._versions and self._versions[collection] != version:
+                        self.metrics["events"] += 1
+                        self._flush(collection)
+                self._versions = versions
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Cache version poll failed: {e}")
+            await asyncio.sleep(self.poll_interval_seconds)
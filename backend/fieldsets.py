@@ -0,0 +1,59 @@
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Type
+
+from pydantic import BaseModel, create_model
+
+
+@lru_cache(maxsize=256)
+def _trimmed_model(model: Type[BaseModel], fields: FrozenSet[str]) -> Type[BaseModel]:
+    # Keep the declared types and defaults of the selected fields only
+    return create_model(
+        f"{model.__name__}Fields",
+        **{name: (info.annotation, info) for name, info in model.model_fields.items() if name in fields}
+    )
+
+
+@lru_cache(maxsize=64)
+def partial_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """The model with every field optional, to document responses carrying any subset"""
+    return create_model(
+        f"{model.__name__}Partial",
+        **{name: (Optional[info.annotation], None) for name, info in model.model_fields.items()}
+    )
+
+
+class Fieldset:
+    """A `fields=` selection over a pydantic model
+
+    Maps the selection to a Mongo projection and to a model declaring only
+    those fields, so less is read, validated and serialized. Fields in
+    `always` (typically the id clients key on) are included whether or not
+    they were asked for. No selection means every field, as before.
+    """
+
+    def __init__(self, model: Type[BaseModel], fields: Optional[Iterable[str]] = None, always: Iterable[str] = ("id",)):
+        self.full_model = model
+        self.fields = None if fields is None else frozenset(fields) | frozenset(always)
+
+    @classmethod
+    def parse(cls, model: Type[BaseModel], value: Optional[str], always: Iterable[str] = ("id",)) -> "Fieldset":
+        """Parse a comma-separated list, raising ValueError for unknown fields"""
+        if not value:
+            return cls(model, always=always)
+        fields = {field.strip() for field in value.split(",") if field.strip()}
+        unknown = fields - set(model.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}; allowed: {', '.join(model.model_fields)}")
+        return cls(model, fields, always)
+
+    @property
+    def projection(self) -> Optional[Dict[str, Any]]:
+        if self.fields is None:
+            return None
+        return {"_id": 0, **{field: 1 for field in self.fields}}
+
+    @property
+    def model(self) -> Type[BaseModel]:
+        if self.fields is None:
+            return self.full_model
+        return _trimmed_model(self.full_model, self.fields)
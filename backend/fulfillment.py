@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentDeliveryError(Exception):
+    """Delivery failure that retrying cannot fix"""
+
+
+class ManualDeliveryRequired(Exception):
+    """Nothing to deliver automatically; an admin fulfills the purchase"""
+
+
+class LeaseLostError(Exception):
+    """The purchase was claimed by another worker in the meantime"""
+
+
+class FulfillmentWorker:
+    """Background worker that moves pending purchases to completed
+
+    Purchases are claimed in batches by stamping them with a lease. A purchase
+    whose lease expires (crashed or stuck worker) becomes claimable again, so
+    several workers can share the same collection safely. The lease is renewed
+    when a delivery starts and every third of lease_seconds while it runs, so
+    purchases queued behind the concurrency limit or slow deliveries aren't
+    reclaimed from under a live worker. Deliveries that
+    take several steps save their progress with checkpoint(), so a retry can
+    carry on where the last attempt stopped.
+    """
+
+    def __init__(
+        self,
+        purchases,
+        deliver: Callable[[Dict[str, Any]], Awaitable[None]],
+        batch_size: int = 50,
+        concurrency: int = 8,
+        lease_seconds: float = 60,
+        max_attempts: int = 5,
+        backoff_base_seconds: float = 5,
+        backoff_max_seconds: float = 900,
+        poll_interval_seconds: float = 5,
+        on_completed: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        stamp: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+    ):
+        self.purchases = purchases
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.on_completed = on_completed
+        # Extra fields to $set with every status change, e.g. a change sequence
+        self.stamp = stamp
+        self.worker_id = str(uuid.uuid4())
+        self.metrics = {
+            "batches": 0,
+            "claimed": 0,
+            "completed": 0,
+            "retried": 0,
+            "dead_lettered": 0,
+            "manual": 0,
+            "lease_lost": 0,
+            "last_batch_seconds": 0.0,
+            "delivery_seconds_total": 0.0,
+        }
+        self.in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """Wake the worker up early, e.g. right after a purchase is created"""
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Fulfillment batch failed: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                # Queue drained, wait for new work or the next poll
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def claim_batch(self) -> List[Dict[str, Any]]:
+        """Atomically lease up to batch_size claimable purchases"""
+        now = datetime.utcnow()
+        claimable = {
+            "$or": [
+                {"status": "pending", "next_attempt_at": {"$not": {"$gt": now}}},
+                {"status": "processing", "lease_expires_at": {"$lt": now}},
+            ]
+        }
+        candidates = await self.purchases.find(claimable, {"id": 1}).sort("created_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+
+        # The claimable filter is re-checked per document by update_many, so a
+        # purchase grabbed by another worker in the meantime is skipped
+        lease_id = f"{self.worker_id}:{uuid.uuid4()}"
+        await self.purchases.update_many(
+            {"id": {"$in": [c["id"] for c in candidates]}, **claimable},
+            {
+                "$set": await self._stamped({
+                    "status": "processing",
+                    "lease_owner": lease_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                }),
+                "$inc": {"attempts": 1},
+            }
+        )
+        return await self.purchases.find({"lease_owner": lease_id}).to_list(self.batch_size)
+
+    async def process_batch(self) -> int:
+        started = time.perf_counter()
+        claimed = await self.claim_batch()
+        if not claimed:
+            return 0
+        self.metrics["batches"] += 1
+        self.metrics["claimed"] += len(claimed)
+        await asyncio.gather(*(self._fulfill(purchase) for purchase in claimed))
+        self.metrics["last_batch_seconds"] = time.perf_counter() - started
+        return len(claimed)
+
+    async def _fulfill(self, purchase: Dict[str, Any]):
+        async with self._semaphore:
+            # The lease ran from claim time and may have expired in the queue;
+            # if another worker reclaimed the purchase since, it's theirs
+            if not await self.renew_lease(purchase):
+                self.metrics["lease_lost"] += 1
+                logger.warning(f"Lost lease on purchase {purchase['id']} before delivery")
+                return
+            started = time.perf_counter()
+            self.in_flight += 1
+            heartbeat = asyncio.create_task(self._heartbeat(purchase))
+            try:
+                await asyncio.wait_for(self.deliver(purchase), self.lease_seconds)
+            except ManualDeliveryRequired as e:
+                await self._hand_off(purchase, str(e))
+            except PermanentDeliveryError as e:
+                await self._fail(purchase, str(e), permanent=True)
+            except Exception as e:
+                await self._fail(purchase, str(e) or type(e).__name__, permanent=False)
+            else:
+                await self._complete(purchase)
+            finally:
+                heartbeat.cancel()
+                self.in_flight -= 1
+                self.metrics["delivery_seconds_total"] += time.perf_counter() - started
+
+    async def renew_lease(self, purchase: Dict[str, Any]) -> bool:
+        """Extend the lease on a purchase this worker holds, False if it's gone"""
+        result = await self.purchases.update_one(
+            self._owned(purchase),
+            {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+        )
+        return bool(result.matched_count)
+
+    async def _heartbeat(self, purchase: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self.renew_lease(purchase):
+                    # The delivery's next checkpoint stops it
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to renew lease on purchase {purchase['id']}: {e}")
+
+    async def _stamped(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {**fields, **await self.stamp()} if self.stamp is not None else fields
+
+    def _owned(self, purchase: Dict[str, Any]) -> Dict[str, Any]:
+        # Only the current lease holder may move the purchase forward
+        return {"id": purchase["id"], "status": "processing", "lease_owner": purchase["lease_owner"]}
+
+    async def checkpoint(self, purchase: Dict[str, Any], fields: Dict[str, Any], unset: Iterable[str] = ()):
+        """Save delivery progress on a purchase this worker is delivering
+
+        Raises LeaseLostError when the lease is gone, so the delivery stops
+        before sending anything the new holder will send as well.
+        """
+        update: Dict[str, Any] = {}
+        if fields:
+            update["$set"] = fields
+        if unset:
+            update["$unset"] = {field: "" for field in unset}
+        result = await self.purchases.update_one(self._owned(purchase), update)
+        if not result.matched_count:
+            raise LeaseLostError(f"Lost lease on purchase {purchase['id']}")
+
+    async def _complete(self, purchase: Dict[str, Any]):
+        result = await self.purchases.update_one(
+            self._owned(purchase),
+            {
+                "$set": await self._stamped({"status": "completed", "completed_at": datetime.utcnow()}),
+                "$unset": {"lease_owner": "", "lease_expires_at": "", "last_error": ""},
+            }
+        )
+        if result.modified_count:
+            self.metrics["completed"] += 1
+            if self.on_completed is not None:
+                try:
+                    await self.on_completed(purchase)
+                except Exception as e:
+                    logger.error(f"Post-completion hook failed for purchase {purchase['id']}: {e}")
+        else:
+            self.metrics["lease_lost"] += 1
+            logger.warning(f"Lost lease on purchase {purchase['id']} before completion")
+
+    async def _fail(self, purchase: Dict[str, Any], error: str, permanent: bool):
+        attempts = purchase.get("attempts", 1)
+        if permanent or attempts >= self.max_attempts:
+            update = {"status": "failed", "failed_at": datetime.utcnow(), "last_error": error}
+            metric = "dead_lettered"
+        else:
+            delay = min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            update = {
+                "status": "pending",
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+                "last_error": error,
+            }
+            metric = "retried"
+
+        result = await self.purchases.update_one(
+            self._owned(purchase),
+            {"$set": await self._stamped(update), "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        )
+        if result.modified_count:
+            self.metrics[metric] += 1
+            logger.warning(f"Fulfillment of purchase {purchase['id']} failed ({metric}): {error}")
+        else:
+            self.metrics["lease_lost"] += 1
+
+    async def _hand_off(self, purchase: Dict[str, Any], reason: str):
+        result = await self.purchases.update_one(
+            self._owned(purchase),
+            {
+                "$set": await self._stamped({"status": "manual", "last_error": reason}),
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            }
+        )
+        if result.modified_count:
+            self.metrics["manual"] += 1
+            logger.info(f"Purchase {purchase['id']} left for manual fulfillment: {reason}")
+        else:
+            self.metrics["lease_lost"] += 1
+
+    async def queue_counts(self) -> Dict[str, int]:
+        counts = await self.purchases.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        return {c["_id"]: c["count"] for c in counts}
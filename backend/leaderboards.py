@@ -0,0 +1,152 @@
+import asyncio
+import bisect
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TopK:
+    """The K highest-scoring entries, kept sorted by score then name
+
+    Entries are dicts with at least "id" and "name". Every operation is O(K)
+    at worst and independent of how many candidates exist overall.
+    """
+
+    def __init__(self, size: int, field: str):
+        self.size = size
+        self.field = field
+        self._keys: List[tuple] = []
+        self._entries: List[Dict[str, Any]] = []
+        self._by_id: Dict[str, tuple] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _sort_key(self, entry: Dict[str, Any]) -> tuple:
+        return (-entry.get(self.field, 0), entry.get("name", ""), entry["id"])
+
+    def offer(self, entry: Dict[str, Any]):
+        """Insert or update an entry; it is dropped if it doesn't make the top K"""
+        self.remove(entry["id"])
+        key = self._sort_key(entry)
+        if len(self._entries) >= self.size and key >= self._keys[-1]:
+            return
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._entries.insert(index, entry)
+        self._by_id[entry["id"]] = key
+        if len(self._entries) > self.size:
+            self._keys.pop()
+            dropped = self._entries.pop()
+            del self._by_id[dropped["id"]]
+
+    def remove(self, entry_id: str) -> bool:
+        key = self._by_id.pop(entry_id, None)
+        if key is None:
+            return False
+        index = bisect.bisect_left(self._keys, key)
+        del self._keys[index]
+        del self._entries[index]
+        return True
+
+    def get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        key = self._by_id.get(entry_id)
+        return self._entries[bisect.bisect_left(self._keys, key)] if key is not None else None
+
+    def replace(self, entries: List[Dict[str, Any]]):
+        ranked = sorted(entries, key=self._sort_key)[:self.size]
+        self._keys = [self._sort_key(entry) for entry in ranked]
+        self._entries = ranked
+        self._by_id = dict(zip((entry["id"] for entry in ranked), self._keys))
+
+    def rank_of(self, entry_id: str) -> Optional[int]:
+        key = self._by_id.get(entry_id)
+        return bisect.bisect_left(self._keys, key) + 1 if key is not None else None
+
+    def page(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        return [
+            {**entry, "rank": rank}
+            for rank, entry in enumerate(self._entries[offset:offset + limit], start=offset + 1)
+        ]
+
+
+class Leaderboards:
+    """Top-K user rankings per counter field on the users collection
+
+    Boards are seeded from an indexed sort on each field, updated in place as
+    the counters change in this process and re-seeded periodically to pick
+    up changes made by other workers.
+    """
+
+    def __init__(self, users, fields: Dict[str, str], size: int = 100, refresh_interval_seconds: float = 30, extra_fields: tuple = ()):
+        self.users = users
+        self.fields = fields
+        self.size = size
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.projection = {"_id": 0, "id": 1, "minecraft_username": 1, **{field: 1 for field in fields.values()}, **{field: 1 for field in extra_fields}}
+        self.boards = {metric: TopK(size, field) for metric, field in fields.items()}
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def setup(self):
+        for field in self.fields.values():
+            await self.users.create_index([(field, -1)])
+
+    def _entry(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {key: user.get(key) for key in self.projection if key != "_id"}
+        entry["name"] = user.get("minecraft_username", "")
+        for field in self.fields.values():
+            entry[field] = entry.get(field) or 0
+        return entry
+
+    async def refresh(self):
+        for metric, field in self.fields.items():
+            users = await self.users.find({field: {"$gt": 0}}, self.projection).sort(field, -1).limit(self.size).to_list(self.size)
+            self.boards[metric].replace([self._entry(user) for user in users])
+
+    def update(self, user: Dict[str, Any], metrics: Iterable[str]):
+        """Re-rank a user on the boards whose counters changed"""
+        entry = self._entry(user)
+        for metric in metrics:
+            board = self.boards[metric]
+            if entry[board.field] > 0:
+                board.offer(dict(entry))
+
+    def remove(self, user_id: str):
+        removed = [board.remove(user_id) for board in self.boards.values()]
+        # A board that lost an entry is short until the next refresh fills it
+        if any(removed):
+            self._refresh_soon()
+
+    def _refresh_soon(self):
+        async def refresh():
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh leaderboards: {e}")
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(refresh())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval_seconds)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to refresh leaderboards: {e}")
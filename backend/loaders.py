@@ -0,0 +1,92 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class DataLoader:
+    """Batches and memoizes lookups of documents by key for one request
+
+    Keys requested during the same event-loop tick are fetched together with a
+    single $in query; every key is fetched at most once, later loads reuse the
+    result (None for missing documents). Returned documents are shared between
+    callers and must not be mutated.
+    """
+
+    def __init__(self, collection, key_field: str = "id", projection: Optional[Dict[str, Any]] = None):
+        self.collection = collection
+        self.key_field = key_field
+        self.projection = projection
+        self.queries = 0
+        self._results: Dict[Any, asyncio.Future] = {}
+        self._queue: List[Any] = []
+
+    async def load(self, key) -> Optional[Dict[str, Any]]:
+        future = self._results.get(key)
+        if future is None:
+            future = self._results[key] = asyncio.get_running_loop().create_future()
+            if not self._queue:
+                asyncio.get_running_loop().call_soon(self._dispatch)
+            self._queue.append(key)
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable) -> List[Optional[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key, document: Optional[Dict[str, Any]]):
+        """Record a document the caller already has, replacing any cached one"""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(document)
+        self._results[key] = future
+
+    def clear(self, key=None):
+        if key is None:
+            self._results = {key: future for key, future in self._results.items() if not future.done()}
+        elif key in self._results and self._results[key].done():
+            del self._results[key]
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        asyncio.ensure_future(self._fetch(keys))
+
+    async def _fetch(self, keys: List[Any]):
+        self.queries += 1
+        try:
+            documents = await self.collection.find({self.key_field: {"$in": keys}}, self.projection).to_list(None)
+        except Exception as e:
+            for key in keys:
+                future = self._results.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                    # Callers re-raise it; don't log it again as unretrieved
+                    future.exception()
+            return
+        found = {document[self.key_field]: document for document in documents}
+        for key in keys:
+            future = self._results.get(key)
+            if future is not None and not future.done():
+                future.set_result(found.get(key))
+
+
+class Loaders:
+    """The loaders available to one request, created on first use"""
+
+    def __init__(self, db):
+        self.db = db
+        self._loaders: Dict[str, DataLoader] = {}
+
+    def _loader(self, collection: str) -> DataLoader:
+        loader = self._loaders.get(collection)
+        if loader is None:
+            loader = self._loaders[collection] = DataLoader(self.db[collection])
+        return loader
+
+    @property
+    def users(self) -> DataLoader:
+        return self._loader("users")
+
+    @property
+    def shop_items(self) -> DataLoader:
+        return self._loader("shop_items")
+
+    @property
+    def purchases(self) -> DataLoader:
+        return self._loader("purchases")
@@ -0,0 +1,202 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+# Id of the request being handled, set by RequestLogMiddleware. Tasks
+# started while handling a request inherit it.
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra` fields of the record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def add_request_id(record: logging.LogRecord) -> bool:
+    if getattr(record, "request_id", None) is None:
+        record.request_id = request_id.get()
+    return True
+
+
+class BackgroundLogHandler(logging.handlers.QueueHandler):
+    """Hands records to a writer thread instead of writing them in the caller
+
+    The queue is bounded: when the writer falls behind, records are dropped
+    and counted rather than stalling the event loop.
+    """
+
+    def __init__(self, output: logging.Handler, max_queued: int = 10000):
+        super().__init__(queue.Queue(max_queued))
+        self.listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=True)
+        self.metrics = Counter()
+        self._running = False
+
+    def start(self):
+        self.listener.start()
+        self._running = True
+
+    def stop(self):
+        """Write out what is queued and stop the writer thread"""
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now, while the arguments and the
+        # exception are still what they were when logged
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.metrics["dropped"] += 1
+        else:
+            self.metrics["queued"] += 1
+
+
+def configure_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    filename: Optional[str] = None,
+    max_queued: int = 10000
+) -> Optional[BackgroundLogHandler]:
+    """Replace the root handlers, returning the background handler if any
+
+    Output goes to `filename`, or stderr. With max_queued 0 records are
+    written synchronously by the logging thread. Uvicorn's loggers are sent
+    through the same handler, except its access log, which
+    RequestLogMiddleware replaces.
+    """
+    output = logging.handlers.WatchedFileHandler(filename) if filename else logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    handler: logging.Handler = output
+    background = None
+    if max_queued > 0:
+        background = handler = BackgroundLogHandler(output, max_queued)
+        background.start()
+        atexit.register(background.stop)
+    handler.addFilter(add_request_id)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    for name in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(name).handlers.clear()
+        logging.getLogger(name).propagate = True
+    access = logging.getLogger("uvicorn.access")
+    access.handlers.clear()
+    access.propagate = False
+    return background
+
+
+class RequestLogMiddleware:
+    """ASGI middleware giving each request an id and logging it with its timing
+
+    The id is taken from a well-formed X-Request-ID header or generated, and
+    returned in the response headers. Failed requests (status >= 400) and
+    ones slower than slow_ms are always logged; the rest, the bulk of the
+    volume, only at sample_rate.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = 1.0,
+        slow_ms: float = 1000,
+        logger_name: str = "access",
+        metrics: Optional[Counter] = None
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.logger = logging.getLogger(logger_name)
+        # Counts of "logged" and "sampled_out" requests
+        self.metrics = Counter() if metrics is None else metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"x-request-id"), "")
+        current_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        token = request_id.set(current_id)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", current_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if status >= 400 or duration_ms >= self.slow_ms or random.random() < self.sample_rate:
+                self.metrics["logged"] += 1
+                route = scope.get("route")
+                self.logger.log(
+                    logging.ERROR if status >= 500 else logging.INFO,
+                    f"{scope['method']} {scope['path']} {status} {duration_ms:.1f} ms",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "route": route.path if route is not None else None,
+                        "status": status,
+                        "duration_ms": round(duration_ms, 3),
+                    }
+                )
+            else:
+                self.metrics["sampled_out"] += 1
+            request_id.reset(token)
@@ -0,0 +1,322 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow pings
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for counters and gauges holding one value per label tuple
+
+    When a callback is given, values are read from it at scrape time instead;
+    it returns a single value, or a dict of label tuples to values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), callback: Optional[Callable] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        values = self._values
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        for labels, value in list(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, labels: Tuple = ()):
+        self._values[labels] = value
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """Histogram safe to observe from any thread
+
+    pymongo's listeners observe from Motor's worker threads, so updates and
+    reads of the series hold a lock.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label tuple: [non-cumulative bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple = ()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, labels: Tuple = ()):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]!r}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = (), callback: Optional[Callable] = None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (), callback: Optional[Callable] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+)
+mongo_command_duration = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection", "outcome")
+)
+mojang_request_duration = registry.histogram(
+    "mojang_request_duration_seconds", "Mojang API request latency", ("endpoint", "outcome")
+)
+minecraft_status_duration = registry.histogram(
+    "minecraft_status_ping_duration_seconds", "Minecraft server status ping latency", ("outcome",)
+)
+mongo_pool_checkout_wait = registry.histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection", ("address", "outcome")
+)
+mongo_ping_duration = registry.histogram(
+    "mongo_ping_duration_seconds", "MongoDB ping round trip latency", ("outcome",)
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            # The router stores the matched route on the scope; using its path
+            # template keeps label cardinality bounded
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                (scope["method"], route.path if route is not None else "unmatched", status)
+            )
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Record MongoDB command latencies
+
+    Motor runs pymongo in worker threads, so the map of in-flight commands
+    is guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            with self._lock:
+                self._collections[event.request_id] = collection
+
+    def _record(self, event, outcome: str):
+        with self._lock:
+            collection = self._collections.pop(event.request_id, "")
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, (event.command_name, collection, outcome))
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+
+
+def _address(address) -> str:
+    return f"{address[0]}:{address[1]}"
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Track pool occupancy and how long callers wait to check out a connection
+
+    Checkouts happen on the calling thread, so the wait is timed from a
+    thread-local start time. stats() summarizes each pool by server address.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pools: Dict[str, Dict[str, float]] = {}
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {address: dict(pool) for address, pool in self._pools.items()}
+
+    def _pool(self, address) -> Dict[str, float]:
+        pool = self._pools.get(_address(address))
+        if pool is None:
+            pool = self._pools[_address(address)] = {
+                "open": 0, "in_use": 0, "checkouts": 0, "checkout_failures": 0,
+                "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            }
+        return pool
+
+    def _checked_out(self, address, outcome: str):
+        started = getattr(self._local, "started", None)
+        waited = time.perf_counter() - started if started is not None else 0.0
+        self._local.started = None
+        with self._lock:
+            pool = self._pool(address)
+            if outcome == "success":
+                pool["checkouts"] += 1
+                pool["in_use"] += 1
+                pool["wait_seconds_total"] += waited
+            else:
+                pool["checkout_failures"] += 1
+            pool["wait_seconds_max"] = max(pool["wait_seconds_max"], waited)
+        mongo_pool_checkout_wait.observe(waited, (_address(address), outcome))
+
+    def _count(self, address, field: str, amount: int):
+        with self._lock:
+            self._pool(address)[field] += amount
+
+    def pool_created(self, event):
+        self._count(event.address, "open", 0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count(event.address, "open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event.address, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._checked_out(event.address, event.reason)
+
+    def connection_checked_out(self, event):
+        self._checked_out(event.address, "success")
+
+    def connection_checked_in(self, event):
+        self._count(event.address, "in_use", -1)
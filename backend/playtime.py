@@ -0,0 +1,144 @@
+import logging
+import re
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import InsertOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+FORMATTING_CODE = re.compile("§.")
+CHECKPOINT_ID = "playtime"
+
+
+def parse_player_list(response: str) -> List[str]:
+    """Player names from the output of the RCON list command
+
+    Handles vanilla ("There are 2 of a max of 20 players online: a, b") and
+    servers that group players per line ("default: a, b").
+    """
+    names = []
+    for line in FORMATTING_CODE.sub("", response).splitlines():
+        if ":" not in line:
+            continue
+        names.extend(name.strip() for name in line.split(":", 1)[1].split(","))
+    return [name for name in names if name]
+
+
+class PlaytimeTracker:
+    """Turns successive online-player snapshots into sessions and playtime totals
+
+    Only the difference between two snapshots is written: a session document
+    is created when a player appears and closed when they disappear, adding
+    its length to the player's playtime document. The open sessions are kept
+    in memory and restored from the playtime documents when a new process
+    takes over, so history is never replayed.
+    """
+
+    def __init__(self, db, max_gap_seconds: float):
+        self.sessions = db.player_sessions
+        self.playtime = db.player_playtime
+        self.events = db.player_events
+        self.checkpoints = db.tracker_checkpoints
+        self.max_gap_seconds = max_gap_seconds
+        self.online: Dict[str, Dict[str, Any]] = {}
+        self.metrics = {"joins": 0, "leaves": 0}
+
+    async def setup(self):
+        await self.playtime.create_index("player", unique=True)
+        await self.playtime.create_index([("total_seconds", -1)])
+        await self.playtime.create_index("online_since", sparse=True)
+        await self.sessions.create_index([("player", 1), ("started_at", -1)])
+        await self.events.create_index([("at", -1)])
+        await self.events.create_index([("player", 1), ("at", -1)])
+
+    async def load(self):
+        """Restore the open sessions left by the previous tracker"""
+        self.online = {}
+        async for doc in self.playtime.find({"online_since": {"$exists": True}}, {"player": 1, "uuid": 1, "session_id": 1, "online_since": 1}):
+            self.online[doc["player"]] = {"session_id": doc.get("session_id"), "uuid": doc.get("uuid"), "started_at": doc["online_since"]}
+        checkpoint = await self.checkpoints.find_one({"_id": CHECKPOINT_ID})
+        if self.online and checkpoint is not None:
+            observed_at = checkpoint["observed_at"]
+            # Nobody watched the server for a while, end those sessions when we last saw them
+            if (datetime.utcnow() - observed_at).total_seconds() > self.max_gap_seconds:
+                await self.observe([], observed_at)
+
+    async def observe(self, players: List[Dict[str, Optional[str]]], at: Optional[datetime] = None):
+        """Record a snapshot of the players online; [] means nobody (or the server is down)"""
+        at = at or datetime.utcnow()
+        current = {player["name"]: player for player in players}
+        joined = [name for name in current if name not in self.online]
+        left = [name for name in self.online if name not in current]
+
+        session_writes, playtime_writes, events = [], [], []
+        for name in joined:
+            session_id = str(uuid.uuid4())
+            player_uuid = current[name].get("uuid")
+            self.online[name] = {"session_id": session_id, "uuid": player_uuid, "started_at": at}
+            session_writes.append(InsertOne({"id": session_id, "player": name, "uuid": player_uuid, "started_at": at, "ended_at": None}))
+            playtime_writes.append(UpdateOne(
+                {"player": name},
+                {
+                    "$set": {"uuid": player_uuid, "online_since": at, "session_id": session_id, "last_seen": at},
+                    "$setOnInsert": {"total_seconds": 0, "sessions": 0, "first_seen": at},
+                },
+                upsert=True
+            ))
+            events.append({"id": str(uuid.uuid4()), "type": "join", "player": name, "uuid": player_uuid, "at": at})
+        for name in left:
+            session = self.online.pop(name)
+            seconds = max(0.0, (at - session["started_at"]).total_seconds())
+            if session["session_id"]:
+                session_writes.append(UpdateOne({"id": session["session_id"]}, {"$set": {"ended_at": at, "duration_seconds": seconds}}))
+            playtime_writes.append(UpdateOne(
+                {"player": name},
+                {
+                    "$inc": {"total_seconds": seconds, "sessions": 1},
+                    "$set": {"last_seen": at},
+                    "$unset": {"online_since": "", "session_id": ""},
+                }
+            ))
+            events.append({"id": str(uuid.uuid4()), "type": "leave", "player": name, "uuid": session["uuid"], "at": at, "duration_seconds": seconds})
+
+        if session_writes:
+            await self.sessions.bulk_write(session_writes, ordered=False)
+        if playtime_writes:
+            await self.playtime.bulk_write(playtime_writes, ordered=False)
+        if events:
+            await self.events.insert_many(events, ordered=False)
+        await self.checkpoints.update_one({"_id": CHECKPOINT_ID}, {"$set": {"observed_at": at}}, upsert=True)
+        self.metrics["joins"] += len(joined)
+        self.metrics["leaves"] += len(left)
+        return joined, left
+
+    async def leaderboard(self, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """Players ranked by playtime, counting sessions still in progress"""
+        now = datetime.utcnow()
+        projection = {"_id": 0, "player": 1, "uuid": 1, "total_seconds": 1, "sessions": 1, "online_since": 1, "last_seen": 1}
+        # Stored totals are exact for offline players; anyone online may have
+        # overtaken them, so consider all of those too
+        candidates = {}
+        async for doc in self.playtime.find({}, projection).sort("total_seconds", -1).limit(offset + limit):
+            candidates[doc["player"]] = doc
+        async for doc in self.playtime.find({"online_since": {"$exists": True}}, projection):
+            candidates[doc["player"]] = doc
+
+        entries = []
+        for doc in candidates.values():
+            online_since = doc.get("online_since")
+            total = doc.get("total_seconds", 0) + (max(0.0, (now - online_since).total_seconds()) if online_since else 0)
+            entries.append({
+                "player": doc["player"],
+                "uuid": doc.get("uuid"),
+                "total_seconds": round(total),
+                "sessions": doc.get("sessions", 0) + (1 if online_since else 0),
+                "online": online_since is not None,
+                "last_seen": doc.get("last_seen"),
+            })
+        entries.sort(key=lambda entry: (-entry["total_seconds"], entry["player"]))
+        page = entries[offset:offset + limit]
+        for rank, entry in enumerate(page, start=offset + 1):
+            entry["rank"] = rank
+        return page
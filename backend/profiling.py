@@ -0,0 +1,196 @@
+import asyncio
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+PROFILE_HEADER = b"x-profile"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame) -> List[str]:
+    """Frames of a running thread from the event loop callback down to the leaf"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        # Everything above the handle that resumed the task is loop machinery
+        if code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+            break
+        frames.append(_frame_label(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_stack(task: asyncio.Task) -> List[str]:
+    """Frames of a suspended task, following the chain of awaited coroutines"""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None) or getattr(awaitable, "ag_frame", None)
+        if frame is None:
+            frames.append(f"[await {type(awaitable).__name__}]")
+            break
+        frames.append(_frame_label(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None) or getattr(awaitable, "ag_await", None)
+    return frames
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.duration_ms: Optional[float] = None
+        self.status: Optional[int] = None
+        self.samples: Counter = Counter()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "sample_count": sum(self.samples.values()),
+        }
+
+    def folded(self) -> str:
+        """Samples in the collapsed-stack format read by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for selected requests
+
+    A background thread wakes every interval and, for each request being
+    profiled, records either the stack the event loop is executing for it or,
+    while it is suspended, the chain of coroutines it is awaiting on (Mongo,
+    RCON, ...). Requests that are not selected pay only a random() call.
+    """
+
+    def __init__(self, interval_seconds: float = 0.002, max_profiles: int = 50):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.interval_seconds = interval_seconds
+        self.header_token: Optional[str] = None
+        self.profiles = deque(maxlen=max_profiles)
+        self._active: Dict[asyncio.Task, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, enabled: bool, sample_rate: float, interval_seconds: Optional[float] = None, max_profiles: Optional[int] = None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        if interval_seconds is not None:
+            self.interval_seconds = interval_seconds
+        if max_profiles is not None and max_profiles != self.profiles.maxlen:
+            self.profiles = deque(self.profiles, maxlen=max_profiles)
+        if enabled and self.header_token is None:
+            self.header_token = secrets.token_urlsafe(16)
+        if not enabled:
+            self.header_token = None
+        if enabled and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+            self._thread.start()
+
+    def select(self, headers) -> Optional[str]:
+        """Return why a request should be profiled, or None"""
+        if not self.enabled:
+            return None
+        if self.header_token is not None:
+            for name, value in headers:
+                if name == PROFILE_HEADER and secrets.compare_digest(value.decode("latin-1"), self.header_token):
+                    return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def begin(self, profile: RequestProfile):
+        task = asyncio.current_task()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        with self._lock:
+            self._active[task] = profile
+
+    def end(self, profile: RequestProfile, duration_seconds: float, status: int):
+        with self._lock:
+            for task, active in list(self._active.items()):
+                if active is profile:
+                    del self._active[task]
+        profile.duration_ms = round(duration_seconds * 1000, 3)
+        profile.status = status
+        self.profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def _sample_loop(self):
+        while self.enabled:
+            time.sleep(self.interval_seconds)
+            with self._lock:
+                if not self._active:
+                    continue
+                active = list(self._active.items())
+            running = asyncio.current_task(self._loop) if self._loop is not None else None
+            thread_frame = sys._current_frames().get(self._loop_thread_id)
+            for task, profile in active:
+                try:
+                    if task is running and thread_frame is not None:
+                        stack = _thread_stack(thread_frame)
+                    else:
+                        stack = _await_stack(task) + ["[waiting]"]
+                except Exception:
+                    # The task moved on while we were walking its frames
+                    continue
+                if stack:
+                    profile.samples[";".join(stack)] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that runs selected requests under the sampling profiler"""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        trigger = self.profiler.select(scope["headers"]) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger)
+        started = time.perf_counter()
+        self.profiler.begin(profile)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.profiler.end(profile, time.perf_counter() - started, status)
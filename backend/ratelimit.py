@@ -0,0 +1,161 @@
+import asyncio
+import ipaddress
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class RateLimited(Exception):
+    def __init__(self, rule: str, retry_after_seconds: float):
+        super().__init__(f"Rate limit {rule} exceeded")
+        self.rule = rule
+        self.retry_after_seconds = retry_after_seconds
+
+
+def parse_networks(addresses: Iterable[str]) -> List[Network]:
+    """Networks from addresses or CIDR ranges, e.g. "10.0.0.0/8" """
+    return [ipaddress.ip_network(address.strip(), strict=False) for address in addresses if address.strip()]
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str], trusted_proxies: Sequence[Network]) -> str:
+    """The address of the client behind any trusted proxies
+
+    X-Forwarded-For is only believed when the peer is a trusted proxy.
+    Each proxy appends the address it got the request from, so the header
+    is read right to left, skipping trusted proxies; the first other
+    address is the client. Anything left of it could be made up by the
+    client and is ignored.
+    """
+    if peer is None:
+        return "unknown"
+    address = peer
+    hops = [hop.strip() for hop in forwarded_for.split(",")] if forwarded_for else []
+    while address_in(address, trusted_proxies) and hops:
+        address = hops.pop()
+    return address
+
+
+def address_in(address: str, networks: Sequence[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+class Rule:
+    """Allow `burst` requests at once, refilling at `rate_per_second`"""
+
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+
+    @property
+    def refill_seconds(self) -> float:
+        """Time for an empty bucket to fill up again"""
+        return self.burst / self.rate_per_second
+
+
+class TokenBuckets:
+    """Token buckets for one rule, one [tokens, updated_at] pair per key
+
+    A bucket that has refilled completely is equivalent to no bucket, so
+    sweep() drops those; state is proportional to the clients seen within
+    one refill period.
+    """
+
+    def __init__(self, rule: Rule, max_keys: int = 100000):
+        self.rule = rule
+        self.max_keys = max_keys
+        self._buckets: Dict[str, List[float]] = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key: str, cost: float = 1, now: Optional[float] = None) -> float:
+        """Take tokens, returning 0 if allowed or the seconds to wait otherwise"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self.sweep(now)
+            bucket = self._buckets[key] = [self.rule.burst, now]
+        else:
+            bucket[0] = min(self.rule.burst, bucket[0] + (now - bucket[1]) * self.rule.rate_per_second)
+            bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / self.rule.rate_per_second
+
+    def sweep(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        refill = self.rule.refill_seconds
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < refill}
+        if len(self._buckets) >= self.max_keys:
+            # Still full of active clients: forget the least recently seen half
+            recent = sorted(self._buckets.items(), key=lambda item: item[1][1])[len(self._buckets) // 2:]
+            self._buckets = dict(recent)
+
+
+class RateLimiter:
+    """Per-rule token buckets kept in memory, optionally backed by a shared store
+
+    The in-memory check always runs first, so most rejections cost a dict
+    lookup. With a shared store, requests that pass locally are also charged
+    against a bucket shared by all workers.
+    """
+
+    def __init__(self, rules: Dict[str, Rule], shared_store=None, sweep_interval_seconds: float = 60):
+        self.rules = rules
+        self.shared_store = shared_store
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.buckets = {name: TokenBuckets(rule) for name, rule in rules.items()}
+        self.metrics: Dict[Tuple[str, str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _count(self, rule: str, outcome: str):
+        self.metrics[(rule, outcome)] = self.metrics.get((rule, outcome), 0) + 1
+
+    async def check(self, rule_name: str, key: str, cost: float = 1):
+        """Charge a request to a key, raising RateLimited if its bucket is empty"""
+        wait = self.buckets[rule_name].take(key, cost)
+        if wait == 0 and self.shared_store is not None:
+            rule = self.rules[rule_name]
+            try:
+                wait = await self.shared_store.take_tokens(f"ratelimit:{rule_name}:{key}", rule.rate_per_second, rule.burst, cost)
+            except Exception as e:
+                # Fall back to the local limit rather than failing requests
+                logger.error(f"Shared rate limit check failed: {e}")
+        if wait > 0:
+            self._count(rule_name, "rejected")
+            raise RateLimited(rule_name, wait)
+        self._count(rule_name, "allowed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval_seconds)
+            for buckets in self.buckets.values():
+                buckets.sweep()
+            if self.shared_store is not None:
+                try:
+                    await self.shared_store.sweep_tokens()
+                except Exception as e:
+                    logger.error(f"Failed to sweep shared rate limit buckets: {e}")
@@ -0,0 +1,261 @@
+import asyncio
+import itertools
+import logging
+import struct
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Source RCON packet types as used by Minecraft
+PACKET_RESPONSE = 0
+PACKET_COMMAND = 2
+PACKET_AUTH = 3
+# Minecraft answers unknown packet types with "Unknown request", which is
+# used to mark the end of a fragmented response
+PACKET_SENTINEL = 200
+
+# Minecraft splits responses into packets of at most this many body bytes
+MAX_FRAGMENT_SIZE = 4096
+
+
+class RconError(Exception):
+    """RCON connection or protocol failure"""
+
+
+class RconUnavailable(RconError):
+    """No usable RCON connection; the command was not sent"""
+
+
+class RconAuthError(RconUnavailable):
+    """RCON password rejected"""
+
+
+class RconTimeout(RconError):
+    """No RCON response within the command timeout"""
+
+
+def encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+async def read_packet(reader: asyncio.StreamReader):
+    """Read one packet and return (request_id, packet_type, body)"""
+    length, = struct.unpack("<i", await reader.readexactly(4))
+    if length < 10:
+        raise RconError(f"Invalid packet length {length}")
+    data = await reader.readexactly(length)
+    request_id, packet_type = struct.unpack("<ii", data[:8])
+    return request_id, packet_type, data[8:-2].decode("utf-8", errors="replace")
+
+
+class RconConnection:
+    """One authenticated RCON connection with pipelined requests
+
+    Commands are written as soon as they are submitted and matched to their
+    responses by request id, so many commands can be in flight at once.
+    """
+
+    def __init__(self, host: str, port: int, password: str, connect_timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.connect_timeout = connect_timeout
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._fragments: Dict[int, List[str]] = {}
+        self._sentinels: Dict[int, int] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self.closed = True
+        self.retired = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.connect_timeout
+        )
+        auth_id = next(self._ids)
+        self._writer.write(encode_packet(auth_id, PACKET_AUTH, self.password))
+        await self._writer.drain()
+        while True:
+            request_id, packet_type, _ = await asyncio.wait_for(read_packet(self._reader), self.connect_timeout)
+            # Some servers send an empty RESPONSE_VALUE before the auth response
+            if packet_type == PACKET_COMMAND:
+                break
+        if request_id == -1:
+            self._writer.close()
+            raise RconAuthError("RCON authentication failed")
+        self.closed = False
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def submit(self, commands: List[str]) -> List[asyncio.Future]:
+        """Queue commands on this connection in a single write"""
+        if self.closed:
+            raise RconUnavailable("Connection closed")
+        loop = asyncio.get_running_loop()
+        futures = []
+        buffer = bytearray()
+        for command in commands:
+            request_id = next(self._ids)
+            future = loop.create_future()
+            self._pending[request_id] = future
+            self._fragments[request_id] = []
+            futures.append((request_id, future))
+            buffer += encode_packet(request_id, PACKET_COMMAND, command)
+        for request_id, future in futures:
+            future.add_done_callback(lambda _, request_id=request_id: self._forget(request_id))
+        self._writer.write(bytes(buffer))
+        await self._writer.drain()
+        return [future for _, future in futures]
+
+    def _forget(self, request_id: int):
+        self._pending.pop(request_id, None)
+        self._fragments.pop(request_id, None)
+        if self.retired and not self._pending and not self.closed:
+            self._fail_all(RconError("Connection retired"))
+
+    def retire(self):
+        """Stop taking new commands and close once in-flight ones finish"""
+        self.retired = True
+        if not self._pending and not self.closed:
+            self._fail_all(RconError("Connection retired"))
+
+    def _resolve(self, request_id: int):
+        future = self._pending.get(request_id)
+        if future is not None and not future.done():
+            future.set_result("".join(self._fragments.get(request_id, [])))
+
+    async def _read_loop(self):
+        try:
+            while True:
+                request_id, _, body = await read_packet(self._reader)
+                if request_id in self._sentinels:
+                    self._resolve(self._sentinels.pop(request_id))
+                    continue
+                if request_id not in self._pending:
+                    # Late answer to a command that already timed out
+                    continue
+                # Responses come back in request order, so an answer to a later
+                # request means every earlier one is complete
+                for earlier in [r for r in self._pending if r < request_id]:
+                    self._resolve(earlier)
+                self._fragments[request_id].append(body)
+                if len(body.encode("utf-8")) < MAX_FRAGMENT_SIZE:
+                    self._resolve(request_id)
+                elif request_id == max(self._pending):
+                    # A full-size fragment may be followed by more; the sentinel
+                    # reply tells us when the response is over
+                    sentinel_id = next(self._ids)
+                    self._sentinels[sentinel_id] = request_id
+                    self._writer.write(encode_packet(sentinel_id, PACKET_SENTINEL, ""))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self.closed:
+                logger.warning(f"RCON connection to {self.host}:{self.port} lost: {e}")
+            self._fail_all(RconError(f"Connection lost: {e}"))
+        else:
+            self._fail_all(RconError("Connection closed"))
+
+    def _fail_all(self, error: Exception):
+        self.closed = True
+        for future in list(self._pending.values()):
+            if not future.done():
+                future.set_exception(error)
+        self._sentinels.clear()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+            self._read_task = None
+        self._fail_all(RconError("Connection closed"))
+
+
+class RconPool:
+    """Pool of persistent RCON connections that reconnects on demand"""
+
+    def __init__(self, host: str, port: int, password: str, size: int = 2, timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self._connections: List[RconConnection] = []
+        self._connect_lock = asyncio.Lock()
+        self.metrics = {"commands": 0, "errors": 0, "timeouts": 0, "reconnects": 0}
+
+    @property
+    def in_flight(self) -> int:
+        return sum(c.in_flight for c in self._connections)
+
+    async def _acquire(self) -> RconConnection:
+        self._connections = [c for c in self._connections if not (c.closed or c.retired)]
+        idle = [c for c in self._connections if c.in_flight == 0]
+        if idle or len(self._connections) >= self.size:
+            return min(self._connections, key=lambda c: c.in_flight)
+        async with self._connect_lock:
+            if len(self._connections) < self.size:
+                connection = RconConnection(self.host, self.port, self.password, self.timeout)
+                try:
+                    await connection.connect()
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    raise RconUnavailable(f"Cannot connect to RCON at {self.host}:{self.port}: {e}")
+                self.metrics["reconnects"] += 1
+                self._connections.append(connection)
+        return min(self._connections, key=lambda c: c.in_flight)
+
+    async def execute_many(self, commands: List[str]) -> List[str]:
+        """Pipeline commands over one connection and return their responses
+
+        Each command gets `timeout` seconds from the reply before it, so a
+        long pipeline isn't held to the budget of a single command. Raises
+        RconUnavailable if the commands could not be sent, else RconError if
+        any of them got no answer, in which case it may or may not have run.
+        Commands are only ever sent once, since game commands are not safe
+        to replay.
+        """
+        if not commands:
+            return []
+        try:
+            connection = await self._acquire()
+            futures = await connection.submit(commands)
+        except (RconError, OSError) as e:
+            self.metrics["errors"] += 1
+            raise e if isinstance(e, RconError) else RconError(str(e))
+        self.metrics["commands"] += len(commands)
+        try:
+            # Commands are answered in order, so each deadline starts when the
+            # previous answer arrived
+            return [await asyncio.wait_for(future, self.timeout) for future in futures]
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            # A late response would hold up everything queued behind it, so
+            # later commands go to a fresh connection instead
+            connection.retire()
+            raise RconTimeout(f"No RCON response within {self.timeout}s")
+        except RconError:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            # Nobody waits for the answers after a failure
+            for future in futures:
+                future.cancel()
+
+    async def execute(self, command: str) -> str:
+        return (await self.execute_many([command]))[0]
+
+    async def close(self):
+        for connection in self._connections:
+            await connection.close()
+        self._connections = []
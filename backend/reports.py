@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Tuple, Type
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, ValidationError
+
+logger = logging.getLogger(__name__)
+
+Columns = Dict[str, List[Any]]
+
+
+def _week_start(times: pd.Series) -> pd.Series:
+    return times.dt.normalize() - pd.to_timedelta(times.dt.weekday, unit="D")
+
+
+def _rate(count: int, total: int) -> float:
+    return round(count / total, 4) if total else 0.0
+
+
+# Reports. They run in worker processes, so they take and return plain data:
+# the columns read from each source collection and the params as a dict.
+
+class RetentionParams(BaseModel):
+    weeks: int = Field(12, ge=1, le=52)
+    # Monday of the last week reported, this week by default
+    as_of: Optional[date] = None
+
+
+def retention_cohorts(data: Dict[str, Columns], params: Dict[str, Any]) -> Dict[str, Any]:
+    """Share of each weekly signup cohort logging in again 0, 1, 2... weeks later
+
+    Logins archived out of Mongo aren't counted, so weeks further back than
+    the archive age show lower retention than they had.
+    """
+    weeks = params["weeks"]
+    as_of = pd.Timestamp(params["as_of"])
+    users = pd.DataFrame(data["users"])
+    logins = pd.DataFrame(data["login_logs"])
+    users["cohort"] = _week_start(pd.to_datetime(users["created_at"]))
+    logins["week"] = _week_start(pd.to_datetime(logins["login_time"]))
+    sizes = users.groupby("cohort").size()
+
+    active = logins.merge(users[["id", "cohort"]], left_on="user_id", right_on="id")
+    active["offset"] = (active["week"] - active["cohort"]).dt.days // 7
+    active = active[(active["offset"] >= 0) & (active["offset"] < weeks)].drop_duplicates(["user_id", "offset"])
+    counts = active.groupby(["cohort", "offset"]).size().unstack(fill_value=0)
+    counts = counts.reindex(index=sizes.index, columns=range(weeks), fill_value=0).to_numpy()
+    rates = counts / sizes.to_numpy()[:, np.newaxis]
+
+    cohorts = []
+    for index, (cohort, size) in enumerate(sizes.items()):
+        # Weeks that have started for this cohort, the current one included
+        observed = min(weeks, (as_of - cohort).days // 7 + 1)
+        cohorts.append({
+            "cohort": cohort.date().isoformat(),
+            "users": int(size),
+            "active": counts[index, :observed].astype(int).tolist(),
+            "retention": np.round(rates[index, :observed], 4).tolist(),
+        })
+    return {"weeks": weeks, "as_of": as_of.date().isoformat(), "cohorts": cohorts}
+
+
+class RevenueParams(BaseModel):
+    interval: Literal["day", "week", "month"] = "week"
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+
+PERIOD_FREQUENCIES = {"day": "D", "week": "W", "month": "M"}
+
+
+def revenue_by_category(data: Dict[str, Columns], params: Dict[str, Any]) -> Dict[str, Any]:
+    """Completed purchase revenue and count per shop category and period"""
+    purchases = pd.DataFrame(data["purchases"])
+    items = pd.DataFrame(data["shop_items"])
+    # Purchases completed before completed_at was recorded count when made
+    completed_at = pd.to_datetime(purchases["completed_at"]).fillna(pd.to_datetime(purchases["created_at"]))
+    in_range = pd.Series(True, index=purchases.index)
+    if params.get("start") is not None:
+        in_range &= completed_at >= pd.Timestamp(params["start"])
+    if params.get("end") is not None:
+        in_range &= completed_at < pd.Timestamp(params["end"])
+    purchases = purchases[in_range]
+    completed_at = completed_at[in_range]
+    if purchases.empty:
+        return {"interval": params["interval"], "periods": [], "categories": [], "total_revenue": 0.0, "total_purchases": 0}
+
+    frequency = PERIOD_FREQUENCIES[params["interval"]]
+    periods = completed_at.dt.to_period(frequency)
+    # Purchases of items since deleted from the shop
+    categories = purchases["item_id"].map(dict(zip(items["id"], items["category"]))).fillna("Unknown")
+    grouped = purchases["price"].astype(float).groupby([periods, categories]).agg(["sum", "count"])
+    all_periods = pd.period_range(periods.min(), periods.max(), freq=frequency)
+    revenue = grouped["sum"].unstack(fill_value=0.0).reindex(all_periods, fill_value=0.0)
+    count = grouped["count"].unstack(fill_value=0).reindex(all_periods, fill_value=0)
+
+    order = revenue.sum().sort_values(ascending=False).index
+    return {
+        "interval": params["interval"],
+        "periods": [period.start_time.date().isoformat() for period in all_periods],
+        "categories": [
+            {
+                "category": category,
+                "revenue": revenue[category].round(2).tolist(),
+                "purchases": count[category].astype(int).tolist(),
+                "total_revenue": round(float(revenue[category].sum()), 2),
+                "total_purchases": int(count[category].sum()),
+            }
+            for category in order
+        ],
+        "total_revenue": round(float(revenue.to_numpy().sum()), 2),
+        "total_purchases": int(count.to_numpy().sum()),
+    }
+
+
+class FunnelParams(BaseModel):
+    # Users who signed up in [start, end), everyone by default
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+
+def purchase_funnel(data: Dict[str, Columns], params: Dict[str, Any]) -> Dict[str, Any]:
+    """How many users who signed up went on to order, complete an order and order again"""
+    users = pd.DataFrame(data["users"])
+    purchases = pd.DataFrame(data["purchases"])
+    purchases = purchases[purchases["user_id"].isin(users["id"])]
+    completed = purchases[purchases["status"] == "completed"].groupby("user_id").size()
+    stages = [
+        ("registered", len(users)),
+        ("ordered", int(purchases["user_id"].nunique())),
+        ("purchased", int((completed >= 1).sum())),
+        ("repeat_purchased", int((completed >= 2).sum())),
+    ]
+    return {
+        "stages": [
+            {
+                "stage": stage,
+                "users": users_at_stage,
+                "rate": _rate(users_at_stage, stages[0][1]),
+                "from_previous": _rate(users_at_stage, stages[index - 1][1]) if index else 1.0,
+            }
+            for index, (stage, users_at_stage) in enumerate(stages)
+        ],
+        "purchases_by_status": {status: int(count) for status, count in purchases["status"].value_counts().items()},
+    }
+
+
+class Report:
+    """A report: its params, the fields it reads and the function computing it
+
+    `query` turns the params into a Mongo filter per source collection.
+    """
+
+    def __init__(
+        self,
+        params: Type[BaseModel],
+        sources: Dict[str, Tuple[str, ...]],
+        compute: Callable[[Dict[str, Columns], Dict[str, Any]], Dict[str, Any]],
+        query: Optional[Callable[[BaseModel], Dict[str, dict]]] = None
+    ):
+        self.params = params
+        self.sources = sources
+        self.compute = compute
+        self.query = query or (lambda params: {})
+
+
+def _time_range(field: str, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = start
+    if end is not None:
+        bounds["$lt"] = end
+    return {field: bounds} if bounds else {}
+
+
+def _retention_query(params: RetentionParams) -> Dict[str, dict]:
+    first_week = datetime.combine(params.as_of, datetime.min.time()) - timedelta(weeks=params.weeks - 1)
+    return {"users": {"created_at": {"$gte": first_week}}, "login_logs": {"login_time": {"$gte": first_week}}}
+
+
+REPORTS = {
+    "retention_cohorts": Report(
+        RetentionParams,
+        {"users": ("id", "created_at"), "login_logs": ("user_id", "login_time")},
+        retention_cohorts,
+        _retention_query
+    ),
+    "revenue_by_category": Report(
+        RevenueParams,
+        {"purchases": ("item_id", "price", "created_at", "completed_at"), "shop_items": ("id", "category")},
+        revenue_by_category,
+        # A purchase completed in the range was created before its end
+        lambda params: {"purchases": {"status": "completed", **_time_range("created_at", None, params.end)}}
+    ),
+    "purchase_funnel": Report(
+        FunnelParams,
+        {"users": ("id", "created_at"), "purchases": ("user_id", "status")},
+        purchase_funnel,
+        lambda params: {"users": _time_range("created_at", params.start, params.end)}
+    ),
+}
+
+
+class ReportJobs:
+    """Runs reports in the background and keeps their results until the data changes
+
+    A job reads its projected source collections from `source_db` a batch at
+    a time into columns, then computes the report in a worker process, so
+    neither the reading nor the number crunching holds up the event loop for
+    long. Jobs and results live in `jobs`, shared by all app processes.
+
+    Each job records the version of its data: the highest sync_seq and the
+    document count of `stamped` collections, whose writes are stamped by the
+    change feed, and a digest of the (small) other ones. Submitting a report
+    again returns the job with the same params and data version, finished
+    or not, instead of starting another.
+    """
+
+    def __init__(
+        self,
+        jobs,
+        source_db,
+        reports: Dict[str, Report],
+        stamped: Iterable[str] = (),
+        max_workers: int = 2,
+        batch_size: int = 5000,
+        timeout_seconds: float = 600,
+        result_ttl_seconds: float = 30 * 24 * 3600
+    ):
+        self.jobs = jobs
+        self.source_db = source_db
+        self.reports = reports
+        self.stamped = set(stamped)
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.timeout_seconds = timeout_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        # (report, outcome) -> count
+        self.metrics: Counter = Counter()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(max_workers)
+        self._tasks: set = set()
+
+    async def setup(self):
+        await self.jobs.create_index("id", unique=True)
+        await self.jobs.create_index([("key", 1), ("submitted_at", -1)])
+        await self.jobs.create_index("finished_at", expireAfterSeconds=int(self.result_ttl_seconds))
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking would copy the locks of our threads in whatever state
+            # they are in, so workers start fresh
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def parse(self, kind: str, params: Dict[str, Any]) -> BaseModel:
+        """Validated params of a report, raising ValueError for unknown reports or bad params"""
+        if kind not in self.reports:
+            raise ValueError(f"Unknown report {kind}; available: {', '.join(self.reports)}")
+        try:
+            parsed = self.reports[kind].params(**params)
+        except ValidationError as e:
+            raise ValueError("; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+        if isinstance(parsed, RetentionParams) and parsed.as_of is None:
+            today = datetime.utcnow().date()
+            parsed.as_of = today - timedelta(days=today.weekday())
+        return parsed
+
+    async def data_version(self, report: Report) -> Dict[str, Any]:
+        version = {}
+        for collection, fields in report.sources.items():
+            source = self.source_db[collection]
+            if collection in self.stamped:
+                # Writes move the highest sequence number, deletes the count
+                latest = await source.find({"sync_seq": {"$exists": True}}, {"_id": 0, "sync_seq": 1}).sort("sync_seq", -1).limit(1).to_list(1)
+                version[collection] = [latest[0]["sync_seq"] if latest else 0, await source.estimated_document_count()]
+            else:
+                digest = hashlib.blake2b(digest_size=12)
+                async for doc in source.find({}, {"_id": 0, **{field: 1 for field in fields}}).sort(fields[0], 1):
+                    digest.update(json.dumps(doc, sort_keys=True, default=str).encode())
+                version[collection] = digest.hexdigest()
+        return version
+
+    def _expired(self, job: dict) -> bool:
+        return job["status"] in ("queued", "running") and job["submitted_at"] < datetime.utcnow() - timedelta(seconds=self.timeout_seconds)
+
+    async def submit(self, kind: str, params: Dict[str, Any], submitted_by: Optional[str] = None) -> dict:
+        """The job computing a report, an existing one when its data hasn't changed"""
+        parsed = self.parse(kind, params)
+        report = self.reports[kind]
+        params = parsed.model_dump(mode="json")
+        key = f"{kind}:{json.dumps(params, sort_keys=True)}"
+        version = await self.data_version(report)
+        existing = await self.jobs.find_one(
+            {"key": key, "data_version": version, "status": {"$in": ["queued", "running", "completed"]}},
+            {"_id": 0},
+            sort=[("submitted_at", -1)]
+        )
+        if existing is not None and not self._expired(existing):
+            self.metrics[(kind, "reused")] += 1
+            if existing["status"] == "completed":
+                existing["current"] = True
+            return existing
+
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "params": params,
+            "key": key,
+            "data_version": version,
+            "status": "queued",
+            "submitted_by": submitted_by,
+            "submitted_at": datetime.utcnow(),
+        }
+        await self.jobs.insert_one(dict(job))
+        task = asyncio.create_task(self._run(job, report, parsed))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await self.jobs.find_one({"id": job_id}, {"_id": 0})
+        if job is None:
+            return None
+        if self._expired(job):
+            # Its process died or it is stuck; submitting again starts over
+            job.update(status="failed", error="Timed out", finished_at=datetime.utcnow())
+            await self.jobs.update_one({"id": job_id}, {"$set": {"status": "failed", "error": "Timed out", "finished_at": job["finished_at"]}})
+        if job["status"] == "completed":
+            job["current"] = job["data_version"] == await self.data_version(self.reports[job["kind"]])
+        return job
+
+    async def _load(self, report: Report, params: BaseModel) -> Dict[str, Columns]:
+        queries = report.query(params)
+        data = {}
+        for collection, fields in report.sources.items():
+            columns: Columns = {field: [] for field in fields}
+            cursor = self.source_db[collection].find(
+                queries.get(collection, {}),
+                {"_id": 0, **{field: 1 for field in fields}},
+                batch_size=self.batch_size
+            )
+            while True:
+                batch = await cursor.to_list(self.batch_size)
+                if not batch:
+                    break
+                for field, values in columns.items():
+                    values.extend([doc.get(field) for doc in batch])
+            data[collection] = columns
+        return data
+
+    async def _run(self, job: dict, report: Report, params: BaseModel):
+        async with self._slots:
+            started = time.perf_counter()
+            await self.jobs.update_one({"id": job["id"]}, {"$set": {"status": "running", "started_at": datetime.utcnow()}})
+            try:
+                data = await self._load(report, params)
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor(), report.compute, data, params.model_dump()
+                )
+            except asyncio.CancelledError:
+                await self.jobs.update_one({"id": job["id"]}, {"$set": {"status": "failed", "error": "Cancelled", "finished_at": datetime.utcnow()}})
+                raise
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # A worker died (e.g. out of memory); start afresh next time
+                    self._pool = None
+                logger.error(f"Report {job['kind']} ({job['id']}) failed: {e}")
+                self.metrics[(job["kind"], "failed")] += 1
+                await self.jobs.update_one({"id": job["id"]}, {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}})
+                return
+            duration = time.perf_counter() - started
+            self.metrics[(job["kind"], "completed")] += 1
+            await self.jobs.update_one({"id": job["id"]}, {"$set": {
+                "status": "completed",
+                "result": result,
+                "finished_at": datetime.utcnow(),
+                "duration_ms": round(duration * 1000, 1),
+            }})
@@ -1,41 +1,263 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import PlainTextResponse, FileResponse, RedirectResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Callable
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
 import bcrypt
 from mcstatus import JavaServer
 import requests
 import json
 import base64
+import re
+import math
 import asyncio
+import time
 from contextlib import asynccontextmanager
+from collections import Counter
 from bson import ObjectId
+from fulfillment import FulfillmentWorker, ManualDeliveryRequired, PermanentDeliveryError
+from rcon import RconPool, RconError, RconUnavailable
+from metrics import registry, MetricsMiddleware, MongoCommandListener, MongoPoolListener, mojang_request_duration, minecraft_status_duration, mongo_ping_duration
+from profiling import SamplingProfiler, ProfilingMiddleware
+from logs import configure_logging, RequestLogMiddleware
+from shared_state import create_shared_store, LeaderElector
+from cache_sync import CacheInvalidator
+from admission import AdmissionController, AdmissionMiddleware, Budget
+from ratelimit import RateLimiter, RateLimited, Rule, address_in, client_address, parse_networks
+from tokens import TokenVerifier, TokenRevocations
+from playtime import PlaytimeTracker, parse_player_list
+from leaderboards import Leaderboards
+from loaders import Loaders
+from fieldsets import Fieldset, partial_model
+from archive import LogArchiver
+from analytics import AnalyticsReads
+from reports import ReportJobs, REPORTS
+from anomalies import ServerMonitor
+from sync import ChangeFeed
+from sketches import ActiveUserSketches
+from skins import SkinStore, SkinError, texture_hash_from_url, TEXTURE_HASH_PATTERN
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Logging: JSON lines (LOG_FORMAT=text for the old format) written by a
+# background thread from a queue of at most LOG_QUEUE_SIZE records, beyond
+# which records are dropped; 0 writes synchronously. Successful requests are
+# logged at ACCESS_LOG_SAMPLE_RATE, failed and slow ones always.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_FILE = os.environ.get('LOG_FILE') or None
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', '0.05'))
+ACCESS_LOG_SLOW_MS = float(os.environ.get('ACCESS_LOG_SLOW_MS', '1000'))
+request_log_metrics: Counter = Counter()
+log_handler = configure_logging(LOG_LEVEL, json_format=LOG_FORMAT == 'json', filename=LOG_FILE, max_queued=LOG_QUEUE_SIZE)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Pool settings, see the pymongo MongoClient documentation. Compressors must
+# also be enabled on the server, e.g. MONGO_COMPRESSORS="zstd,zlib".
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "maxIdleTimeMS": int(os.environ['MONGO_MAX_IDLE_TIME_MS']) if os.environ.get('MONGO_MAX_IDLE_TIME_MS') else None,
+    "waitQueueTimeoutMS": int(os.environ['MONGO_WAIT_QUEUE_TIMEOUT_MS']) if os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS') else None,
+    "compressors": os.environ.get('MONGO_COMPRESSORS') or None,
+}
+# Connections opened at startup, so the first requests don't pay for them
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get('MONGO_WARMUP_CONNECTIONS', str(min(MONGO_MAX_POOL_SIZE, max(MONGO_MIN_POOL_SIZE, 10)))))
+mongo_pool_listener = MongoPoolListener()
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=[MongoCommandListener(), mongo_pool_listener],
+    **{option: value for option, value in MONGO_POOL_OPTIONS.items() if value is not None}
+)
 db = client[os.environ['DB_NAME']]
 
+# Admin analytics read through a client of their own, so their connections
+# never hold up logins and purchases, and from secondaries when MongoDB runs
+# as a replica set (secondaryPreferred reads the primary otherwise)
+ANALYTICS_MONGO_URL = os.environ.get('ANALYTICS_MONGO_URL', mongo_url)
+ANALYTICS_READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+ANALYTICS_MAX_POOL_SIZE = int(os.environ.get('ANALYTICS_MAX_POOL_SIZE', '10'))
+# Budget of each analytics query; over it, the last good result or a
+# cheaper estimate is returned
+ANALYTICS_MAX_TIME_MS = int(os.environ.get('ANALYTICS_MAX_TIME_MS', '2000'))
+ANALYTICS_MAX_STALE_SECONDS = float(os.environ.get('ANALYTICS_MAX_STALE_SECONDS', '3600'))
+analytics_pool_listener = MongoPoolListener()
+analytics_client = AsyncIOMotorClient(
+    ANALYTICS_MONGO_URL,
+    event_listeners=[MongoCommandListener(), analytics_pool_listener],
+    readPreference=ANALYTICS_READ_PREFERENCE,
+    maxPoolSize=ANALYTICS_MAX_POOL_SIZE,
+    **{option: value for option, value in MONGO_POOL_OPTIONS.items() if value is not None and option in ("maxIdleTimeMS", "compressors")}
+)
+analytics_db = analytics_client[os.environ['DB_NAME']]
+
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-here')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
+# Verified tokens are remembered until they expire, up to this many
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', '10000'))
+# Authenticated requests update last_seen at most this often per user
+LAST_SEEN_WRITE_INTERVAL_SECONDS = float(os.environ.get('LAST_SEEN_WRITE_INTERVAL_SECONDS', '60'))
 
 # Minecraft server configuration
-MC_SERVER_IP = "91.197.6.209"
-MC_SERVER_PORT = 25598
+MC_SERVER_IP = os.environ.get('MC_SERVER_IP', "91.197.6.209")
+MC_SERVER_PORT = int(os.environ.get('MC_SERVER_PORT', '25598'))
+STATUS_POLL_INTERVAL_SECONDS = float(os.environ.get('STATUS_POLL_INTERVAL_SECONDS', '15'))
+# Anomaly detection on status polls, see ServerMonitor
+ANOMALY_EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA', '0.1'))
+ANOMALY_LATENCY_ZSCORE = float(os.environ.get('ANOMALY_LATENCY_ZSCORE', '4'))
+ANOMALY_LATENCY_MIN_MS = float(os.environ.get('ANOMALY_LATENCY_MIN_MS', '50'))
+ANOMALY_PLAYER_DROP_FRACTION = float(os.environ.get('ANOMALY_PLAYER_DROP_FRACTION', '0.5'))
+ANOMALY_PLAYER_DROP_MIN = int(os.environ.get('ANOMALY_PLAYER_DROP_MIN', '3'))
+ANOMALY_WARMUP_SAMPLES = int(os.environ.get('ANOMALY_WARMUP_SAMPLES', '20'))
+SERVER_EVENTS_MAX_LIMIT = 500
+PLAYTIME_LEADERBOARD_MAX_LIMIT = 100
+PLAYTIME_LEADERBOARD_MAX_OFFSET = 10000
+RCON_HOST = os.environ.get('RCON_HOST', MC_SERVER_IP)
+RCON_PORT = int(os.environ.get('RCON_PORT', '25575'))
+RCON_PASSWORD = os.environ.get('RCON_PASSWORD', '')
+RCON_POOL_SIZE = int(os.environ.get('RCON_POOL_SIZE', '2'))
+RCON_TIMEOUT_SECONDS = float(os.environ.get('RCON_TIMEOUT_SECONDS', '5'))
+
+# Mojang API configuration
+MOJANG_API_URL = os.environ.get('MOJANG_API_URL', "https://api.mojang.com")
+MOJANG_SESSION_URL = os.environ.get('MOJANG_SESSION_URL', "https://sessionserver.mojang.com")
+
+# Skin proxy configuration
+SKIN_TEXTURE_URL = os.environ.get('SKIN_TEXTURE_URL', "https://textures.minecraft.net/texture")
+SKIN_CACHE_DIR = os.environ.get('SKIN_CACHE_DIR', str(ROOT_DIR / 'skin_cache'))
+SKIN_CACHE_MAX_BYTES = int(os.environ.get('SKIN_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+SKIN_LOOKUP_TTL_SECONDS = float(os.environ.get('SKIN_LOOKUP_TTL_SECONDS', '600'))
+SKIN_MAX_TEXTURE_BYTES = 1024 * 1024
+SKIN_HEAD_SIZES = (16, 32, 64, 128)
+
+# Log records older than ARCHIVE_MAX_AGE_DAYS move to Parquet files under
+# ARCHIVE_DIR, partitioned by the time field of their collection
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'true').lower() == 'true'
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'archive'))
+ARCHIVE_MAX_AGE_DAYS = float(os.environ.get('ARCHIVE_MAX_AGE_DAYS', '90'))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '5000'))
+ARCHIVE_QUERY_MAX_LIMIT = 1000
+ARCHIVE_COLLECTIONS = {"login_logs": "login_time", "server_logs": "timestamp", "commands": "executed_at"}
+# Fields archive queries can match on, per collection
+ARCHIVE_MATCH_FIELDS = {
+    "login_logs": ("user_id", "minecraft_username"),
+    "server_logs": (),
+    "commands": ("executed_by", "status"),
+}
+
+# Shop catalog configuration
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '60'))
+SHOP_IMPORT_BATCH_SIZE = 1000
+SHOP_IMPORT_MAX_ERRORS = 1000
+
+# User lookups in get_current_user are cached until a change to the user is seen
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '300'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+# Updates touching only these fields don't evict cached users
+USER_ACTIVITY_FIELDS = {"last_seen", "last_login", "login_count", "purchase_count", "total_spent", "sync_seq", "synced_at"}
+CACHE_VERSION_POLL_SECONDS = float(os.environ.get('CACHE_VERSION_POLL_SECONDS', '1'))
+
+# Active user estimates
+ACTIVITY_SKETCH_FLUSH_SECONDS = float(os.environ.get('ACTIVITY_SKETCH_FLUSH_SECONDS', '10'))
+ACTIVITY_SKETCH_RETENTION_DAYS = 400
+
+# Leaderboards, counters kept on the user documents
+LEADERBOARD_FIELDS = {"logins": "login_count", "purchases": "purchase_count", "spend": "total_spent"}
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '100'))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '30'))
+
+# Command history configuration
+COMMAND_HISTORY_FIELDS = {"_id": 0, "id": 1, "command": 1, "executed_by": 1, "executed_at": 1, "status": 1, "error": 1, "duration_ms": 1}
+COMMAND_HISTORY_MAX_LIMIT = 200
+
+# Delta sync for the admin panel
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', '5'))
+SYNC_TOMBSTONE_TTL_SECONDS = float(os.environ.get('SYNC_TOMBSTONE_TTL_SECONDS', str(7 * 24 * 3600)))
+SYNC_MAX_LIMIT = 1000
+
+# Report jobs, computed in REPORT_WORKERS worker processes
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '2'))
+REPORT_BATCH_SIZE = int(os.environ.get('REPORT_BATCH_SIZE', '5000'))
+REPORT_TIMEOUT_SECONDS = float(os.environ.get('REPORT_TIMEOUT_SECONDS', '600'))
+REPORT_RESULT_TTL_SECONDS = float(os.environ.get('REPORT_RESULT_TTL_SECONDS', str(30 * 24 * 3600)))
+
+# Purchase fulfillment configuration
+FULFILLMENT_ENABLED = os.environ.get('FULFILLMENT_ENABLED', 'true').lower() == 'true'
+FULFILLMENT_BATCH_SIZE = int(os.environ.get('FULFILLMENT_BATCH_SIZE', '50'))
+FULFILLMENT_CONCURRENCY = int(os.environ.get('FULFILLMENT_CONCURRENCY', '8'))
+FULFILLMENT_LEASE_SECONDS = float(os.environ.get('FULFILLMENT_LEASE_SECONDS', '60'))
+FULFILLMENT_MAX_ATTEMPTS = int(os.environ.get('FULFILLMENT_MAX_ATTEMPTS', '5'))
+
+# Multi-worker coordination
+# "mongo", "file:///dev/shm/terra" or "redis://host:6379/0"
+SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL', 'mongo')
+LEADER_LEASE_SECONDS = float(os.environ.get('LEADER_LEASE_SECONDS', '15'))
+
+# Admission control: concurrency, wait queue size and queueing deadline per
+# class of work, overridable with e.g. ADMISSION_PUBLIC="64,256,0.5"
+ADMISSION_CONTROL_ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+ADMISSION_DEFAULTS = {
+    "public": (64, 256, 0.5),
+    "authenticated": (64, 256, 2),
+    "admin": (8, 32, 10),
+    "background": (16, 1000, 60),
+}
+
+def admission_budget(name: str, defaults: tuple) -> Budget:
+    override = os.environ.get(f'ADMISSION_{name.upper()}')
+    concurrency, queue, timeout = override.split(",") if override else defaults
+    return Budget(name, int(concurrency), int(queue), float(timeout))
+
+admission = AdmissionController({name: admission_budget(name, defaults) for name, defaults in ADMISSION_DEFAULTS.items()})
+
+# Rate limiting: requests per minute and burst size per rule, overridable with
+# e.g. RATE_LIMIT_LOGIN_IP="20,10". RATE_LIMIT_SHARED also charges every
+# request to buckets in the shared store, so limits hold across workers.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_SHARED = os.environ.get('RATE_LIMIT_SHARED', 'false').lower() == 'true'
+# Reverse proxies in front of the app, as addresses or CIDR ranges. Rate
+# limits key on the client address they pass in X-Forwarded-For; from
+# anyone else the header is ignored.
+TRUSTED_PROXIES = parse_networks(os.environ.get('TRUSTED_PROXIES', '').split(','))
+RATE_LIMIT_DEFAULTS = {
+    "login_ip": (20, 10),
+    "login_username": (6, 3),
+    "public_ip": (600, 100),
+}
+
+def rate_limit_rule(name: str, defaults: tuple) -> Rule:
+    override = os.environ.get(f'RATE_LIMIT_{name.upper()}')
+    per_minute, burst = override.split(",") if override else defaults
+    return Rule(float(per_minute) / 60, float(burst))
+
+# Addresses or CIDR ranges that may read /metrics and /api/health/db
+# without an admin token, e.g. Prometheus or the load balancer. Empty by
+# default: behind a proxy on the same host every request would come from
+# a local address.
+INTERNAL_ALLOWED_IPS = parse_networks(os.environ.get('INTERNAL_ALLOWED_IPS', '').split(','))
+
+# Request profiling
+profiler = SamplingProfiler()
 
 # Security
 security = HTTPBearer()
@@ -54,6 +276,12 @@ class User(BaseModel):
     ip_address: Optional[str] = None
     user_agent: Optional[str] = None
 
+class TokenUser(BaseModel):
+    """Who a request is from, as stated by its access token"""
+    id: str
+    minecraft_username: str
+    is_admin: bool = False
+
 class UserCreate(BaseModel):
     minecraft_username: str
 
@@ -68,10 +296,24 @@ class ServerStats(BaseModel):
     latency: Optional[float] = None
     last_updated: datetime = Field(default_factory=datetime.utcnow)
 
+class ReportRequest(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+
 class AdminCommand(BaseModel):
     command: str
     executed_by: str
     executed_at: datetime = Field(default_factory=datetime.utcnow)
+    status: Optional[str] = None  # logged, completed, failed, unconfirmed
+    response: Optional[str] = None
+    error: Optional[str] = None
+    duration_ms: Optional[float] = None
+
+class ProfilingConfig(BaseModel):
+    enabled: bool
+    sample_rate: float = Field(0.0, ge=0, le=1)
+    interval_ms: float = Field(2, ge=0.5, le=1000)
+    max_profiles: int = Field(50, ge=1, le=1000)
 
 class ShopItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -80,6 +322,7 @@ class ShopItem(BaseModel):
     price: float
     category: str
     image_url: Optional[str] = None
+    delivery_commands: List[str] = []
     in_stock: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -89,6 +332,11 @@ class ShopItemCreate(BaseModel):
     price: float
     category: str
     image_url: Optional[str] = None
+    delivery_commands: List[str] = []
+
+class ShopItemImport(ShopItemCreate):
+    id: Optional[str] = None
+    in_stock: Optional[bool] = None
 
 class Purchase(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -96,8 +344,12 @@ class Purchase(BaseModel):
     item_id: str
     item_name: str
     price: float
-    status: str = "pending"  # pending, completed, cancelled
+    status: str = "pending"  # pending, processing, completed, failed, manual, cancelled
+    attempts: int = 0
+    commands_sent: int = 0
+    last_error: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
 
 class LoginLog(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -115,6 +367,137 @@ class ServerLog(BaseModel):
     latency: float
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
+# Caches
+class TTLCache:
+    """Small in-process cache with per-entry expiry"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Any, tuple] = {}
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        if len(self._entries) >= self.max_entries and key not in self._entries:
+            # Drop the entry closest to expiry to make room
+            oldest = min(self._entries, key=lambda k: self._entries[k][0])
+            del self._entries[oldest]
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Any], bool]):
+        for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+            del self._entries[key]
+
+catalog_cache = TTLCache(ttl_seconds=CATALOG_CACHE_TTL_SECONDS)
+status_cache = TTLCache(ttl_seconds=min(2, STATUS_POLL_INTERVAL_SECONDS))
+user_cache = TTLCache(ttl_seconds=USER_CACHE_TTL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES)
+playtime_cache = TTLCache(ttl_seconds=min(30, STATUS_POLL_INTERVAL_SECONDS * 2))
+# Player uuid -> texture hash, "" when the player has no custom skin
+skin_lookup_cache = TTLCache(ttl_seconds=SKIN_LOOKUP_TTL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES)
+# User id -> True while their last_seen was written recently
+last_seen_writes = TTLCache(ttl_seconds=LAST_SEEN_WRITE_INTERVAL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES)
+token_verifier = TokenVerifier(JWT_SECRET, JWT_ALGORITHM, max_entries=AUTH_TOKEN_CACHE_MAX_ENTRIES)
+caches = {"catalog": catalog_cache, "status": status_cache, "user": user_cache, "skin_lookup": skin_lookup_cache, "playtime": playtime_cache, "auth_token": token_verifier}
+
+analytics_reads = AnalyticsReads(max_time_ms=ANALYTICS_MAX_TIME_MS, max_stale_seconds=ANALYTICS_MAX_STALE_SECONDS)
+
+# Tokens carry their user's token_version; bumping it and recording a
+# revocation rejects tokens issued before the change
+token_revocations = TokenRevocations(db.token_revocations, token_ttl_seconds=JWT_EXPIRATION_HOURS * 3600)
+
+def model_projection(model) -> Dict[str, int]:
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+# Writes to these collections are stamped with change_feed.stamp(), deletes
+# leave a tombstone, so the admin panel can fetch only what changed
+change_feed = ChangeFeed(
+    db,
+    {
+        "users": model_projection(User),
+        "purchases": model_projection(Purchase),
+        "login_logs": model_projection(LoginLog),
+        "commands": COMMAND_HISTORY_FIELDS,
+    },
+    settle_seconds=SYNC_SETTLE_SECONDS,
+    tombstone_ttl_seconds=SYNC_TOMBSTONE_TTL_SECONDS
+)
+
+# Heavy analytics, read from the analytics client and computed off the event
+# loop; results are reused until the change feed shows their data changed
+report_jobs = ReportJobs(
+    db.report_jobs,
+    analytics_db,
+    REPORTS,
+    stamped=change_feed.collections,
+    max_workers=REPORT_WORKERS,
+    batch_size=REPORT_BATCH_SIZE,
+    timeout_seconds=REPORT_TIMEOUT_SECONDS,
+    result_ttl_seconds=REPORT_RESULT_TTL_SECONDS
+)
+
+def on_users_change(change: Optional[dict]):
+    if change is None:
+        user_cache.invalidate()
+        return
+    if change["operationType"] == "update":
+        description = change.get("updateDescription", {})
+        if not description.get("removedFields") and set(description.get("updatedFields", {})) <= USER_ACTIVITY_FIELDS:
+            return
+    # Change events only carry the _id, cached entries are keyed by our id
+    object_id = change["documentKey"]["_id"]
+    user_cache.invalidate_where(lambda user: user["_id"] == object_id)
+
+def on_shop_items_change(change: Optional[dict]):
+    catalog_cache.invalidate()
+
+cache_invalidator = CacheInvalidator(
+    db,
+    {
+        "users": on_users_change,
+        "shop_items": on_shop_items_change,
+        "token_revocations": lambda change: token_revocations.reload_soon()
+    },
+    poll_interval_seconds=CACHE_VERSION_POLL_SECONDS
+)
+
+# Distinct active users per day, for DAU/WAU/MAU
+activity_sketches = ActiveUserSketches(
+    db.activity_sketches,
+    flush_interval_seconds=ACTIVITY_SKETCH_FLUSH_SECONDS,
+    retention_days=ACTIVITY_SKETCH_RETENTION_DAYS
+)
+
+leaderboards = Leaderboards(
+    db.users,
+    LEADERBOARD_FIELDS,
+    size=LEADERBOARD_SIZE,
+    refresh_interval_seconds=LEADERBOARD_REFRESH_SECONDS,
+    extra_fields=("last_login", "last_seen", "created_at")
+)
+
+# Shared state and leader election across worker processes
+shared_store = create_shared_store(SHARED_STATE_URL, db)
+leader = LeaderElector(shared_store, name="background-jobs", ttl_seconds=LEADER_LEASE_SECONDS)
+rate_limiter = RateLimiter(
+    {name: rate_limit_rule(name, defaults) for name, defaults in RATE_LIMIT_DEFAULTS.items()},
+    shared_store=shared_store if RATE_LIMIT_SHARED else None
+)
+
 # Utility functions
 def convert_objectid_to_str(obj):
     """Convert ObjectId fields to strings for JSON serialization"""
@@ -127,10 +510,25 @@ def convert_objectid_to_str(obj):
     else:
         return obj
 
+def encode_cursor(timestamp: datetime, doc_id: str) -> str:
+    """Encode a (timestamp, id) keyset position as an opaque cursor"""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{doc_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor created by encode_cursor"""
+    try:
+        timestamp, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), doc_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 def get_minecraft_uuid(username: str) -> Optional[str]:
     """Get UUID from Minecraft username using Mojang API"""
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        response = requests.get(f"https://api.mojang.com/users/profiles/minecraft/{username}")
+        response = requests.get(f"{MOJANG_API_URL}/users/profiles/minecraft/{username}")
+        outcome = str(response.status_code)
         if response.status_code == 200:
             data = response.json()
             return data.get('id')
@@ -138,11 +536,16 @@ def get_minecraft_uuid(username: str) -> Optional[str]:
     except Exception as e:
         logging.error(f"Error getting UUID for {username}: {e}")
         return None
+    finally:
+        mojang_request_duration.observe(time.perf_counter() - started, ("profile", outcome))
 
 def get_minecraft_skin(uuid: str) -> Optional[str]:
     """Get skin URL from UUID using Mojang API"""
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        response = requests.get(f"https://sessionserver.mojang.com/session/minecraft/profile/{uuid}")
+        response = requests.get(f"{MOJANG_SESSION_URL}/session/minecraft/profile/{uuid}")
+        outcome = str(response.status_code)
         if response.status_code == 200:
             data = response.json()
             properties = data.get('properties', [])
@@ -154,6 +557,36 @@ def get_minecraft_skin(uuid: str) -> Optional[str]:
     except Exception as e:
         logging.error(f"Error getting skin for UUID {uuid}: {e}")
         return None
+    finally:
+        mojang_request_duration.observe(time.perf_counter() - started, ("session", outcome))
+
+skin_store = SkinStore(SKIN_CACHE_DIR, SKIN_CACHE_MAX_BYTES, head_sizes=SKIN_HEAD_SIZES)
+
+async def resolve_texture_hash(player_uuid: str) -> Optional[str]:
+    """Find the texture hash of a player's current skin"""
+    texture_hash = skin_lookup_cache.get(player_uuid)
+    if texture_hash is None:
+        skin_url = await asyncio.to_thread(get_minecraft_skin, player_uuid)
+        if skin_url is None:
+            # Mojang unreachable or no skin set, fall back to what we stored at login
+            user = await db.users.find_one({"uuid": player_uuid}, {"skin_url": 1})
+            skin_url = user.get("skin_url") if user else None
+        texture_hash = (texture_hash_from_url(skin_url) if skin_url else None) or ""
+        skin_lookup_cache.set(player_uuid, texture_hash)
+    return texture_hash or None
+
+def fetch_texture(texture_hash: str) -> bytes:
+    """Download a skin texture from the Mojang texture CDN"""
+    response = requests.get(f"{SKIN_TEXTURE_URL}/{texture_hash}", timeout=10, stream=True)
+    try:
+        if response.status_code != 200:
+            raise SkinError(f"Texture server returned {response.status_code}")
+        data = response.raw.read(SKIN_MAX_TEXTURE_BYTES + 1, decode_content=True)
+        if len(data) > SKIN_MAX_TEXTURE_BYTES:
+            raise SkinError("Texture too large")
+        return data
+    finally:
+        response.close()
 
 def create_jwt_token(user_data: dict) -> str:
     """Create JWT token"""
@@ -161,80 +594,382 @@ def create_jwt_token(user_data: dict) -> str:
         "user_id": user_data["id"],
         "username": user_data["minecraft_username"],
         "is_admin": user_data["is_admin"],
+        "ver": user_data.get("token_version", 0),
         "exp": datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current user from JWT token"""
+def get_loaders() -> Loaders:
+    """Batched, memoized lookups shared by everything that runs for one request"""
+    # FastAPI caches dependencies per request, so handlers and other
+    # dependencies asking for this get the same instance
+    return Loaders(db)
+
+def select_fields(model):
+    """Dependency parsing a `fields=` selection over a model's fields"""
+    def dependency(fields: Optional[str] = Query(None, description=f"Comma-separated subset of: {', '.join(model.model_fields)}")) -> Fieldset:
+        try:
+            return Fieldset.parse(model, fields)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return dependency
+
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Get the user a JWT token was issued to, without loading their profile"""
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await db.users.find_one({"id": user_id})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        # Update last seen
+        payload = token_verifier.verify(credentials.credentials)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user_id = payload.get("user_id")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # Deleted users and role changes revoke earlier tokens
+    if token_revocations.is_revoked(user_id, payload.get("ver", 0)):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    
+    activity_sketches.record(user_id)
+    if last_seen_writes.get(user_id) is None:
+        last_seen_writes.set(user_id, True)
         await db.users.update_one(
             {"id": user_id},
             {"$set": {"last_seen": datetime.utcnow()}}
         )
-        
-        return User(**user)
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return TokenUser(id=user_id, minecraft_username=payload["username"], is_admin=payload["is_admin"])
+
+async def get_current_user(
+    token_user: TokenUser = Depends(get_token_user),
+    loaders: Loaders = Depends(get_loaders)
+):
+    """Get current user's full profile from JWT token"""
+    user = user_cache.get(token_user.id)
+    if user is None:
+        user = await db.users.find_one({"id": token_user.id})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        user_cache.set(token_user.id, user)
+    loaders.users.prime(token_user.id, user)
+    return User(**user)
 
-async def get_admin_user(current_user: User = Depends(get_current_user)):
+async def get_admin_user(current_user: TokenUser = Depends(get_token_user)):
     """Get current admin user"""
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
 # Minecraft server functions
-async def get_minecraft_server_status() -> ServerStats:
-    """Get Minecraft server status"""
+STATUS_SNAPSHOT_KEY = "server_status"
+
+def offline_server_stats() -> ServerStats:
+    """Default values reported while the server is down"""
+    return ServerStats(
+        players_online=0,
+        max_players=20,
+        server_version="Unknown",
+        motd="Server offline",
+        latency=0
+    )
+
+async def query_minecraft_server():
+    """Ping the Minecraft server, returning the raw status or None if it does not answer"""
+    started = time.perf_counter()
     try:
-        server = JavaServer.lookup(f"{MC_SERVER_IP}:{MC_SERVER_PORT}")
-        status = server.status()
-        
-        server_stats = ServerStats(
-            players_online=status.players.online,
-            max_players=status.players.max,
-            server_version=status.version.name if status.version else None,
-            motd=status.description if hasattr(status, 'description') else None,
-            latency=status.latency
-        )
-        
-        # Log server stats
-        await db.server_logs.insert_one({
-            "id": str(uuid.uuid4()),
-            "players_online": server_stats.players_online,
-            "max_players": server_stats.max_players,
-            "latency": server_stats.latency,
-            "timestamp": datetime.utcnow()
-        })
-        
-        return server_stats
+        server = await JavaServer.async_lookup(f"{MC_SERVER_IP}:{MC_SERVER_PORT}")
+        status = await server.async_status()
     except Exception as e:
+        minecraft_status_duration.observe(time.perf_counter() - started, ("error",))
         logging.error(f"Error getting server status: {e}")
-        # Return default values if server is down
-        return ServerStats(
-            players_online=0,
-            max_players=20,
-            server_version="Unknown",
-            motd="Server offline",
-            latency=0
-        )
+        return None
+    minecraft_status_duration.observe(time.perf_counter() - started, ("ok",))
+    return status
+
+def server_stats_from_status(status) -> ServerStats:
+    return ServerStats(
+        players_online=status.players.online,
+        max_players=status.players.max,
+        server_version=status.version.name if status.version else None,
+        motd=status.description if hasattr(status, 'description') else None,
+        latency=status.latency
+    )
+
+async def ping_minecraft_server() -> Optional[ServerStats]:
+    """Ping the Minecraft server, returning None if it does not answer"""
+    status = await query_minecraft_server()
+    return server_stats_from_status(status) if status is not None else None
+
+async def list_online_players(status) -> Optional[List[dict]]:
+    """Everyone online, or None if we can't tell
+    
+    The status sample is capped (12 players on vanilla), so larger servers
+    are listed over RCON instead.
+    """
+    if status is None:
+        return []
+    sample = status.players.sample or []
+    if len(sample) >= status.players.online:
+        return [{"name": player.name, "uuid": player.id.replace("-", "")} for player in sample]
+    if rcon_pool is None:
+        return None
+    try:
+        response = await rcon_pool.execute("list")
+    except RconError as e:
+        logging.error(f"Error listing players over RCON: {e}")
+        return None
+    uuids = {player.name: player.id.replace("-", "") for player in sample}
+    return [{"name": name, "uuid": uuids.get(name)} for name in parse_player_list(response)]
+
+async def poll_server_status():
+    """Ping the server on a fixed interval and publish the result to all workers (leader only)"""
+    # Pick up the sessions left open and statistics kept by the previous leader
+    await playtime_tracker.load()
+    await server_monitor.load()
+    while True:
+        status = await query_minecraft_server()
+        server_stats = server_stats_from_status(status) if status is not None else None
+        try:
+            players = await list_online_players(status)
+            if players is not None:
+                await playtime_tracker.observe(players)
+        except Exception as e:
+            logging.error(f"Error tracking player sessions: {e}")
+        try:
+            if server_stats is not None:
+                await server_monitor.observe(server_stats.latency, server_stats.players_online)
+            else:
+                await server_monitor.observe(None, None)
+        except Exception as e:
+            logging.error(f"Error checking server status for anomalies: {e}")
+        try:
+            if server_stats is not None:
+                # Log server stats
+                await db.server_logs.insert_one({
+                    "id": str(uuid.uuid4()),
+                    "players_online": server_stats.players_online,
+                    "max_players": server_stats.max_players,
+                    "latency": server_stats.latency,
+                    "timestamp": datetime.utcnow()
+                })
+            else:
+                server_stats = offline_server_stats()
+            await shared_store.set(
+                STATUS_SNAPSHOT_KEY,
+                jsonable_encoder(server_stats),
+                ttl_seconds=STATUS_POLL_INTERVAL_SECONDS * 3
+            )
+        except Exception as e:
+            logging.error(f"Error publishing server status: {e}")
+        await asyncio.sleep(STATUS_POLL_INTERVAL_SECONDS)
+
+playtime_tracker = PlaytimeTracker(db, max_gap_seconds=STATUS_POLL_INTERVAL_SECONDS * 4)
+server_monitor = ServerMonitor(
+    db,
+    f"{MC_SERVER_IP}:{MC_SERVER_PORT}",
+    alpha=ANOMALY_EWMA_ALPHA,
+    latency_zscore=ANOMALY_LATENCY_ZSCORE,
+    latency_min_ms=ANOMALY_LATENCY_MIN_MS,
+    drop_fraction=ANOMALY_PLAYER_DROP_FRACTION,
+    drop_min=ANOMALY_PLAYER_DROP_MIN,
+    warmup_samples=ANOMALY_WARMUP_SAMPLES
+)
+leader.add_job(poll_server_status)
+
+log_archiver = LogArchiver(
+    db,
+    ARCHIVE_DIR,
+    ARCHIVE_COLLECTIONS,
+    max_age_days=ARCHIVE_MAX_AGE_DAYS,
+    batch_size=ARCHIVE_BATCH_SIZE,
+    interval_seconds=ARCHIVE_INTERVAL_SECONDS
+)
+if ARCHIVE_ENABLED:
+    leader.add_job(log_archiver.run)
+
+async def get_minecraft_server_status() -> ServerStats:
+    """Get Minecraft server status from the snapshot published by the leader"""
+    server_stats = status_cache.get(STATUS_SNAPSHOT_KEY)
+    if server_stats is None:
+        snapshot = await shared_store.get(STATUS_SNAPSHOT_KEY)
+        if snapshot is not None:
+            server_stats = ServerStats(**snapshot)
+        else:
+            # Nothing published yet (startup or leader change), ping directly
+            server_stats = await ping_minecraft_server() or offline_server_stats()
+        status_cache.set(STATUS_SNAPSHOT_KEY, server_stats)
+    return server_stats
+
+# Game server commands
+# Without an RCON password commands are only recorded, not sent
+rcon_pool = RconPool(RCON_HOST, RCON_PORT, RCON_PASSWORD, size=RCON_POOL_SIZE, timeout=RCON_TIMEOUT_SECONDS) if RCON_PASSWORD else None
+
+async def dispatch_server_commands(commands: List[str], executed_by: str) -> List[dict]:
+    """Send commands to the Minecraft server over RCON and record them with their results"""
+    now = datetime.utcnow()
+    command_dicts = [
+        {"id": str(uuid.uuid4()), "command": command, "executed_by": executed_by, "executed_at": now}
+        for command in commands
+    ]
+    if rcon_pool is None:
+        for command_dict in command_dicts:
+            command_dict["status"] = "logged"
+    else:
+        started = time.perf_counter()
+        try:
+            responses = await rcon_pool.execute_many(commands)
+        except RconUnavailable as e:
+            logging.error(f"RCON execution failed: {e}")
+            for command_dict in command_dicts:
+                command_dict.update({"status": "failed", "error": str(e)})
+        except RconError as e:
+            # Sent, but without an answer the commands may or may not have run
+            logging.error(f"RCON execution unconfirmed: {e}")
+            for command_dict in command_dicts:
+                command_dict.update({"status": "unconfirmed", "error": str(e)})
+        else:
+            for command_dict, response in zip(command_dicts, responses):
+                command_dict.update({"status": "completed", "response": response})
+        duration_ms = round((time.perf_counter() - started) * 1000, 2)
+        for command_dict in command_dicts:
+            command_dict["duration_ms"] = duration_ms
+    
+    if command_dicts:
+        stamp = await change_feed.stamp()
+        await db.commands.insert_many([{**command_dict, **stamp} for command_dict in command_dicts])
+    return command_dicts
+
+async def dispatch_server_command(command: str, executed_by: str) -> dict:
+    """Send a single command to the Minecraft server and record it"""
+    return (await dispatch_server_commands([command], executed_by))[0]
+
+# Purchase fulfillment
+async def render_delivery_commands(purchase: dict) -> List[str]:
+    """The purchased item's delivery commands, filled in for the buyer"""
+    user = await db.users.find_one({"id": purchase["user_id"]})
+    if not user:
+        raise PermanentDeliveryError("User not found")
+    item = await db.shop_items.find_one({"id": purchase["item_id"]})
+    if not item:
+        raise PermanentDeliveryError("Item not found")
+    if not item.get("delivery_commands"):
+        # Items from before delivery commands existed are handed out by admins
+        raise ManualDeliveryRequired("Item has no delivery commands")
+    
+    placeholders = {
+        "username": user["minecraft_username"],
+        "uuid": user["uuid"],
+        "purchase_id": purchase["id"]
+    }
+    try:
+        return [command.format_map(placeholders) for command in item["delivery_commands"]]
+    except (KeyError, IndexError, ValueError) as e:
+        raise PermanentDeliveryError(f"Invalid delivery command template: {e}")
+
+async def deliver_purchase(purchase: dict):
+    """Run the delivery commands of the purchased item for the buyer
+    
+    Commands are sent one at a time, with progress saved on the purchase
+    around each: `commands_sent` counts the acknowledged ones and
+    `sending_command` marks the one on the wire. A retry resumes after the
+    last acknowledged command. A command left unacknowledged may have run,
+    and game commands aren't safe to replay, so that purchase is
+    dead-lettered for an admin to check in game instead.
+    """
+    if rcon_pool is None:
+        raise RconError("RCON is not configured")
+    if purchase.get("sending_command") is not None:
+        raise PermanentDeliveryError(f"Delivery command {purchase['sending_command'] + 1} was sent but never confirmed")
+    
+    # The commands are rendered once, so later edits of the item can't
+    # shift which ones were already sent
+    commands = purchase.get("commands")
+    if commands is None:
+        commands = await render_delivery_commands(purchase)
+        await fulfillment_worker.checkpoint(purchase, {"commands": commands, "commands_sent": 0})
+    
+    for index in range(purchase.get("commands_sent", 0), len(commands)):
+        await fulfillment_worker.checkpoint(purchase, {"sending_command": index})
+        result = await dispatch_server_command(commands[index], executed_by=f"fulfillment:{purchase['id']}")
+        if result["status"] == "failed":
+            # Never reached the server, so the next attempt can send it
+            await fulfillment_worker.checkpoint(purchase, {}, unset=["sending_command"])
+            raise RconError(result["error"])
+        if result["status"] != "completed":
+            raise PermanentDeliveryError(f"Delivery command {index + 1} was sent but never confirmed: {result['error']}")
+        await fulfillment_worker.checkpoint(purchase, {"commands_sent": index + 1}, unset=["sending_command"])
+
+async def record_completed_purchase(purchase: dict):
+    """Count a delivered purchase towards the buyer's totals"""
+    user = await db.users.find_one_and_update(
+        {"id": purchase["user_id"]},
+        {"$inc": {"purchase_count": 1, "total_spent": purchase["price"]}, "$set": await change_feed.stamp()},
+        projection=leaderboards.projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if user is not None:
+        leaderboards.update(user, ("purchases", "spend"))
+
+async def backfill_purchase_totals():
+    """Derive purchase_count and total_spent for users created before they existed"""
+    if await db.migrations.find_one({"_id": "user_purchase_totals"}):
+        return
+    totals = await db.purchases.aggregate([
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}, "spent": {"$sum": "$price"}}}
+    ]).to_list(None)
+    if totals:
+        await db.users.bulk_write([
+            UpdateOne({"id": total["_id"]}, {"$set": {"purchase_count": total["count"], "total_spent": total["spent"]}})
+            for total in totals
+        ], ordered=False)
+    await db.migrations.update_one({"_id": "user_purchase_totals"}, {"$set": {"applied_at": datetime.utcnow()}}, upsert=True)
+
+async def deliver_purchase_in_background(purchase: dict):
+    """Deliver a purchase within the background admission budget"""
+    async with admission.slot("background"):
+        await deliver_purchase(purchase)
+
+# Without RCON nothing can be delivered, so purchases wait in the queue
+fulfillment_enabled = FULFILLMENT_ENABLED and rcon_pool is not None
+fulfillment_worker = FulfillmentWorker(
+    db.purchases,
+    deliver_purchase_in_background,
+    batch_size=FULFILLMENT_BATCH_SIZE,
+    concurrency=FULFILLMENT_CONCURRENCY,
+    lease_seconds=FULFILLMENT_LEASE_SECONDS,
+    max_attempts=FULFILLMENT_MAX_ATTEMPTS,
+    on_completed=record_completed_purchase,
+    stamp=change_feed.stamp
+)
 
 # Application lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    await warm_up_mongo_pool()
+    # Ensure indexes
+    await db.shop_items.create_index("id", unique=True)
+    await db.purchases.create_index("id", unique=True)
+    await db.purchases.create_index([("status", 1), ("next_attempt_at", 1)])
+    await db.purchases.create_index([("status", 1), ("lease_expires_at", 1)])
+    await db.purchases.create_index("lease_owner", sparse=True)
+    await db.commands.create_index([("executed_at", -1), ("id", -1)])
+    await db.commands.create_index([("executed_by", 1), ("executed_at", -1), ("id", -1)])
+    await shared_store.setup()
+    await token_revocations.setup()
+    await token_revocations.load()
+    await playtime_tracker.setup()
+    await server_monitor.setup()
+    await activity_sketches.setup()
+    await leaderboards.setup()
+    await log_archiver.setup()
+    await change_feed.setup()
+    await report_jobs.setup()
+    cache_invalidator.start()
+    activity_sketches.start()
+    rate_limiter.start()
+    await asyncio.to_thread(skin_store.load)
+    
     # Create default admin user if not exists
     admin_user = await db.users.find_one({"minecraft_username": "Admin"})
     if not admin_user:
@@ -261,6 +996,7 @@ async def lifespan(app: FastAPI):
                 "price": 9.99,
                 "category": "Rangs",
                 "image_url": "https://via.placeholder.com/300x200?text=VIP",
+                "delivery_commands": ["lp user {username} parent add vip"],
                 "in_stock": True,
                 "created_at": datetime.utcnow()
             },
@@ -271,6 +1007,10 @@ async def lifespan(app: FastAPI):
                 "price": 4.99,
                 "category": "Items",
                 "image_url": "https://via.placeholder.com/300x200?text=Diamant",
+                "delivery_commands": [
+                    "give {username} diamond 64",
+                    "give {username} diamond_sword{{Enchantments:[{{id:sharpness,lvl:5}}]}} 1"
+                ],
                 "in_stock": True,
                 "created_at": datetime.utcnow()
             },
@@ -281,26 +1021,110 @@ async def lifespan(app: FastAPI):
                 "price": 7.99,
                 "category": "Terrains",
                 "image_url": "https://via.placeholder.com/300x200?text=Terrain",
+                "delivery_commands": ["adjustbonusclaimblocks {username} 10000"],
                 "in_stock": True,
                 "created_at": datetime.utcnow()
             }
         ]
         await db.shop_items.insert_many(default_items)
     
+    await backfill_purchase_totals()
+    await leaderboards.refresh()
+    leaderboards.start()
+    
+    # Purchases are leased individually, so every worker can fulfill them
+    if fulfillment_enabled:
+        fulfillment_worker.start()
+    elif FULFILLMENT_ENABLED:
+        logging.warning("Purchase fulfillment is off: RCON_PASSWORD is not set")
+    leader.start()
+    
     yield
     # Shutdown
+    await leader.stop()
+    await cache_invalidator.stop()
+    await leaderboards.stop()
+    await rate_limiter.stop()
+    try:
+        await activity_sketches.stop()
+    except Exception as e:
+        logging.error(f"Failed to persist activity sketches: {e}")
+    await shared_store.close()
+    await fulfillment_worker.stop()
+    await report_jobs.stop()
+    if rcon_pool is not None:
+        await rcon_pool.close()
+    analytics_client.close()
     client.close()
 
+async def ping_mongo() -> float:
+    """Round trip to MongoDB in seconds"""
+    started = time.perf_counter()
+    try:
+        await client.admin.command("ping")
+    except Exception:
+        mongo_ping_duration.observe(time.perf_counter() - started, ("error",))
+        raise
+    elapsed = time.perf_counter() - started
+    mongo_ping_duration.observe(elapsed, ("success",))
+    return elapsed
+
+async def warm_up_mongo_pool():
+    # Concurrent pings each check out a connection, filling the pool up to
+    # that many before we serve traffic
+    started = time.perf_counter()
+    results = await asyncio.gather(*(ping_mongo() for _ in range(MONGO_WARMUP_CONNECTIONS)), return_exceptions=True)
+    failed = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        logging.warning(f"MongoDB pool warm-up: {len(failed)} of {len(results)} pings failed: {failed[0]}")
+    else:
+        logging.info(f"MongoDB pool warmed up with {len(results)} connections in {(time.perf_counter() - started) * 1000:.0f} ms")
+
 # Create the main app
 app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Rate limiting
+async def enforce_rate_limit(rule: str, key: str):
+    if not RATE_LIMIT_ENABLED:
+        return
+    try:
+        await rate_limiter.check(rule, key)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(math.ceil(e.retry_after_seconds))}
+        )
+
+def client_ip(request: Request) -> str:
+    return client_address(
+        request.client.host if request.client else None,
+        request.headers.get("x-forwarded-for"),
+        TRUSTED_PROXIES
+    )
+
+async def rate_limit_public(request: Request):
+    await enforce_rate_limit("public_ip", client_ip(request))
+
+async def require_internal_access(request: Request):
+    """Let only allow-listed addresses and admins read operational endpoints"""
+    if address_in(client_ip(request), INTERNAL_ALLOWED_IPS):
+        return
+    payload = bearer_payload(request.scope)
+    if payload is None or not payload.get("is_admin"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
 # Auth endpoints
 @api_router.post("/auth/login")
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, request: Request):
     """Login user with Minecraft username"""
+    # Checked before any I/O, so rejected attempts cost nothing
+    await enforce_rate_limit("login_ip", client_ip(request))
+    await enforce_rate_limit("login_username", user_data.minecraft_username.lower())
+    
     # Get UUID from Mojang API
     minecraft_uuid = get_minecraft_uuid(user_data.minecraft_username)
     if not minecraft_uuid:
@@ -308,6 +1132,8 @@ async def login(user_data: UserLogin):
     
     # Check if user exists
     user = await db.users.find_one({"minecraft_username": user_data.minecraft_username})
+    # The user and their login log change together
+    stamp = await change_feed.stamp()
     
     if not user:
         # Create new user
@@ -321,7 +1147,8 @@ async def login(user_data: UserLogin):
             "last_login": datetime.utcnow(),
             "last_seen": datetime.utcnow(),
             "skin_url": skin_url,
-            "login_count": 1
+            "login_count": 1,
+            **stamp
         }
         await db.users.insert_one(user_dict)
         user = user_dict
@@ -332,12 +1159,18 @@ async def login(user_data: UserLogin):
             {
                 "$set": {
                     "last_login": datetime.utcnow(),
-                    "last_seen": datetime.utcnow()
+                    "last_seen": datetime.utcnow(),
+                    **stamp
                 },
                 "$inc": {"login_count": 1}
             }
         )
         user["login_count"] = user.get("login_count", 0) + 1
+        user["last_login"] = user["last_seen"] = datetime.utcnow()
+        user_cache.invalidate(user["id"])
+    
+    activity_sketches.record(user["id"])
+    leaderboards.update(user, ("logins",))
     
     # Log login
     await db.login_logs.insert_one({
@@ -345,7 +1178,8 @@ async def login(user_data: UserLogin):
         "user_id": user["id"],
         "minecraft_username": user_data.minecraft_username,
         "login_time": datetime.utcnow(),
-        "success": True
+        "success": True,
+        **stamp
     })
     
     # Create JWT token
@@ -362,55 +1196,143 @@ async def get_me(current_user: User = Depends(get_current_user)):
     """Get current user info"""
     return current_user
 
+# Health endpoints
+@api_router.get("/health/db", dependencies=[Depends(require_internal_access)])
+async def get_db_health():
+    """MongoDB reachability, ping latency and connection pool usage"""
+    def pool_stats(listener: MongoPoolListener) -> Dict[str, dict]:
+        pools = listener.stats()
+        for pool in pools.values():
+            pool["wait_ms_mean"] = round(pool.pop("wait_seconds_total") / pool["checkouts"] * 1000, 3) if pool["checkouts"] else 0.0
+            pool["wait_ms_max"] = round(pool.pop("wait_seconds_max") * 1000, 3)
+        return pools
+
+    health = {
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "pools": pool_stats(mongo_pool_listener),
+        "analytics": {
+            "read_preference": ANALYTICS_READ_PREFERENCE,
+            "max_pool_size": ANALYTICS_MAX_POOL_SIZE,
+            "pools": pool_stats(analytics_pool_listener)
+        }
+    }
+    try:
+        ping = await ping_mongo()
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": str(e), **health})
+    return {"status": "ok", "ping_ms": round(ping * 1000, 3), **health}
+
 # Server status endpoints
-@api_router.get("/server/status")
+@api_router.get("/server/status", dependencies=[Depends(rate_limit_public)])
 async def get_server_status():
     """Get Minecraft server status"""
     return await get_minecraft_server_status()
 
-@api_router.get("/server/players")
+@api_router.get("/server/players", dependencies=[Depends(rate_limit_public)])
 async def get_online_players():
     """Get number of online players"""
     status = await get_minecraft_server_status()
     return {"players_online": status.players_online, "max_players": status.max_players}
 
+@api_router.get("/server/playtime", dependencies=[Depends(rate_limit_public)])
+async def get_playtime_leaderboard(
+    limit: int = Query(20, ge=1, le=PLAYTIME_LEADERBOARD_MAX_LIMIT),
+    offset: int = Query(0, ge=0, le=PLAYTIME_LEADERBOARD_MAX_OFFSET)
+):
+    """Players ranked by time spent on the server"""
+    leaderboard = playtime_cache.get((limit, offset))
+    if leaderboard is None:
+        leaderboard = await playtime_tracker.leaderboard(limit, offset)
+        playtime_cache.set((limit, offset), leaderboard)
+    return {"players": leaderboard, "offset": offset, "limit": limit}
+
+# Leaderboard endpoints
+def get_leaderboard_board(metric: str, current_user: TokenUser):
+    board = leaderboards.boards.get(metric)
+    if board is None:
+        raise HTTPException(status_code=404, detail=f"Unknown leaderboard, expected one of {', '.join(LEADERBOARD_FIELDS)}")
+    # How much each player spent is for admins only
+    if metric == "spend" and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return board
+
+@api_router.get("/leaderboards/{metric}")
+async def get_leaderboard(
+    metric: str,
+    limit: int = Query(20, ge=1, le=LEADERBOARD_SIZE),
+    offset: int = Query(0, ge=0, le=LEADERBOARD_SIZE),
+    current_user: TokenUser = Depends(get_token_user)
+):
+    """Top users by logins, purchases or spend"""
+    board = get_leaderboard_board(metric, current_user)
+    entries = [
+        {"rank": entry["rank"], "user_id": entry["id"], "minecraft_username": entry["minecraft_username"], "score": entry[board.field]}
+        for entry in board.page(offset, limit)
+    ]
+    return {"metric": metric, "entries": entries, "offset": offset, "limit": limit, "size": LEADERBOARD_SIZE}
+
+@api_router.get("/leaderboards/{metric}/me")
+async def get_my_leaderboard_rank(metric: str, current_user: TokenUser = Depends(get_token_user)):
+    """Your own rank, or null if you are outside the tracked top entries"""
+    board = get_leaderboard_board(metric, current_user)
+    entry = board.get(current_user.id)
+    return {
+        "metric": metric,
+        "rank": board.rank_of(current_user.id),
+        "score": entry[board.field] if entry else None,
+        "size": LEADERBOARD_SIZE
+    }
+
 # User endpoints
-@api_router.get("/users", response_model=List[User])
-async def get_users(current_user: User = Depends(get_admin_user)):
-    """Get all users (admin only)"""
-    users = await db.users.find().to_list(1000)
-    return [User(**user) for user in users]
+@api_router.get("/users", response_model=List[partial_model(User)], response_model_exclude_unset=True)
+async def get_users(fieldset: Fieldset = Depends(select_fields(User)), current_user: TokenUser = Depends(get_admin_user)):
+    """Get all users (admin only)
+    
+    Each user carries the selected fields only, all of them by default.
+    """
+    users = await db.users.find({}, fieldset.projection).to_list(1000)
+    return [fieldset.model(**user).model_dump() for user in users]
 
 @api_router.get("/users/{user_id}")
-async def get_user(user_id: str, current_user: User = Depends(get_current_user)):
+async def get_user(user_id: str, current_user: TokenUser = Depends(get_token_user), loaders: Loaders = Depends(get_loaders)):
     """Get user by ID"""
     # Users can only see their own profile or admins can see any
     if current_user.id != user_id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    user = await db.users.find_one({"id": user_id})
+    user = await loaders.users.load(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     return User(**user)
 
 @api_router.put("/users/{user_id}/admin")
-async def toggle_admin(user_id: str, current_user: User = Depends(get_admin_user)):
+async def toggle_admin(user_id: str, current_user: TokenUser = Depends(get_admin_user), loaders: Loaders = Depends(get_loaders)):
     """Toggle admin status (admin only)"""
-    user = await db.users.find_one({"id": user_id})
+    user = await loaders.users.load(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     new_admin_status = not user["is_admin"]
-    await db.users.update_one(
+    user = await db.users.find_one_and_update(
         {"id": user_id},
-        {"$set": {"is_admin": new_admin_status}}
+        {"$set": {"is_admin": new_admin_status, **await change_feed.stamp()}, "$inc": {"token_version": 1}},
+        return_document=ReturnDocument.AFTER
     )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_cache.invalidate(user_id)
+    loaders.users.clear(user_id)
+    # Their tokens still claim the old role, so they have to log in again
+    await token_revocations.revoke(user_id, user["token_version"])
+    await cache_invalidator.bump("users")
+    await cache_invalidator.bump("token_revocations")
     
     return {"message": f"User admin status updated to {new_admin_status}"}
 
 @api_router.delete("/users/{user_id}")
-async def delete_user(user_id: str, current_user: User = Depends(get_admin_user)):
+async def delete_user(user_id: str, current_user: TokenUser = Depends(get_admin_user)):
     """Delete user (admin only)"""
     if current_user.id == user_id:
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
@@ -419,75 +1341,164 @@ async def delete_user(user_id: str, current_user: User = Depends(get_admin_user)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    user_cache.invalidate(user_id)
+    leaderboards.remove(user_id)
+    await change_feed.tombstone("users", user_id)
+    await token_revocations.revoke(user_id)
+    await cache_invalidator.bump("users")
+    await cache_invalidator.bump("token_revocations")
     return {"message": "User deleted successfully"}
 
 # Admin endpoints
+@api_router.get("/admin/sync")
+async def sync_admin_data(
+    cursor: Optional[str] = Query(None, description="Cursor from the previous sync; omit to get a starting cursor"),
+    limit: int = Query(500, ge=1, le=SYNC_MAX_LIMIT),
+    current_user: TokenUser = Depends(get_admin_user)
+):
+    """Users, purchases, logins and commands changed or deleted since a cursor (admin only)
+    
+    Take a cursor before loading the full lists, then apply the changes
+    (upsert by id) and deletions from each sync, passing the returned cursor
+    back next time. Changes can be sent more than once. When "reset" is
+    true the cursor is too old and the lists must be reloaded.
+    """
+    if cursor is None:
+        return {"cursor": await change_feed.cursor()}
+    try:
+        return await change_feed.changes(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def analytics_read(degraded: Dict[str, str], name: str, query, **kwargs):
+    """analytics_reads.read(), noting in `degraded` when the result isn't fresh"""
+    result, reason = await analytics_reads.read(name, query, **kwargs)
+    if reason is not None:
+        degraded[name] = reason
+    return result
+
 @api_router.get("/admin/stats")
-async def get_admin_stats(current_user: User = Depends(get_admin_user)):
-    """Get admin statistics"""
-    # Get user stats
-    total_users = await db.users.count_documents({})
-    admin_users = await db.users.count_documents({"is_admin": True})
-    active_users_today = await db.users.count_documents({
-        "last_seen": {"$gte": datetime.utcnow() - timedelta(days=1)}
-    })
+async def get_admin_stats(current_user: TokenUser = Depends(get_admin_user)):
+    """Get admin statistics
+
+    Figures that took too long are stale or estimated, listed in `degraded`.
+    """
+    degraded: Dict[str, str] = {}
+    (
+        total_users,
+        admin_users,
+        recent_logins,
+        total_purchases,
+        total_revenue_result
+    ) = await asyncio.gather(
+        analytics_read(
+            degraded, "total_users",
+            lambda max_time_ms: analytics_db.users.count_documents({}, maxTimeMS=max_time_ms),
+            fallback=analytics_db.users.estimated_document_count
+        ),
+        analytics_read(
+            degraded, "admin_users",
+            lambda max_time_ms: analytics_db.users.count_documents({"is_admin": True}, maxTimeMS=max_time_ms)
+        ),
+        analytics_read(
+            degraded, "recent_logins",
+            lambda max_time_ms: analytics_db.login_logs.find().sort("login_time", -1).limit(10).max_time_ms(max_time_ms).to_list(10),
+            default=[]
+        ),
+        analytics_read(
+            degraded, "total_purchases",
+            lambda max_time_ms: analytics_db.purchases.count_documents({}, maxTimeMS=max_time_ms),
+            fallback=analytics_db.purchases.estimated_document_count
+        ),
+        analytics_read(
+            degraded, "total_revenue",
+            lambda max_time_ms: analytics_db.purchases.aggregate([
+                {"$match": {"status": "completed"}},
+                {"$group": {"_id": None, "total": {"$sum": "$price"}}}
+            ], maxTimeMS=max_time_ms).to_list(1)
+        )
+    )
+    active_users_today = await activity_sketches.window(datetime.utcnow().date(), 1)
     
     # Get server status
     server_status = await get_minecraft_server_status()
     
-    # Get recent logins
-    recent_logins = await db.login_logs.find().sort("login_time", -1).limit(10).to_list(10)
-    recent_logins = convert_objectid_to_str(recent_logins)
-    
-    # Get total purchases
-    total_purchases = await db.purchases.count_documents({})
-    total_revenue_result = await db.purchases.aggregate([
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$price"}}}
-    ]).to_list(1)
+    if total_revenue_result is None:
+        total_revenue = None
+    else:
+        total_revenue = total_revenue_result[0]["total"] if total_revenue_result else 0
     
     return {
         "total_users": total_users,
         "admin_users": admin_users,
         "active_users_today": active_users_today,
         "server_status": server_status,
-        "recent_logins": recent_logins,
+        "recent_logins": convert_objectid_to_str(recent_logins),
         "total_purchases": total_purchases,
-        "total_revenue": total_revenue_result[0]["total"] if total_revenue_result else 0
+        "total_revenue": total_revenue,
+        "degraded": degraded
     }
 
+@api_router.get("/admin/stats/active-users")
+async def get_active_users(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: TokenUser = Depends(get_admin_user)
+):
+    """Estimated distinct active users per day, week and month (admin only)"""
+    # Estimates from HyperLogLog sketches, within about 2% of the exact count
+    today = datetime.utcnow().date()
+    result = {
+        "dau": await activity_sketches.window(today, 1),
+        "wau": await activity_sketches.window(today, 7),
+        "mau": await activity_sketches.window(today, 30),
+    }
+    if start is not None or end is not None:
+        end_day = (end or datetime.utcnow()).date()
+        start_day = start.date() if start is not None else end_day
+        days = (end_day - start_day).days + 1
+        if days < 1:
+            raise HTTPException(status_code=400, detail="start must not be after end")
+        if days > ACTIVITY_SKETCH_RETENTION_DAYS:
+            raise HTTPException(status_code=400, detail=f"Window can't exceed {ACTIVITY_SKETCH_RETENTION_DAYS} days")
+        result["window"] = {
+            "start": start_day.isoformat(),
+            "end": end_day.isoformat(),
+            "active_users": await activity_sketches.window(end_day, days)
+        }
+    return result
+
 @api_router.get("/admin/users/activity")
-async def get_user_activity(current_user: User = Depends(get_admin_user)):
-    """Get user activity logs"""
+async def get_user_activity(fieldset: Fieldset = Depends(select_fields(LoginLog)), current_user: TokenUser = Depends(get_admin_user)):
+    """Get user activity logs, `fields` selecting what to return of each login"""
+    degraded: Dict[str, str] = {}
     # Get login logs
-    login_logs = await db.login_logs.find().sort("login_time", -1).limit(50).to_list(50)
+    login_logs = await analytics_read(
+        degraded, "login_logs",
+        lambda max_time_ms: analytics_db.login_logs.find({}, fieldset.projection).sort("login_time", -1).limit(50).max_time_ms(max_time_ms).to_list(50),
+        default=[],
+        key=fieldset.fields
+    )
     login_logs = convert_objectid_to_str(login_logs)
     
-    # Get user stats
-    user_stats = await db.users.aggregate([
-        {
-            "$project": {
-                "minecraft_username": 1,
-                "login_count": 1,
-                "last_login": 1,
-                "last_seen": 1,
-                "created_at": 1
-            }
-        },
-        {"$sort": {"login_count": -1}},
-        {"$limit": 20}
-    ]).to_list(20)
-    user_stats = convert_objectid_to_str(user_stats)
+    # Most active users
+    user_stats = leaderboards.boards["logins"].page(0, 20)
     
     return {
         "login_logs": login_logs,
-        "user_stats": user_stats
+        "user_stats": user_stats,
+        "degraded": degraded
     }
 
 @api_router.get("/admin/server/logs")
-async def get_server_logs(current_user: User = Depends(get_admin_user)):
+async def get_server_logs(current_user: TokenUser = Depends(get_admin_user)):
     """Get server performance logs"""
-    logs = await db.server_logs.find().sort("timestamp", -1).limit(100).to_list(100)
+    degraded: Dict[str, str] = {}
+    logs = await analytics_read(
+        degraded, "server_logs",
+        lambda max_time_ms: analytics_db.server_logs.find().sort("timestamp", -1).limit(100).max_time_ms(max_time_ms).to_list(100),
+        default=[]
+    )
     logs = convert_objectid_to_str(logs)
     
     # Calculate averages
@@ -504,45 +1515,157 @@ async def get_server_logs(current_user: User = Depends(get_admin_user)):
             "avg_players": round(avg_players, 1),
             "avg_latency": round(avg_latency, 1),
             "total_logs": len(logs)
-        }
+        },
+        "degraded": degraded
     }
 
-@api_router.post("/admin/commands")
-async def execute_command(command: AdminCommand, current_user: User = Depends(get_admin_user)):
-    """Execute admin command (placeholder - actual implementation depends on server setup)"""
-    # This would typically connect to server via RCON
-    # For now, we'll just log the command
-    command_dict = command.dict()
-    command_dict["executed_by"] = current_user.minecraft_username
-    command_dict["id"] = str(uuid.uuid4())
+@api_router.get("/admin/server/events")
+async def get_server_events(
+    kind: Optional[str] = Query(None, description="latency_spike, player_drop or offline"),
+    active: bool = Query(False, description="Only events still going on"),
+    since: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=SERVER_EVENTS_MAX_LIMIT),
+    current_user: TokenUser = Depends(get_admin_user)
+):
+    """Anomalies flagged in the server status, newest first, with the current baseline (admin only)"""
+    query: Dict[str, Any] = {"server": server_monitor.server}
+    if kind is not None:
+        query["kind"] = kind
+    if active:
+        query["ended_at"] = None
+    if since is not None:
+        query["started_at"] = {"$gte": since}
+    events = await db.server_events.find(query, {"_id": 0}).sort("started_at", -1).limit(limit).to_list(limit)
+    return {"events": events, "baseline": await server_monitor.baseline()}
+
+@api_router.get("/admin/archive/{collection}")
+async def query_archive(
+    collection: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    match: List[str] = Query([], description="field=value, may be repeated"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    limit: int = Query(100, ge=1, le=ARCHIVE_QUERY_MAX_LIMIT),
+    current_user: TokenUser = Depends(get_admin_user)
+):
+    """Search archived log records in [start, end), newest first (admin only)"""
+    if collection not in ARCHIVE_COLLECTIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown archive, expected one of {', '.join(ARCHIVE_COLLECTIONS)}")
+    conditions = {}
+    for condition in match:
+        field, _, value = condition.partition("=")
+        if field not in ARCHIVE_MATCH_FIELDS[collection]:
+            allowed = ", ".join(ARCHIVE_MATCH_FIELDS[collection]) or "none"
+            raise HTTPException(status_code=400, detail=f"Cannot match on {field!r}, allowed: {allowed}")
+        conditions[field] = value
+    # Archived times are naive UTC
+    start, end = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo else value
+        for value in (start, end)
+    )
+    columns = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
     
-    await db.commands.insert_one(command_dict)
+    records = await asyncio.to_thread(log_archiver.query, collection, start, end, conditions, columns, limit)
+    return {"records": records, "count": len(records)}
+
+@api_router.post("/admin/reports")
+async def submit_report(request: ReportRequest, current_user: TokenUser = Depends(get_admin_user)):
+    """Start computing a report (admin only)
+
+    Answers 202 with the job to poll, or 200 with the finished job when the
+    report was already computed over the current data.
+    """
+    try:
+        job = await report_jobs.submit(request.kind, request.params, submitted_by=current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(status_code=200 if job["status"] == "completed" else 202, content=jsonable_encoder(job))
+
+@api_router.get("/admin/reports/{job_id}")
+async def get_report(job_id: str, current_user: TokenUser = Depends(get_admin_user)):
+    """Status of a report job and, once completed, its result (admin only)
+
+    `current` is false when the data changed since; submit it again for a
+    fresh result.
+    """
+    job = await report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+@api_router.post("/admin/commands")
+async def execute_command(command: AdminCommand, current_user: TokenUser = Depends(get_admin_user)):
+    """Execute admin command on the Minecraft server over RCON"""
+    result = await dispatch_server_command(command.command, executed_by=current_user.minecraft_username)
+    if result["status"] in ("failed", "unconfirmed"):
+        raise HTTPException(status_code=502, detail=f"RCON error: {result['error']}")
+    if result["status"] == "logged":
+        return {"message": f"Command logged: {command.command}", "id": result["id"]}
     
-    return {"message": f"Command logged: {command.command}"}
+    return {"message": f"Command executed: {command.command}", "id": result["id"], "response": result["response"]}
 
 @api_router.get("/admin/commands")
-async def get_command_history(current_user: User = Depends(get_admin_user)):
-    """Get command history"""
-    commands = await db.commands.find().sort("executed_at", -1).limit(50).to_list(50)
-    return commands
+async def get_command_history(
+    limit: int = Query(50, ge=1, le=COMMAND_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    executed_by: Optional[str] = None,
+    prefix: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: TokenUser = Depends(get_admin_user)
+):
+    """Get command history, newest first, one page at a time"""
+    query: Dict[str, Any] = {}
+    if executed_by:
+        query["executed_by"] = executed_by
+    if prefix:
+        query["command"] = {"$regex": f"^{re.escape(prefix)}"}
+    if since or until:
+        query["executed_at"] = {}
+        if since:
+            query["executed_at"]["$gte"] = since
+        if until:
+            query["executed_at"]["$lt"] = until
+    if cursor:
+        # Keyset pagination: continue strictly after the last returned command
+        executed_at, command_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"executed_at": {"$lt": executed_at}},
+            {"executed_at": executed_at, "id": {"$lt": command_id}}
+        ]
+    
+    commands = await db.commands.find(query, COMMAND_HISTORY_FIELDS).sort(
+        [("executed_at", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+    
+    next_cursor = None
+    if len(commands) == limit:
+        last = commands[-1]
+        next_cursor = encode_cursor(last["executed_at"], last["id"])
+    
+    return {"commands": commands, "next_cursor": next_cursor}
 
 # Shop endpoints
-@api_router.get("/shop/items")
+@api_router.get("/shop/items", dependencies=[Depends(rate_limit_public)])
 async def get_shop_items():
     """Get all shop items"""
-    items = await db.shop_items.find({"in_stock": True}).to_list(1000)
-    return [ShopItem(**item) for item in items]
+    items = catalog_cache.get("in_stock")
+    if items is None:
+        items = await db.shop_items.find({"in_stock": True}).to_list(1000)
+        items = [ShopItem(**item) for item in items]
+        catalog_cache.set("in_stock", items)
+    return items
 
-@api_router.get("/shop/items/{item_id}")
-async def get_shop_item(item_id: str):
+@api_router.get("/shop/items/{item_id}", dependencies=[Depends(rate_limit_public)])
+async def get_shop_item(item_id: str, loaders: Loaders = Depends(get_loaders)):
     """Get specific shop item"""
-    item = await db.shop_items.find_one({"id": item_id})
+    item = await loaders.shop_items.load(item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     return ShopItem(**item)
 
 @api_router.post("/shop/items")
-async def create_shop_item(item: ShopItemCreate, current_user: User = Depends(get_admin_user)):
+async def create_shop_item(item: ShopItemCreate, current_user: TokenUser = Depends(get_admin_user)):
     """Create new shop item (admin only)"""
     item_dict = item.dict()
     item_dict["id"] = str(uuid.uuid4())
@@ -550,35 +1673,123 @@ async def create_shop_item(item: ShopItemCreate, current_user: User = Depends(ge
     item_dict["in_stock"] = True
     
     await db.shop_items.insert_one(item_dict)
+    catalog_cache.invalidate()
+    await cache_invalidator.bump("shop_items")
     return ShopItem(**item_dict)
 
 @api_router.put("/shop/items/{item_id}")
-async def update_shop_item(item_id: str, item: ShopItemCreate, current_user: User = Depends(get_admin_user)):
+async def update_shop_item(item_id: str, item: ShopItemCreate, current_user: TokenUser = Depends(get_admin_user)):
     """Update shop item (admin only)"""
-    result = await db.shop_items.update_one(
+    updated_item = await db.shop_items.find_one_and_update(
         {"id": item_id},
-        {"$set": item.dict()}
+        {"$set": item.dict()},
+        return_document=ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if updated_item is None:
         raise HTTPException(status_code=404, detail="Item not found")
     
-    updated_item = await db.shop_items.find_one({"id": item_id})
+    catalog_cache.invalidate()
+    await cache_invalidator.bump("shop_items")
     return ShopItem(**updated_item)
 
 @api_router.delete("/shop/items/{item_id}")
-async def delete_shop_item(item_id: str, current_user: User = Depends(get_admin_user)):
+async def delete_shop_item(item_id: str, current_user: TokenUser = Depends(get_admin_user)):
     """Delete shop item (admin only)"""
     result = await db.shop_items.delete_one({"id": item_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     
+    catalog_cache.invalidate()
+    await cache_invalidator.bump("shop_items")
     return {"message": "Item deleted successfully"}
 
+@api_router.post("/admin/shop/items/import")
+async def import_shop_items(request: Request, current_user: TokenUser = Depends(get_admin_user)):
+    """Bulk create or update shop items from an NDJSON upload (admin only)"""
+    # Lines with an id update that item, lines without one are matched by name;
+    # anything unmatched is created
+    summary = {"received": 0, "upserted": 0, "modified": 0, "error_count": 0}
+    errors = []
+    batch: Dict[tuple, tuple] = {}
+
+    def record_error(line_number: int, message: str):
+        summary["error_count"] += 1
+        if len(errors) < SHOP_IMPORT_MAX_ERRORS:
+            errors.append({"line": line_number, "error": message})
+
+    async def flush():
+        if not batch:
+            return
+        line_numbers = [line_number for line_number, _ in batch.values()]
+        operations = [operation for _, operation in batch.values()]
+        batch.clear()
+        try:
+            result = await db.shop_items.bulk_write(operations, ordered=False)
+            summary["upserted"] += result.upserted_count
+            summary["modified"] += result.modified_count
+        except BulkWriteError as e:
+            details = e.details
+            summary["upserted"] += details.get("nUpserted", 0)
+            summary["modified"] += details.get("nModified", 0)
+            for write_error in details.get("writeErrors", []):
+                record_error(line_numbers[write_error["index"]], write_error.get("errmsg", "Write failed"))
+
+    def queue_row(line_number: int, raw: bytes):
+        summary["received"] += 1
+        try:
+            payload = json.loads(raw)
+        except ValueError as e:
+            record_error(line_number, f"Invalid JSON: {e}")
+            return
+        if not isinstance(payload, dict):
+            record_error(line_number, "Expected a JSON object")
+            return
+        try:
+            row = ShopItemImport(**payload)
+        except ValidationError as e:
+            record_error(line_number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            return
+        
+        fields = row.dict(exclude={"id", "in_stock"})
+        on_insert = {"id": row.id or str(uuid.uuid4()), "created_at": datetime.utcnow()}
+        if row.in_stock is None:
+            on_insert["in_stock"] = True
+        else:
+            fields["in_stock"] = row.in_stock
+        key = ("id", row.id) if row.id else ("name", row.name)
+        # A later line for the same item replaces an earlier one in the batch
+        batch.pop(key, None)
+        batch[key] = (line_number, UpdateOne(
+            {key[0]: key[1]},
+            {"$set": fields, "$setOnInsert": on_insert},
+            upsert=True
+        ))
+
+    line_number = 0
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for raw in lines:
+            line_number += 1
+            if raw.strip():
+                queue_row(line_number, raw)
+        if len(batch) >= SHOP_IMPORT_BATCH_SIZE:
+            await flush()
+    if pending.strip():
+        queue_row(line_number + 1, pending)
+    await flush()
+    
+    catalog_cache.invalidate()
+    await cache_invalidator.bump("shop_items")
+    summary["errors"] = errors
+    return summary
+
 @api_router.post("/shop/purchase/{item_id}")
-async def purchase_item(item_id: str, current_user: User = Depends(get_current_user)):
+async def purchase_item(item_id: str, current_user: TokenUser = Depends(get_token_user), loaders: Loaders = Depends(get_loaders)):
     """Purchase an item"""
     # Get item
-    item = await db.shop_items.find_one({"id": item_id})
+    item = await loaders.shop_items.load(item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
@@ -593,30 +1804,281 @@ async def purchase_item(item_id: str, current_user: User = Depends(get_current_u
         "item_name": item["name"],
         "price": item["price"],
         "status": "pending",
-        "created_at": datetime.utcnow()
+        "attempts": 0,
+        "created_at": datetime.utcnow(),
+        "next_attempt_at": datetime.utcnow(),
+        **await change_feed.stamp()
     }
     
     await db.purchases.insert_one(purchase)
+    fulfillment_worker.notify()
     
     return {"message": "Purchase initiated", "purchase_id": purchase["id"]}
 
-@api_router.get("/shop/purchases")
-async def get_user_purchases(current_user: User = Depends(get_current_user)):
+# Players see their purchases without the fulfillment internals (rendered
+# commands, leases, raw server errors) stored alongside
+player_purchase_fields = Fieldset(Purchase, [field for field in Purchase.model_fields if field != "last_error"])
+
+@api_router.get("/shop/purchases", response_model=List[player_purchase_fields.model])
+async def get_user_purchases(current_user: TokenUser = Depends(get_token_user)):
     """Get user's purchase history"""
-    purchases = await db.purchases.find({"user_id": current_user.id}).sort("created_at", -1).to_list(1000)
-    purchases = convert_objectid_to_str(purchases)
-    return purchases
+    return await db.purchases.find({"user_id": current_user.id}, player_purchase_fields.projection).sort("created_at", -1).to_list(1000)
 
 @api_router.get("/admin/shop/purchases")
-async def get_all_purchases(current_user: User = Depends(get_admin_user)):
+async def get_all_purchases(fieldset: Fieldset = Depends(select_fields(Purchase)), current_user: TokenUser = Depends(get_admin_user)):
     """Get all purchases (admin only)"""
-    purchases = await db.purchases.find().sort("created_at", -1).to_list(1000)
+    purchases = await db.purchases.find({}, fieldset.projection).sort("created_at", -1).to_list(1000)
     purchases = convert_objectid_to_str(purchases)
     return purchases
 
+@api_router.get("/admin/fulfillment/stats")
+async def get_fulfillment_stats(current_user: TokenUser = Depends(get_admin_user)):
+    """Get purchase fulfillment throughput and queue state (admin only)"""
+    return {
+        "worker_id": fulfillment_worker.worker_id,
+        "enabled": fulfillment_enabled,
+        "metrics": fulfillment_worker.metrics,
+        "queue": await fulfillment_worker.queue_counts()
+    }
+
+@api_router.post("/admin/shop/purchases/{purchase_id}/retry")
+async def retry_purchase(purchase_id: str, current_user: TokenUser = Depends(get_admin_user)):
+    """Move a failed or manual purchase back to the fulfillment queue (admin only)
+    
+    Delivery resumes after the last confirmed command. An unconfirmed
+    command is sent again, so only retry once it's known not to have run.
+    """
+    result = await db.purchases.update_one(
+        {"id": purchase_id, "status": {"$in": ["failed", "manual"]}},
+        {
+            "$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.utcnow(), **await change_feed.stamp()},
+            "$unset": {"failed_at": "", "sending_command": ""}
+        }
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Failed purchase not found")
+    
+    fulfillment_worker.notify()
+    return {"message": "Purchase requeued"}
+
+@api_router.post("/admin/shop/purchases/{purchase_id}/complete")
+async def complete_purchase(purchase_id: str, current_user: TokenUser = Depends(get_admin_user)):
+    """Mark a failed or manual purchase as delivered by hand (admin only)"""
+    purchase = await db.purchases.find_one_and_update(
+        {"id": purchase_id, "status": {"$in": ["failed", "manual"]}},
+        {
+            "$set": {"status": "completed", "completed_at": datetime.utcnow(), "completed_by": current_user.minecraft_username, **await change_feed.stamp()},
+            "$unset": {"failed_at": "", "sending_command": "", "last_error": ""}
+        }
+    )
+    if purchase is None:
+        raise HTTPException(status_code=404, detail="Failed purchase not found")
+    
+    await record_completed_purchase(purchase)
+    return {"message": "Purchase completed"}
+
+# Profiling endpoints
+def profiling_state() -> dict:
+    return {
+        "enabled": profiler.enabled,
+        "sample_rate": profiler.sample_rate,
+        "interval_ms": profiler.interval_seconds * 1000,
+        "max_profiles": profiler.profiles.maxlen,
+        "header": "X-Profile",
+        "header_token": profiler.header_token,
+        "profiles": [profile.summary() for profile in reversed(profiler.profiles)]
+    }
+
+@api_router.get("/admin/profiling")
+async def get_profiling(current_user: TokenUser = Depends(get_admin_user)):
+    """Get request profiler settings and recent profiles (admin only)"""
+    return profiling_state()
+
+@api_router.put("/admin/profiling")
+async def update_profiling(config: ProfilingConfig, current_user: TokenUser = Depends(get_admin_user)):
+    """Enable, disable or tune the request profiler at runtime (admin only)"""
+    # Requests sending the returned header_token in X-Profile are always profiled
+    profiler.configure(
+        enabled=config.enabled,
+        sample_rate=config.sample_rate,
+        interval_seconds=config.interval_ms / 1000,
+        max_profiles=config.max_profiles
+    )
+    return profiling_state()
+
+@api_router.get("/admin/profiling/{profile_id}")
+async def get_profile(profile_id: str, current_user: TokenUser = Depends(get_admin_user)):
+    """Get a request profile as collapsed stacks for flamegraph tools (admin only)"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.folded())
+
+# Skin endpoints
+@api_router.get("/skins/{player_uuid}", dependencies=[Depends(rate_limit_public)])
+async def get_skin(player_uuid: str, size: Optional[int] = Query(None, description="Head avatar size; omit for the full skin")):
+    """Redirect to a player's cached skin or head avatar"""
+    player_uuid = player_uuid.replace("-", "").lower()
+    if not re.fullmatch(r"[0-9a-f]{32}", player_uuid):
+        raise HTTPException(status_code=400, detail="Invalid UUID")
+    if size is not None and size not in SKIN_HEAD_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(map(str, SKIN_HEAD_SIZES))}")
+    
+    texture_hash = await resolve_texture_hash(player_uuid)
+    if texture_hash is None:
+        raise HTTPException(status_code=404, detail="Skin not found")
+    
+    name = f"head-{size}.png" if size else "skin.png"
+    # Skins change rarely, the texture URL itself is immutable
+    return RedirectResponse(
+        f"/api/skins/textures/{texture_hash}/{name}",
+        status_code=302,
+        headers={"Cache-Control": f"public, max-age={int(SKIN_LOOKUP_TTL_SECONDS)}"}
+    )
+
+@api_router.get("/skins/textures/{texture_hash}/{name}", dependencies=[Depends(rate_limit_public)])
+async def get_skin_texture(texture_hash: str, name: str):
+    """Serve a skin texture or rendered head by texture hash"""
+    allowed = {"skin.png"} | {f"head-{size}.png" for size in SKIN_HEAD_SIZES}
+    if not TEXTURE_HASH_PATTERN.match(texture_hash) or name not in allowed:
+        raise HTTPException(status_code=404, detail="Texture not found")
+    
+    try:
+        await skin_store.ensure(texture_hash, lambda: asyncio.to_thread(fetch_texture, texture_hash))
+    except SkinError as e:
+        raise HTTPException(status_code=404, detail=f"Texture unavailable: {e}")
+    except requests.RequestException as e:
+        raise HTTPException(status_code=502, detail=f"Texture server unreachable: {e}")
+    
+    return FileResponse(
+        skin_store.path(texture_hash, name),
+        media_type="image/png",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+# Metrics
+def cache_stats(attribute: str) -> dict:
+    return {(name,): getattr(cache, attribute) for name, cache in caches.items()}
+
+def cache_hit_ratio() -> dict:
+    return {
+        (name,): cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0
+        for name, cache in caches.items()
+    }
+
+registry.counter("cache_hits_total", "Cache lookups served from cache", ("cache",), callback=lambda: cache_stats("hits"))
+registry.counter("cache_misses_total", "Cache lookups that missed", ("cache",), callback=lambda: cache_stats("misses"))
+registry.gauge("cache_hit_ratio", "Share of cache lookups served from cache", ("cache",), callback=cache_hit_ratio)
+registry.gauge("write_queue_depth", "Writes queued or in progress", ("queue",), callback=lambda: {
+    ("fulfillment",): fulfillment_worker.in_flight,
+    ("rcon",): rcon_pool.in_flight if rcon_pool is not None else 0
+})
+registry.counter("cache_invalidation_events_total", "Change events and version bumps seen by the cache invalidator", callback=lambda: cache_invalidator.metrics["events"])
+registry.counter("skin_cache_events_total", "Skin texture cache outcomes", ("event",), callback=lambda: {
+    (event,): count for event, count in skin_store.metrics.items()
+})
+registry.gauge("skin_cache_bytes", "Bytes of skins and heads cached on disk", callback=lambda: skin_store.total_bytes)
+registry.counter("player_session_events_total", "Player joins and leaves seen by the status poller", ("event",), callback=lambda: {
+    ("join",): playtime_tracker.metrics["joins"],
+    ("leave",): playtime_tracker.metrics["leaves"]
+})
+registry.gauge("leader", "1 if this process runs the background jobs", callback=lambda: int(leader.is_leader))
+registry.counter("leader_job_crashes_total", "Leader jobs restarted after raising", ("job",), callback=lambda: {
+    (job,): count for job, count in leader.crashes.items()
+})
+registry.counter("fulfillment_events_total", "Purchase fulfillment outcomes", ("event",), callback=lambda: {
+    (event,): fulfillment_worker.metrics[event]
+    for event in ("claimed", "completed", "retried", "dead_lettered", "manual", "lease_lost")
+})
+
+mongo_pool_listeners = {"main": mongo_pool_listener, "analytics": analytics_pool_listener}
+registry.gauge("mongo_pool_connections", "Pooled MongoDB connections by state", ("client", "address", "state"), callback=lambda: {
+    (name, address, state): pool[state]
+    for name, listener in mongo_pool_listeners.items()
+    for address, pool in listener.stats().items()
+    for state in ("open", "in_use")
+})
+registry.counter("mongo_pool_checkouts_total", "MongoDB connection checkouts", ("client", "address", "outcome"), callback=lambda: {
+    (name, address, outcome): pool[field]
+    for name, listener in mongo_pool_listeners.items()
+    for address, pool in listener.stats().items()
+    for outcome, field in (("success", "checkouts"), ("failed", "checkout_failures"))
+})
+registry.counter("analytics_reads_total", "Admin analytics reads, by whether they kept to their time budget", ("read", "outcome"), callback=lambda: dict(analytics_reads.metrics))
+registry.counter("archived_records_total", "Log records moved to the archive", callback=lambda: log_archiver.metrics["archived"])
+registry.counter("server_anomalies_total", "Anomalies flagged in the status polls", ("kind",), callback=lambda: {
+    (kind,): count for kind, count in server_monitor.metrics.items()
+})
+registry.counter("report_jobs_total", "Report jobs by outcome, reused when an up to date one existed", ("report", "outcome"), callback=lambda: dict(report_jobs.metrics))
+registry.counter("log_records_total", "Log records by what happened to them", ("outcome",), callback=lambda: {
+    (outcome,): log_handler.metrics[outcome] for outcome in ("queued", "dropped")
+} if log_handler is not None else {})
+registry.gauge("log_queue_depth", "Log records waiting for the writer thread", callback=lambda: log_handler.depth if log_handler is not None else 0)
+registry.counter("access_log_requests_total", "Requests by whether they were logged", ("outcome",), callback=lambda: {
+    (outcome,): count for outcome, count in request_log_metrics.items()
+})
+registry.counter("rate_limit_requests_total", "Requests checked by the rate limiter", ("rule", "outcome"), callback=lambda: dict(rate_limiter.metrics))
+
+def bearer_payload(scope) -> Optional[dict]:
+    """Payload of the request's bearer token if it is valid and not revoked"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            try:
+                # A cache hit for tokens in use, one HMAC for anything else
+                payload = token_verifier.verify(token.strip())
+            except jwt.InvalidTokenError:
+                return None
+            user_id = payload.get("user_id")
+            if user_id is None or token_revocations.is_revoked(user_id, payload.get("ver", 0)):
+                return None
+            return payload
+    return None
+
+def classify_request(scope) -> Optional[str]:
+    """Admission budget for an HTTP request, None to bypass admission control
+    
+    Only a verified token earns the authenticated or admin budget, so an
+    anonymous flood can't get past the public budget with a made-up header.
+    """
+    path = scope["path"]
+    if path == "/metrics" or path.startswith("/api/health"):
+        return None
+    payload = bearer_payload(scope)
+    if payload is None:
+        return "public"
+    if payload.get("is_admin") and (path.startswith("/api/admin") or path == "/api/users"):
+        return "admin"
+    return "authenticated"
+
+admission_wait = registry.histogram("admission_queue_wait_seconds", "Time spent queued before admission", ("class",))
+admission.wait_observer = lambda budget, waited: admission_wait.observe(waited, (budget,))
+registry.gauge("admission_in_flight", "Admitted work in progress", ("class",), callback=lambda: {
+    (name,): budget.active for name, budget in admission.budgets.items()
+})
+registry.gauge("admission_queue_depth", "Work waiting for admission", ("class",), callback=lambda: {
+    (name,): budget.queued for name, budget in admission.budgets.items()
+})
+registry.counter("admission_rejected_total", "Work shed by admission control", ("class", "reason"), callback=lambda: {
+    (name, reason): budget.metrics[reason]
+    for name, budget in admission.budgets.items()
+    for reason in ("queue_full", "timeout")
+})
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_internal_access)])
+async def get_metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so CORS preflights are answered without a slot and rejections
+# still carry CORS headers
+if ADMISSION_CONTROL_ENABLED:
+    app.add_middleware(AdmissionMiddleware, controller=admission, classify=classify_request)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -624,10 +2086,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+app.add_middleware(MetricsMiddleware)
+# Outermost, so the request id covers everything and timings include
+# admission queueing
+app.add_middleware(RequestLogMiddleware, sample_rate=ACCESS_LOG_SAMPLE_RATE, slow_ms=ACCESS_LOG_SLOW_MS, metrics=request_log_metrics)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
\ No newline at end of file
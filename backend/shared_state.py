@@ -0,0 +1,416 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStore(ABC):
+    """Key/value store and lease manager shared by all worker processes
+
+    Values must be JSON-compatible. Leases are held by an owner id until they
+    expire or are released; acquiring a lease you already hold renews it.
+    Token buckets refill at `rate` tokens per second up to `burst`; take_tokens
+    returns 0 when the tokens were taken, or the seconds until they would be.
+    """
+
+    async def setup(self):
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def release_lease(self, name: str, owner: str):
+        ...
+
+    @abstractmethod
+    async def take_tokens(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        ...
+
+    async def sweep_tokens(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MongoSharedStore(SharedStore):
+    """Shared store backed by a MongoDB collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def setup(self):
+        # Mongo's TTL monitor only runs once a minute, reads check expiry too
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str) -> Optional[Any]:
+        doc = await self.collection.find_one({"_id": f"value:{key}"})
+        if doc is None or (doc.get("expires_at") and doc["expires_at"] < datetime.utcnow()):
+            return None
+        return json.loads(doc["value"])
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds) if ttl_seconds else None
+        await self.collection.update_one(
+            {"_id": f"value:{key}"},
+            {"$set": {"value": json.dumps(value), "expires_at": expires_at}},
+            upsert=True
+        )
+
+    async def delete(self, key: str):
+        await self.collection.delete_one({"_id": f"value:{key}"})
+
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            # Matches if we already own the lease or it has expired; otherwise
+            # the upsert collides with the holder's document
+            await self.collection.update_one(
+                {"_id": f"lease:{name}", "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def release_lease(self, name: str, owner: str):
+        await self.collection.delete_one({"_id": f"lease:{name}", "owner": owner})
+
+    async def take_tokens(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        now = datetime.utcnow()
+        elapsed_ms = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}]}
+        # Refill, decide and charge in one atomic pipeline update; the TTL
+        # index removes buckets once they would be full again
+        doc = await self.collection.find_one_and_update(
+            {"_id": f"bucket:{key}"},
+            [
+                {"$set": {"tokens": {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed_ms, rate / 1000]}]}]}}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "updated_at": now,
+                    "expires_at": now + timedelta(seconds=burst / rate),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return 0.0 if doc["allowed"] else (cost - doc["tokens"]) / rate
+
+
+class FileSharedStore(SharedStore):
+    """Shared store in a directory on the local machine, typically under /dev/shm
+
+    Each write takes an exclusive flock, so processes on the same host see
+    a consistent view. Waiting for the lock blocks while another process
+    holds it, so file operations run in a thread, off the event loop.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.directory / ".lock"
+
+    def _path(self, kind: str, key: str) -> Path:
+        return self.directory / f"{kind}-{key.replace('/', '_')}.json"
+
+    async def _locked(self, operation: Callable[[], Any]) -> Any:
+        return await asyncio.to_thread(self._run_locked, operation)
+
+    def _run_locked(self, operation: Callable[[], Any]) -> Any:
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return operation()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            entry = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("expires_at") is not None and entry["expires_at"] < time.time():
+            return None
+        return entry
+
+    def _take_tokens(self, path: Path, rate: float, burst: float, cost: float) -> float:
+        now = time.time()
+        entry = self._read(path) or {"tokens": burst, "updated_at": now}
+        tokens = min(burst, entry["tokens"] + max(0.0, now - entry["updated_at"]) * rate)
+        wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+        if not wait:
+            tokens -= cost
+        self._write(path, {"tokens": tokens, "updated_at": now, "expires_at": now + burst / rate})
+        return wait
+
+    def _write(self, path: Path, entry: Dict[str, Any]):
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(entry))
+        temporary.replace(path)
+
+    async def get(self, key: str) -> Optional[Any]:
+        # Writes replace files atomically, so reads need no lock
+        entry = await asyncio.to_thread(self._read, self._path("value", key))
+        return entry["value"] if entry else None
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        entry = {"value": value, "expires_at": time.time() + ttl_seconds if ttl_seconds else None}
+        await self._locked(lambda: self._write(self._path("value", key), entry))
+
+    async def delete(self, key: str):
+        await self._locked(lambda: self._path("value", key).unlink(missing_ok=True))
+
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        path = self._path("lease", name)
+
+        def acquire():
+            entry = self._read(path)
+            if entry is not None and entry["owner"] != owner:
+                return False
+            self._write(path, {"owner": owner, "expires_at": time.time() + ttl_seconds})
+            return True
+
+        return await self._locked(acquire)
+
+    async def release_lease(self, name: str, owner: str):
+        path = self._path("lease", name)
+
+        def release():
+            entry = self._read(path)
+            if entry is not None and entry["owner"] == owner:
+                path.unlink(missing_ok=True)
+
+        await self._locked(release)
+
+    async def take_tokens(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        path = self._path("bucket", key)
+        return await self._locked(lambda: self._take_tokens(path, rate, burst, cost))
+
+    async def sweep_tokens(self):
+        def sweep():
+            now = time.time()
+            for path in self.directory.glob("bucket-*.json"):
+                try:
+                    if json.loads(path.read_text()).get("expires_at", 0) < now:
+                        path.unlink(missing_ok=True)
+                except (FileNotFoundError, ValueError):
+                    pass
+
+        await self._locked(sweep)
+
+
+class RedisSharedStore(SharedStore):
+    """Shared store on any Redis-compatible server
+
+    Works with redis.asyncio clients and stand-ins that support GET, SET with
+    PX/NX, DEL and EVAL.
+    """
+
+    # Renew if we hold the lease, otherwise take it only if it is free
+    ACQUIRE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2]) and 1 or 0
+    end
+    return redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') and 1 or 0
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    TAKE_TOKENS_SCRIPT = """
+    local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+    return tostring(wait)
+    """
+
+    def __init__(self, redis, prefix: str = "terra:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self.redis.get(f"{self.prefix}value:{key}")
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        await self.redis.set(
+            f"{self.prefix}value:{key}",
+            json.dumps(value),
+            px=int(ttl_seconds * 1000) if ttl_seconds else None
+        )
+
+    async def delete(self, key: str):
+        await self.redis.delete(f"{self.prefix}value:{key}")
+
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        result = await self.redis.eval(self.ACQUIRE_SCRIPT, 1, f"{self.prefix}lease:{name}", owner, int(ttl_seconds * 1000))
+        return bool(result)
+
+    async def release_lease(self, name: str, owner: str):
+        await self.redis.eval(self.RELEASE_SCRIPT, 1, f"{self.prefix}lease:{name}", owner)
+
+    async def take_tokens(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        # Lua numbers come back truncated to integers, so the wait is a string
+        wait = await self.redis.eval(self.TAKE_TOKENS_SCRIPT, 1, f"{self.prefix}bucket:{key}", rate, burst, cost, time.time())
+        return float(wait)
+
+    async def close(self):
+        close = getattr(self.redis, "aclose", None) or getattr(self.redis, "close", None)
+        if close is not None:
+            await close()
+
+
+def create_shared_store(url: str, db) -> SharedStore:
+    """Build the store selected by SHARED_STATE_URL
+
+    "mongo" (the default) uses the shared_state collection, "file:///dev/shm/x"
+    a local directory and "redis://..." a Redis server (needs the redis package).
+    """
+    scheme = urlparse(url).scheme or url
+    if scheme == "mongo":
+        return MongoSharedStore(db.shared_state)
+    if scheme == "file":
+        return FileSharedStore(urlparse(url).path)
+    if scheme in ("redis", "rediss", "unix"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_URL points to Redis but the redis package is not installed")
+        return RedisSharedStore(redis_asyncio.from_url(url))
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+class LeaderElector:
+    """Elects one process to run background jobs, using a lease in the shared store
+
+    Every process calls run(); the lease holder starts the registered jobs and
+    renews the lease every ttl/3. If renewal fails the jobs are cancelled, and
+    another process takes over once the lease expires. A job that raises is
+    logged and restarted after an exponential backoff, reset once it has run
+    for longer than the longest backoff.
+    """
+
+    def __init__(
+        self,
+        store: SharedStore,
+        name: str = "leader",
+        ttl_seconds: float = 15,
+        restart_backoff_seconds: float = 1,
+        max_restart_backoff_seconds: float = 60
+    ):
+        self.store = store
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.restart_backoff_seconds = restart_backoff_seconds
+        self.max_restart_backoff_seconds = max_restart_backoff_seconds
+        self.owner = f"{os.getpid()}:{uuid.uuid4()}"
+        self.is_leader = False
+        # Job name -> crashes
+        self.crashes: Counter = Counter()
+        self._jobs: List[Callable[[], Awaitable[None]]] = []
+        self._job_tasks: List[asyncio.Task] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def add_job(self, job: Callable[[], Awaitable[None]]):
+        self._jobs.append(job)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._step_down()
+        try:
+            await self.store.release_lease(self.name, self.owner)
+        except Exception as e:
+            logger.error(f"Failed to release leadership lease: {e}")
+
+    async def run(self):
+        while True:
+            try:
+                acquired = await self.store.acquire_lease(self.name, self.owner, self.ttl_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Leader election failed: {e}")
+                acquired = False
+            if acquired and not self.is_leader:
+                logger.info(f"Process {self.owner} elected leader for {self.name}")
+                self.is_leader = True
+                self._job_tasks = [asyncio.create_task(self._supervise(job)) for job in self._jobs]
+            elif not acquired and self.is_leader:
+                logger.warning(f"Process {self.owner} lost leadership for {self.name}")
+                await self._step_down()
+            await asyncio.sleep(self.ttl_seconds / 3)
+
+    async def _supervise(self, job: Callable[[], Awaitable[None]]):
+        name = getattr(job, "__qualname__", repr(job))
+        failures = 0
+        while True:
+            started = time.monotonic()
+            try:
+                await job()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.crashes[name] += 1
+                if time.monotonic() - started > self.max_restart_backoff_seconds:
+                    failures = 0
+                delay = min(self.max_restart_backoff_seconds, self.restart_backoff_seconds * 2 ** failures)
+                failures += 1
+                logger.exception(f"Leader job {name} crashed, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+    async def _step_down(self):
+        self.is_leader = False
+        for task in self._job_tasks:
+            task.cancel()
+        await asyncio.gather(*self._job_tasks, return_exceptions=True)
+        self._job_tasks = []
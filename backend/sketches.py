@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    """Cardinality sketch with 2^precision one-byte registers
+
+    The standard error is about 1.04 / sqrt(2^precision), 1.6% at the default
+    precision of 12 (4 KiB). Sketches with the same precision merge by taking
+    the register-wise maximum, which estimates the size of the union.
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f"Expected {self.size} registers, got {len(self.registers)}")
+
+    def add(self, item: str) -> bool:
+        """Add an item, returning whether any register changed"""
+        value = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        index = value >> (64 - self.precision)
+        remaining = value & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        merged = np.maximum(np.frombuffer(self.registers, dtype=np.uint8), np.frombuffer(other.registers, dtype=np.uint8))
+        self.registers = bytearray(merged.tobytes())
+
+    def count(self) -> int:
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(registers == 0))
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+
+class ActiveUserSketches:
+    """Daily active-user sketches, updated in memory and merged into MongoDB
+
+    record() only touches the in-memory sketch for the day. A background task
+    periodically merges changed sketches into the activity_sketches
+    collection with a compare-and-swap on a version field, so any number of
+    workers can contribute to the same day. Windows are estimated by merging
+    the daily sketches they cover.
+    """
+
+    def __init__(self, collection, precision: int = 12, flush_interval_seconds: float = 10, retention_days: int = 400):
+        self.collection = collection
+        self.precision = precision
+        self.flush_interval_seconds = flush_interval_seconds
+        self.retention_days = retention_days
+        self._pending: Dict[date, HyperLogLog] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def record(self, user_id: str, at: Optional[datetime] = None):
+        day = (at or datetime.utcnow()).date()
+        sketch = self._pending.get(day)
+        if sketch is None:
+            sketch = self._pending[day] = HyperLogLog(self.precision)
+        sketch.add(user_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to persist activity sketches: {e}")
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        error = None
+        for day, sketch in pending.items():
+            try:
+                await self._merge_into_store(day, sketch)
+            except Exception as e:
+                # Keep it for the next flush, merged with whatever arrived since
+                if day in self._pending:
+                    self._pending[day].merge(sketch)
+                else:
+                    self._pending[day] = sketch
+                error = e
+        if error is not None:
+            raise error
+
+    async def _merge_into_store(self, day: date, sketch: HyperLogLog):
+        key = day.isoformat()
+        while True:
+            doc = await self.collection.find_one({"_id": key})
+            if doc is None:
+                try:
+                    await self.collection.insert_one({
+                        "_id": key,
+                        "registers": Binary(bytes(sketch.registers)),
+                        "precision": self.precision,
+                        "version": 1,
+                        "expires_at": datetime.combine(day, datetime.min.time()) + timedelta(days=self.retention_days),
+                    })
+                    return
+                except DuplicateKeyError:
+                    # Another worker created the day first, merge into theirs
+                    continue
+            merged = HyperLogLog(self.precision, doc["registers"])
+            merged.merge(sketch)
+            if bytes(merged.registers) == bytes(doc["registers"]):
+                return
+            result = await self.collection.update_one(
+                {"_id": key, "version": doc["version"]},
+                {"$set": {"registers": Binary(bytes(merged.registers))}, "$inc": {"version": 1}}
+            )
+            if result.modified_count:
+                return
+
+    async def estimate(self, days: Iterable[date]) -> int:
+        """Distinct users active on any of the given days"""
+        days = list(days)
+        total = HyperLogLog(self.precision)
+        async for doc in self.collection.find({"_id": {"$in": [day.isoformat() for day in days]}}):
+            total.merge(HyperLogLog(self.precision, doc["registers"]))
+        # Include what this worker has not written yet
+        for day in days:
+            if day in self._pending:
+                total.merge(self._pending[day])
+        return total.count()
+
+    async def window(self, end: date, days: int) -> int:
+        return await self.estimate(end - timedelta(days=offset) for offset in range(days))
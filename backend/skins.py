@@ -0,0 +1,178 @@
+import asyncio
+import io
+import logging
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TEXTURE_HASH_PATTERN = re.compile(r"^[0-9a-f]{16,64}$")
+# Skins are 64x64; high resolution packs go up to 16 times that
+MAX_TEXTURE_SIDE = 1024
+
+
+class SkinError(Exception):
+    """Raised for textures that can't be fetched or decoded"""
+
+
+def texture_hash_from_url(url: str) -> Optional[str]:
+    """Textures are content addressed: the last path segment is their hash"""
+    texture_hash = url.rstrip("/").rsplit("/", 1)[-1].lower()
+    return texture_hash if TEXTURE_HASH_PATTERN.match(texture_hash) else None
+
+
+def decode_skin(data: bytes) -> Image.Image:
+    """Decode a PNG texture to RGBA
+
+    The size in the header is checked before any pixel data is inflated, so
+    the decompressed size is bounded by MAX_TEXTURE_SIDE squared. Pillow
+    rejects chunks whose CRC doesn't match.
+    """
+    try:
+        image = Image.open(io.BytesIO(data), formats=["PNG"])
+        if image.width > MAX_TEXTURE_SIDE or image.height > MAX_TEXTURE_SIDE:
+            raise SkinError("Texture too large")
+        image.load()
+        return image.convert("RGBA")
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise SkinError(f"Invalid PNG: {e}")
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def render_head(skin: Image.Image, size: int) -> Image.Image:
+    """Front face of the head with the hat layer on top, scaled to size x size"""
+    if skin.width < 64 or skin.height < 16:
+        raise SkinError("Not a Minecraft skin")
+    # Skins are 64x64 or legacy 64x32, possibly at a higher resolution
+    scale = skin.width // 64
+    face = skin.crop((8 * scale, 8 * scale, 16 * scale, 16 * scale))
+    face.putalpha(255)
+    hat = skin.crop((40 * scale, 8 * scale, 48 * scale, 16 * scale))
+    # Nearest neighbour keeps the pixel-art look
+    return Image.alpha_composite(face, hat).resize((size, size), Image.NEAREST)
+
+
+class SkinStore:
+    """On-disk cache of skin textures and pre-rendered heads, keyed by texture hash
+
+    Each texture gets a directory holding skin.png and head-<size>.png. Since a
+    hash always names the same texture, files never change once written and
+    can be served as immutable. Directories are evicted least recently used
+    first once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, head_sizes: Iterable[int] = (16, 32, 64, 128)):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.head_sizes = tuple(head_sizes)
+        self.total_bytes = 0
+        self.metrics = {"hits": 0, "fetched": 0, "evicted": 0, "errors": 0}
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def load(self):
+        """Index the textures already on disk, oldest use first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        for entry in self.directory.iterdir():
+            if entry.is_dir() and TEXTURE_HASH_PATTERN.match(entry.name):
+                files = list(entry.iterdir())
+                if not (entry / "skin.png").exists():
+                    continue
+                found.append((entry.stat().st_mtime, entry.name, sum(f.stat().st_size for f in files)))
+        for _, texture_hash, size in sorted(found):
+            self._entries[texture_hash] = size
+            self.total_bytes += size
+        self._evict()
+
+    def path(self, texture_hash: str, name: str) -> Path:
+        return self.directory / texture_hash / name
+
+    def touch(self, texture_hash: str) -> bool:
+        """Mark a texture as used, returning whether it is cached"""
+        if texture_hash not in self._entries:
+            return False
+        if not self.path(texture_hash, "skin.png").exists():
+            # Evicted by another worker sharing the directory
+            self.total_bytes -= self._entries.pop(texture_hash)
+            return False
+        self._entries.move_to_end(texture_hash)
+        self.metrics["hits"] += 1
+        try:
+            # Keeps the LRU order across restarts
+            os.utime(self.directory / texture_hash)
+        except OSError:
+            pass
+        return True
+
+    async def ensure(self, texture_hash: str, fetch: Callable[[], Awaitable[bytes]]):
+        """Make sure a texture and its heads are on disk, fetching it at most once"""
+        if self.touch(texture_hash):
+            return
+        pending = self._pending.get(texture_hash)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending[texture_hash] = future
+        try:
+            data = await fetch()
+            size = await asyncio.to_thread(self._store, texture_hash, data)
+            self._entries[texture_hash] = size
+            self.total_bytes += size
+            self.metrics["fetched"] += 1
+            self._evict(keep=texture_hash)
+            future.set_result(None)
+        except Exception as e:
+            self.metrics["errors"] += 1
+            future.set_exception(e)
+            # Waiters re-raise it; mark it retrieved so an unawaited future doesn't log
+            future.exception()
+            raise
+        finally:
+            del self._pending[texture_hash]
+
+    def _store(self, texture_hash: str, data: bytes) -> int:
+        skin = decode_skin(data)
+        final = self.directory / texture_hash
+        staging = self.directory / f".{texture_hash}.{os.getpid()}.tmp"
+        staging.mkdir(parents=True, exist_ok=True)
+        files = {"skin.png": data}
+        for size in self.head_sizes:
+            files[f"head-{size}.png"] = encode_png(render_head(skin, size))
+        for name, content in files.items():
+            (staging / name).write_bytes(content)
+        # Another worker may have stored the same texture meanwhile
+        try:
+            staging.rename(final)
+        except OSError:
+            for name in files:
+                (staging / name).unlink(missing_ok=True)
+            staging.rmdir()
+        return sum(len(content) for content in files.values())
+
+    def _evict(self, keep: Optional[str] = None):
+        while self.total_bytes > self.max_bytes and self._entries:
+            texture_hash, size = next(iter(self._entries.items()))
+            if texture_hash == keep:
+                break
+            del self._entries[texture_hash]
+            self.total_bytes -= size
+            self.metrics["evicted"] += 1
+            directory = self.directory / texture_hash
+            for file in directory.glob("*"):
+                file.unlink(missing_ok=True)
+            try:
+                directory.rmdir()
+            except OSError:
+                pass
@@ -0,0 +1,144 @@
+import base64
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ChangeFeed:
+    """What changed in a set of collections since a cursor, for clients keeping copies
+
+    Writers stamp every document they insert or update with a sequence
+    number (stamp()) and record deletions as tombstones, which are kept for
+    tombstone_ttl_seconds. A client syncs by asking for everything stamped
+    after its cursor and applying it by id.
+
+    Sequence numbers are the stamp time in microseconds, kept increasing
+    within the process, so stamping costs no round trip and processes don't
+    contend on a shared counter. Numbers are handed out before the write
+    lands, and clocks of different hosts drift apart, so a write can become
+    visible after one with a higher number. The cursor is therefore only
+    advanced past changes older than settle_seconds, which must exceed the
+    clock skew between hosts; newer ones are sent again next time, which is
+    harmless since applying a change twice is a no-op.
+    """
+
+    def __init__(
+        self,
+        db,
+        collections: Dict[str, Optional[Dict[str, Any]]],
+        settle_seconds: float = 5,
+        tombstone_ttl_seconds: float = 7 * 24 * 3600
+    ):
+        self.db = db
+        # Collection name -> projection of the documents sent to clients
+        self.collections = collections
+        self.settle_seconds = settle_seconds
+        self.tombstone_ttl_seconds = tombstone_ttl_seconds
+        self.tombstones = db.sync_tombstones
+        self._last_seq = 0
+
+    async def setup(self):
+        for collection in self.collections:
+            await self.db[collection].create_index("sync_seq", sparse=True)
+        await self.tombstones.create_index("sync_seq")
+        await self.tombstones.create_index("deleted_at", expireAfterSeconds=int(self.tombstone_ttl_seconds))
+
+    async def stamp(self) -> Dict[str, Any]:
+        """Fields to $set on (or insert with) the documents of one write"""
+        now = datetime.utcnow()
+        # Microseconds since EPOCH, kept increasing within the process
+        self._last_seq = max(self._last_seq + 1, (now - EPOCH) // timedelta(microseconds=1))
+        return {"sync_seq": self._last_seq, "synced_at": now}
+
+    async def tombstone(self, collection: str, doc_id: str):
+        stamp = await self.stamp()
+        await self.tombstones.insert_one({"collection": collection, "id": doc_id, "deleted_at": stamp["synced_at"], **stamp})
+
+    @staticmethod
+    def encode_cursor(seq: int, issued_at: datetime) -> str:
+        return base64.urlsafe_b64encode(f"{seq}|{issued_at.isoformat()}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[int, datetime]:
+        """Raises ValueError for malformed cursors"""
+        try:
+            seq, issued_at = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return int(seq), datetime.fromisoformat(issued_at)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid cursor: {e}")
+
+    async def cursor(self) -> str:
+        """A cursor to take before loading full copies, to sync from afterwards"""
+        now = datetime.utcnow()
+        settled = {"synced_at": {"$lte": now - timedelta(seconds=self.settle_seconds)}}
+        seq = 0
+        for collection in [*self.collections, self.tombstones.name]:
+            latest = await self.db[collection].find(settled, {"sync_seq": 1}).sort("sync_seq", -1).limit(1).to_list(1)
+            if latest:
+                seq = max(seq, latest[0]["sync_seq"])
+        return self.encode_cursor(seq, now)
+
+    async def changes(self, cursor: str, limit: int = 500) -> Dict[str, Any]:
+        """Up to `limit` changes after the cursor, oldest first
+
+        All documents of one write share a sequence number and come on the
+        same page, even if that makes the page longer than `limit`. Returns
+        {"reset": True} when the cursor is older than the tombstones, in which
+        case the client has to reload everything. has_more is False while the
+        next changes are too recent to advance the cursor past, so clients
+        paging until it clears don't spin on them.
+        """
+        seq, issued_at = self.decode_cursor(cursor)
+        now = datetime.utcnow()
+        if issued_at < now - timedelta(seconds=self.tombstone_ttl_seconds):
+            return {"reset": True, "cursor": await self.cursor()}
+
+        # The lowest `limit` sequence numbers overall are among the lowest
+        # `limit` of each source
+        entries = await self._entries({"sync_seq": {"$gt": seq}}, limit + 1)
+        has_more = len(entries) > limit
+        page = entries[:limit]
+        if has_more and entries[limit][0] == page[-1][0]:
+            # The page ends inside a write; take all of it so the cursor can
+            # move past it
+            boundary = page[-1][0]
+            page = [entry for entry in page if entry[0] != boundary] + await self._entries({"sync_seq": boundary})
+
+        changes: Dict[str, List[Dict[str, Any]]] = {collection: [] for collection in self.collections}
+        deleted: Dict[str, List[str]] = {collection: [] for collection in self.collections}
+        settled_before = now - timedelta(seconds=self.settle_seconds)
+        next_seq = seq
+        settled = True
+        for index, (entry_seq, synced_at, collection, doc) in enumerate(page):
+            if collection is None:
+                deleted.setdefault(doc["collection"], []).append(doc["id"])
+            else:
+                changes[collection].append(doc)
+            # Advance over settled changes only, and only past whole writes
+            settled = settled and synced_at <= settled_before
+            next_entry_seq = page[index + 1][0] if index + 1 < len(page) else None
+            if settled and next_entry_seq != entry_seq:
+                next_seq = entry_seq
+
+        return {
+            "reset": False,
+            "cursor": self.encode_cursor(next_seq, now),
+            "changes": changes,
+            "deleted": deleted,
+            "has_more": has_more and next_seq != seq,
+        }
+
+    async def _entries(self, query: Dict[str, Any], limit: Optional[int] = None) -> List[tuple]:
+        """(sync_seq, synced_at, collection, document) of matching changes by
+        sync_seq, up to `limit` per source; tombstones have collection None"""
+        entries: List[tuple] = []
+        for collection, projection in self.collections.items():
+            if projection and any(value for field, value in projection.items() if field != "_id"):
+                projection = {**projection, "sync_seq": 1, "synced_at": 1}
+            async for doc in self.db[collection].find(query, projection).sort("sync_seq", 1).limit(limit or 0):
+                entries.append((doc.pop("sync_seq"), doc.pop("synced_at"), collection, doc))
+        async for tombstone in self.tombstones.find(query).sort("sync_seq", 1).limit(limit or 0):
+            entries.append((tombstone["sync_seq"], tombstone["synced_at"], None, tombstone))
+        entries.sort(key=lambda entry: entry[0])
+        return entries
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+
+class TokenVerifier:
+    """Decodes JWTs, remembering verified payloads until their tokens expire
+
+    Verified payloads are kept in a bounded LRU keyed by the raw token, so a
+    client reusing its token skips signature verification entirely. Only
+    tokens that verified successfully are cached.
+    """
+
+    def __init__(self, secret: str, algorithm: str, max_entries: int = 10000):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._verified: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._verified)
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Payload of a valid token, raising jwt.InvalidTokenError otherwise"""
+        payload = self._verified.get(token)
+        if payload is not None:
+            if payload["exp"] > time.time():
+                self._verified.move_to_end(token)
+                self.hits += 1
+                return payload
+            del self._verified[token]
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+        self.misses += 1
+        payload = jwt.decode(token, self.secret, algorithms=[self.algorithm], options={"require": ["exp"]})
+        self._verified[token] = payload
+        if len(self._verified) > self.max_entries:
+            self._verified.popitem(last=False)
+        return payload
+
+
+class TokenRevocations:
+    """Oldest token version still accepted for users whose tokens were revoked
+
+    A revocation only has to outlive the tokens it revokes, so entries expire
+    one token lifetime after they are recorded and the map holds just the
+    users revoked within that window. They are persisted in a TTL-indexed
+    collection so every instance can reload them; a user revoked for good
+    (deleted) has no accepted version at all.
+    """
+
+    def __init__(self, collection, token_ttl_seconds: float):
+        self.collection = collection
+        self.token_ttl_seconds = token_ttl_seconds
+        # user id -> (oldest accepted version or None for none, expires_at)
+        self._revoked: Dict[str, Tuple[Optional[int], datetime]] = {}
+        self._reload_task: Optional[asyncio.Task] = None
+        self._reload_pending = False
+
+    def __len__(self):
+        return len(self._revoked)
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def is_revoked(self, user_id: str, version: int) -> bool:
+        entry = self._revoked.get(user_id)
+        if entry is None:
+            return False
+        min_version, expires_at = entry
+        if expires_at <= datetime.utcnow():
+            del self._revoked[user_id]
+            return False
+        return min_version is None or version < min_version
+
+    async def revoke(self, user_id: str, min_version: Optional[int] = None):
+        """Reject the user's tokens older than min_version, or all of them"""
+        expires_at = datetime.utcnow() + timedelta(seconds=self.token_ttl_seconds)
+        self._revoked[user_id] = (min_version, expires_at)
+        await self.collection.update_one(
+            {"_id": user_id},
+            {"$set": {"min_version": min_version, "expires_at": expires_at}},
+            upsert=True
+        )
+
+    async def load(self):
+        """Merge in revocations recorded by any instance"""
+        async for doc in self.collection.find({"expires_at": {"$gt": datetime.utcnow()}}):
+            current = self._revoked.get(doc["_id"])
+            # The later expiry is the more recent revocation; the stored one
+            # is the latest write when both fall in the same millisecond
+            if current is None or current[1] <= doc["expires_at"]:
+                self._revoked[doc["_id"]] = (doc.get("min_version"), doc["expires_at"])
+
+    def reload_soon(self):
+        self._reload_pending = True
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload())
+
+    async def _reload(self):
+        # Reload again if asked to while a reload was already running
+        while self._reload_pending:
+            self._reload_pending = False
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Failed to reload token revocations: {e}")
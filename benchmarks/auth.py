@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of per-request authentication overhead
+
+Times, in process and without a server, what get_token_user does with a
+token: a full JWT signature check, the verified-token cache hit that
+replaces it for a returning client, and the revocation lookup done on every
+request. The end-to-end effect shows up in run.py's authenticated scenario.
+
+    python benchmarks/auth.py --iterations 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import jwt
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from tokens import TokenRevocations, TokenVerifier  # noqa: E402
+
+SECRET = "benchmark-secret-key-of-sufficient-length"
+ALGORITHM = "HS256"
+
+
+def make_token(user_id: str) -> str:
+    payload = {
+        "user_id": user_id,
+        "username": user_id,
+        "is_admin": False,
+        "ver": 0,
+        "exp": datetime.utcnow() + timedelta(hours=1),
+    }
+    return jwt.encode(payload, SECRET, algorithm=ALGORITHM)
+
+
+def time_per_call(func, iterations: int) -> float:
+    """Mean microseconds per call"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request token verification")
+    parser.add_argument("--iterations", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=1000, help="distinct tokens in rotation")
+    parser.add_argument("--revoked", type=int, default=1000, help="revocations held in memory")
+    args = parser.parse_args()
+
+    tokens = [make_token(f"user-{i}") for i in range(args.users)]
+    verifier = TokenVerifier(SECRET, ALGORITHM, max_entries=args.users)
+    revocations = TokenRevocations(collection=None, token_ttl_seconds=3600)
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    for i in range(args.revoked):
+        revocations._revoked[f"revoked-{i}"] = (1, expires_at)
+    for token in tokens:
+        verifier.verify(token)
+
+    counter = iter(range(sys.maxsize))
+
+    def next_token():
+        return tokens[next(counter) % len(tokens)]
+
+    def decode():
+        jwt.decode(next_token(), SECRET, algorithms=[ALGORITHM])
+
+    def cached():
+        verifier.verify(next_token())
+
+    def cached_and_revocation():
+        payload = verifier.verify(next_token())
+        revocations.is_revoked(payload["user_id"], payload["ver"])
+
+    result = {
+        "iterations": args.iterations,
+        "tokens": args.users,
+        "revocations": args.revoked,
+        "microseconds_per_request": {
+            "jwt_decode": round(time_per_call(decode, args.iterations), 3),
+            "cached_verify": round(time_per_call(cached, args.iterations), 3),
+            "cached_verify_and_revocation_check": round(time_per_call(cached_and_revocation, args.iterations), 3),
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
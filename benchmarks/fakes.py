@@ -0,0 +1,231 @@
+"""
+Local stand-ins for the external services the backend talks to:
+the Mojang profile/session APIs, the Minecraft status ping and RCON.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from rcon import MAX_FRAGMENT_SIZE, encode_packet, read_packet  # noqa: E402
+
+
+def fake_uuid(username: str) -> str:
+    return hashlib.md5(username.lower().encode()).hexdigest()
+
+
+class FakeMojangServer:
+    """Threaded HTTP server answering the two Mojang endpoints the backend uses
+
+    Every username resolves except those starting with "invalid".
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.requests += 1
+                if fake.latency_ms:
+                    time.sleep(fake.latency_ms / 1000)
+                parts = self.path.strip("/").split("/")
+                if parts[:3] == ["users", "profiles", "minecraft"] and len(parts) == 4:
+                    username = parts[3]
+                    if username.lower().startswith("invalid"):
+                        return self._reply(404, {"errorMessage": f"Couldn't find any profile with name {username}"})
+                    return self._reply(200, {"id": fake_uuid(username), "name": username})
+                if parts[:3] == ["session", "minecraft", "profile"] and len(parts) == 4:
+                    textures = {"textures": {"SKIN": {"url": f"http://textures.invalid/texture/{parts[3]}"}}}
+                    value = base64.b64encode(json.dumps(textures).encode()).decode()
+                    return self._reply(200, {"id": parts[3], "name": "", "properties": [{"name": "textures", "value": value}]})
+                self._reply(404, {"error": "Not Found"})
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.url = f"http://{self.host}:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-mojang", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def _write_varint(value: int) -> bytes:
+    out = bytearray()
+    value &= 0xFFFFFFFF
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+async def _read_varint(reader: asyncio.StreamReader) -> int:
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+    raise ValueError("VarInt too long")
+
+
+def _mc_packet(packet_id: int, payload: bytes) -> bytes:
+    body = _write_varint(packet_id) + payload
+    return _write_varint(len(body)) + body
+
+
+class FakeMinecraftServer:
+    """Minecraft server stand-in speaking the status ping and RCON protocols
+
+    Runs its own event loop in a background thread. The player sample can be
+    changed at any time through ``players``. RCON responses longer than
+    MAX_FRAGMENT_SIZE are split like Minecraft does; commands listed in
+    ``stalled_commands`` are never answered, ``sleep <seconds>`` is answered
+    after that long, and drop_rcon_connections() hangs up on every RCON
+    client.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", rcon_password: str = "bench", max_players: int = 100):
+        self.host = host
+        self.rcon_password = rcon_password
+        self.max_players = max_players
+        self.players = [f"Player{i}" for i in range(12)]
+        self.status_requests = 0
+        self.rcon_commands = 0
+        self.rcon_connections = 0
+        self.stalled_commands = set()
+        self.status_port = None
+        self.rcon_port = None
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._rcon_writers = set()
+
+    def start(self):
+        threading.Thread(target=self._run, name="fake-minecraft", daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        async def shutdown():
+            # Finish open connections here rather than leave them to be
+            # destroyed with the loop
+            handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in handlers:
+                task.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            self._loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+
+    def drop_rcon_connections(self):
+        def drop():
+            for writer in list(self._rcon_writers):
+                writer.close()
+        self._loop.call_soon_threadsafe(drop)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        status_server = self._loop.run_until_complete(asyncio.start_server(self._handle_status, self.host, 0))
+        rcon_server = self._loop.run_until_complete(asyncio.start_server(self._handle_rcon, self.host, 0))
+        self.status_port = status_server.sockets[0].getsockname()[1]
+        self.rcon_port = rcon_server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def status_json(self) -> dict:
+        return {
+            "version": {"name": "1.20.4", "protocol": 765},
+            "players": {
+                "online": len(self.players),
+                "max": self.max_players,
+                "sample": [{"name": name, "id": fake_uuid(name)} for name in self.players[:12]],
+            },
+            "description": {"text": "Benchmark server"},
+        }
+
+    async def _handle_status(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                length = await _read_varint(reader)
+                data = await reader.readexactly(length)
+                packet_id = data[0]
+                if packet_id == 0x00 and len(data) > 1:
+                    # Handshake, nothing to answer
+                    continue
+                if packet_id == 0x00:
+                    self.status_requests += 1
+                    payload = json.dumps(self.status_json()).encode()
+                    writer.write(_mc_packet(0x00, _write_varint(len(payload)) + payload))
+                elif packet_id == 0x01:
+                    writer.write(_mc_packet(0x01, data[1:9]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_rcon(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        authenticated = False
+        self.rcon_connections += 1
+        self._rcon_writers.add(writer)
+        try:
+            while True:
+                request_id, packet_type, body = await read_packet(reader)
+                if packet_type == 3:
+                    authenticated = body == self.rcon_password
+                    writer.write(encode_packet(request_id if authenticated else -1, 2, ""))
+                elif not authenticated:
+                    break
+                elif packet_type == 2:
+                    self.rcon_commands += 1
+                    if body in self.stalled_commands:
+                        continue
+                    if body.startswith("sleep "):
+                        await asyncio.sleep(float(body[len("sleep "):]))
+                    response = self._run_command(body)
+                    for start in range(0, max(len(response), 1), MAX_FRAGMENT_SIZE):
+                        writer.write(encode_packet(request_id, 0, response[start:start + MAX_FRAGMENT_SIZE]))
+                else:
+                    writer.write(encode_packet(request_id, 0, f"Unknown request {packet_type:x}"))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._rcon_writers.discard(writer)
+            writer.close()
+
+    def _run_command(self, command: str) -> str:
+        if command == "list":
+            return f"There are {len(self.players)} of a max of {self.max_players} players online: {', '.join(self.players)}"
+        if command.startswith("echo "):
+            return command[len("echo "):]
+        return f"Executed: {command}"
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the metrics recorded on every request
+
+Times, in process and without a server, a bare ASGI app with and without
+MetricsMiddleware in front, so the difference is the per-request cost of the
+latency histogram and in-flight gauge. Also times Histogram.observe on its
+own, uncontended and with several threads observing into the same series,
+since it takes a lock on every call.
+
+    python benchmarks/metrics_overhead.py --iterations 200000
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from metrics import Histogram, MetricsMiddleware  # noqa: E402
+
+
+class Route:
+    path = "/api/shop/items"
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def time_per_request(app, iterations: int) -> float:
+    """Mean microseconds per request"""
+    scope = {"type": "http", "method": "GET", "path": "/api/shop/items", "route": Route()}
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await app(scope, receive, send)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def time_per_observe(histogram: Histogram, iterations: int, threads: int) -> float:
+    """Mean microseconds per observe, with `threads` threads observing at once"""
+    def observe():
+        for _ in range(iterations):
+            histogram.observe(0.003, ("GET", "/api/shop/items", 200))
+
+    workers = [threading.Thread(target=observe) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (iterations * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request metrics overhead")
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4, help="threads observing at once in the contended run")
+    args = parser.parse_args()
+
+    # Warm up both paths before timing them
+    asyncio.run(time_per_request(MetricsMiddleware(bare_app), 1000))
+
+    bare = asyncio.run(time_per_request(bare_app, args.iterations))
+    instrumented = asyncio.run(time_per_request(MetricsMiddleware(bare_app), args.iterations))
+    result = {
+        "iterations": args.iterations,
+        "microseconds_per_request": {
+            "bare_app": round(bare, 3),
+            "with_metrics_middleware": round(instrumented, 3),
+            "middleware_overhead": round(instrumented - bare, 3),
+        },
+        "microseconds_per_observe": {
+            "uncontended": round(time_per_observe(Histogram("uncontended", ""), args.iterations, 1), 3),
+            f"{args.threads}_threads": round(time_per_observe(Histogram("contended", ""), args.iterations, args.threads), 3),
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
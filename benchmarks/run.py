@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Load-testing and benchmark suite for the backend
+
+Boots backend/server.py against local stand-ins (fake Mojang API, fake
+Minecraft status/RCON server, and either a local MongoDB or an in-process
+MongoDB stand-in), drives a workload at a given concurrency and writes the
+throughput and latency percentiles as JSON. Install its dependencies with
+pip install -r benchmarks/requirements.txt.
+
+    python benchmarks/run.py --scenario mixed --concurrency 32 --duration 20 --output results.json
+    python benchmarks/run.py --mongo-url mongodb://localhost:27017 --scenario login_storm
+    python benchmarks/run.py compare before.json after.json
+
+Logging is configured like in production and written to a temporary file,
+or with --log-sink-delay-ms to stderr, read that slowly per line, standing in
+for a busy disk or log shipper. To see what the background log writer buys
+under a login storm, compare synchronous logging of every request with the
+defaults:
+
+    python benchmarks/run.py --scenario login_storm --log-sink-delay-ms 10 --log-queue-size 0 --access-log-sample-rate 1 --output sync.json
+    python benchmarks/run.py --scenario login_storm --log-sink-delay-ms 10 --output queued.json
+    python benchmarks/run.py compare sync.json queued.json
+
+Scenarios: login_storm, catalog, status, admin_dashboard, authenticated, mixed.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import FakeMinecraftServer, FakeMojangServer  # noqa: E402
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, duration):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else 0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0,
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p90": round(percentile(latencies, 0.90), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0,
+        },
+    }
+
+
+class Workload:
+    """Picks the next request for a virtual user according to the scenario"""
+
+    def __init__(self, base_url: str, scenario: str, user_pool: int):
+        self.base_url = base_url
+        self.scenario = scenario
+        self.user_pool = user_pool
+        self.item_ids = []
+        self.admin_headers = {}
+
+    def prepare(self):
+        session = requests.Session()
+        response = session.post(f"{self.base_url}/auth/login", json={"minecraft_username": "Admin"})
+        response.raise_for_status()
+        self.admin_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        self.item_ids = [item["id"] for item in session.get(f"{self.base_url}/shop/items").json()]
+
+    def login(self, session, state):
+        username = f"Bench{random.randrange(self.user_pool)}"
+        response = session.post(f"{self.base_url}/auth/login", json={"minecraft_username": username})
+        if response.status_code == 200:
+            state["headers"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return response
+
+    def catalog(self, session, state):
+        if self.item_ids and random.random() < 0.3:
+            return "shop_item", session.get(f"{self.base_url}/shop/items/{random.choice(self.item_ids)}")
+        return "shop_items", session.get(f"{self.base_url}/shop/items")
+
+    def status(self, session, state):
+        if random.random() < 0.5:
+            return "server_players", session.get(f"{self.base_url}/server/players")
+        return "server_status", session.get(f"{self.base_url}/server/status")
+
+    def admin_dashboard(self, session, state):
+        name, path = random.choice([
+            ("admin_stats", "/admin/stats"),
+            ("admin_users", "/users"),
+            ("admin_activity", "/admin/users/activity"),
+            ("admin_server_logs", "/admin/server/logs"),
+            ("admin_purchases", "/admin/shop/purchases"),
+            ("admin_commands", "/admin/commands"),
+        ])
+        return name, session.get(f"{self.base_url}{path}", headers=self.admin_headers)
+
+    def authenticated(self, session, state):
+        if "headers" not in state:
+            return "login", self.login(session, state)
+        roll = random.random()
+        if roll < 0.5:
+            return "auth_me", session.get(f"{self.base_url}/auth/me", headers=state["headers"])
+        if roll < 0.8:
+            return "my_purchases", session.get(f"{self.base_url}/shop/purchases", headers=state["headers"])
+        if self.item_ids:
+            return "purchase", session.post(f"{self.base_url}/shop/purchase/{random.choice(self.item_ids)}", headers=state["headers"])
+        return "auth_me", session.get(f"{self.base_url}/auth/me", headers=state["headers"])
+
+    def next_request(self, session, state):
+        scenario = self.scenario
+        if scenario == "mixed":
+            scenario = random.choices(
+                ["login_storm", "catalog", "status", "admin_dashboard", "authenticated"],
+                weights=[15, 35, 30, 5, 15],
+            )[0]
+        if scenario == "login_storm":
+            return "login", self.login(session, state)
+        return getattr(self, scenario)(session, state)
+
+
+def run_load(workload: Workload, concurrency: int, duration: float, warmup: float):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def virtual_user():
+        session = requests.Session()
+        state = {}
+        local_latencies = defaultdict(list)
+        local_errors = defaultdict(int)
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            # Requests arrive through the backend's trusted proxy from many
+            # players, as in production, so per-IP limits see distinct clients
+            session.headers["X-Forwarded-For"] = f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(1, 255)}"
+            try:
+                name, response = workload.next_request(session, state)
+                ok = response.status_code < 500
+            except requests.RequestException:
+                name, ok = "connection", False
+            finished = time.perf_counter()
+            if started < measure_from:
+                continue
+            local_latencies[name].append((finished - started) * 1000)
+            if not ok:
+                local_errors[name] += 1
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    threads = [threading.Thread(target=virtual_user, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+class SlowLogSink:
+    """Drains a pipe taking delay_ms per line
+
+    Once the pipe buffer is full, the writer blocks, as it would on a busy
+    disk or behind a slow log shipper.
+    """
+
+    def __init__(self, pipe, delay_ms: float):
+        self.pipe = pipe
+        self.delay_ms = delay_ms
+        self.lines = 0
+        self._thread = threading.Thread(target=self._read, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _read(self):
+        for _ in self.pipe:
+            self.lines += 1
+            time.sleep(self.delay_ms / 1000)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/shop/items", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Backend did not become ready in time")
+
+
+def benchmark(args) -> dict:
+    mojang = FakeMojangServer(latency_ms=args.mojang_latency_ms).start()
+    minecraft = FakeMinecraftServer().start()
+    port = free_port()
+    log_dir = tempfile.TemporaryDirectory()
+    log_file = Path(log_dir.name) / "backend.log"
+    logging_env = {} if args.log_sink_delay_ms else {"LOG_FILE": str(log_file)}
+    if args.log_queue_size is not None:
+        logging_env["LOG_QUEUE_SIZE"] = str(args.log_queue_size)
+    if args.access_log_sample_rate is not None:
+        logging_env["ACCESS_LOG_SAMPLE_RATE"] = str(args.access_log_sample_rate)
+    env = dict(
+        os.environ,
+        MONGO_URL=args.mongo_url,
+        DB_NAME=f"bench_{uuid.uuid4().hex[:8]}",
+        MOJANG_API_URL=mojang.url,
+        MOJANG_SESSION_URL=mojang.url,
+        MC_SERVER_IP=minecraft.host,
+        MC_SERVER_PORT=str(minecraft.status_port),
+        RCON_HOST=minecraft.host,
+        RCON_PORT=str(minecraft.rcon_port),
+        RCON_PASSWORD=minecraft.rcon_password,
+        TRUSTED_PROXIES="127.0.0.1",
+        # Login storms cycle through --user-pool names far faster than real
+        # players log in, which the per-username limit would turn into 429s
+        RATE_LIMIT_LOGIN_USERNAME=os.environ.get("RATE_LIMIT_LOGIN_USERNAME", "1000000,100000"),
+        **logging_env,
+    )
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT_DIR / "benchmarks" / "serve.py"), str(port)],
+        cwd=ROOT_DIR / "backend",
+        env=env,
+        stderr=subprocess.PIPE if args.log_sink_delay_ms else None,
+    )
+    log_sink = SlowLogSink(process.stderr, args.log_sink_delay_ms).start() if args.log_sink_delay_ms else None
+    base_url = f"http://127.0.0.1:{port}/api"
+    try:
+        wait_until_ready(base_url, process)
+        workload = Workload(base_url, args.scenario, args.user_pool)
+        workload.prepare()
+        latencies, errors = run_load(workload, args.concurrency, args.duration, args.warmup)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        mojang.stop()
+        minecraft.stop()
+        log_lines = 0
+        if log_sink is not None:
+            log_lines = log_sink.lines
+        elif log_file.exists():
+            with open(log_file, "rb") as log:
+                log_lines = sum(1 for _ in log)
+        log_dir.cleanup()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "scenario": args.scenario,
+        "concurrency": args.concurrency,
+        "duration_seconds": args.duration,
+        "mongo": "memory" if args.mongo_url == "memory" else "mongodb",
+        "errors": sum(errors.values()),
+        **summarize(all_latencies, args.duration),
+        "endpoints": {
+            name: {**summarize(values, args.duration), "errors": errors.get(name, 0)}
+            for name, values in sorted(latencies.items())
+        },
+        "external_calls": {
+            "mojang_requests": mojang.requests,
+            "status_pings": minecraft.status_requests,
+            "rcon_commands": minecraft.rcon_commands,
+        },
+        "logging": {
+            "queue_size": args.log_queue_size,
+            "access_log_sample_rate": args.access_log_sample_rate,
+            "sink_delay_ms": args.log_sink_delay_ms,
+            "lines_written": log_lines,
+        },
+    }
+    return result
+
+
+def compare(before_path: str, after_path: str):
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"{before['commit']} -> {after['commit']} ({after['scenario']}, concurrency {after['concurrency']})")
+    print(f"  throughput  {before['throughput_rps']:>10} -> {after['throughput_rps']:>10} rps  {change(before['throughput_rps'], after['throughput_rps'])}")
+    for key in ("p50", "p90", "p99"):
+        old, new = before["latency_ms"][key], after["latency_ms"][key]
+        print(f"  {key:<10}  {old:>10} -> {new:>10} ms   {change(old, new)}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) != 4:
+            sys.exit("usage: run.py compare BEFORE.json AFTER.json")
+        compare(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the backend against local stand-ins")
+    parser.add_argument("--scenario", default="mixed", choices=["login_storm", "catalog", "status", "admin_dashboard", "authenticated", "mixed"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before measuring")
+    parser.add_argument("--user-pool", type=int, default=500, help="distinct usernames used by logins")
+    parser.add_argument("--mojang-latency-ms", type=float, default=0, help="artificial Mojang API latency")
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", "memory"), help="MongoDB URL, or 'memory' for the in-process stand-in")
+    parser.add_argument("--log-queue-size", type=int, help="LOG_QUEUE_SIZE of the backend, 0 to log synchronously")
+    parser.add_argument("--access-log-sample-rate", type=float, help="ACCESS_LOG_SAMPLE_RATE of the backend")
+    parser.add_argument("--log-sink-delay-ms", type=float, default=0, help="artificial per-line log write latency")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    result = benchmark(args)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+        print(f"{result['scenario']}: {result['throughput_rps']} rps, p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms, {result['errors']} errors")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Boot backend/server.py for benchmarking.
+
+Configuration comes from the environment set by benchmarks/run.py. With
+MONGO_URL=memory the Motor client is replaced by the in-process
+mongomock-motor stand-in (pip install -r benchmarks/requirements.txt), so
+no MongoDB is needed; numbers are then only comparable with other
+in-memory runs.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import uvicorn
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    if os.environ.get("MONGO_URL") == "memory":
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+
+        class InMemoryClient(AsyncMongoMockClient):
+            def __init__(self, *args, **kwargs):
+                # Monitoring listeners only make sense for a real server
+                kwargs.pop("event_listeners", None)
+                super().__init__(**kwargs)
+
+        motor.motor_asyncio.AsyncIOMotorClient = InMemoryClient
+
+    import server
+
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
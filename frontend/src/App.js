@@ -1,4 +1,4 @@
-import React, { useState, useEffect, createContext, useContext } from "react";
+import React, { useState, useEffect, useRef, createContext, useContext } from "react";
 import "./App.css";
 import { BrowserRouter, Routes, Route, Navigate, Link } from "react-router-dom";
 import axios from "axios";
@@ -6,6 +6,26 @@ import axios from "axios";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Only the columns the admin panel shows
+const ADMIN_USER_FIELDS = 'id,minecraft_username,uuid,is_admin,login_count,created_at,skin_url';
+const ADMIN_LOGIN_FIELDS = 'id,minecraft_username,login_time';
+const ADMIN_PURCHASE_FIELDS = 'id,item_name,user_id,price,status,created_at';
+const SERVER_EVENT_LABELS = {
+  latency_spike: 'Pic de latence',
+  player_drop: 'Chute de joueurs',
+  offline: 'Serveur hors ligne'
+};
+
+// Upsert changed records by id and drop deleted ones
+const applyChanges = (records, changed = [], deleted = []) => {
+  const byId = new Map(records.map(record => [record.id, record]));
+  changed.forEach(record => byId.set(record.id, { ...byId.get(record.id), ...record }));
+  deleted.forEach(id => byId.delete(id));
+  return Array.from(byId.values());
+};
+
+const newestFirst = (field) => (a, b) => new Date(b[field]) - new Date(a[field]);
+
 // Auth Context
 const AuthContext = createContext();
 
@@ -23,6 +43,17 @@ const AuthProvider = ({ children }) => {
     }
   }, []);
 
+  useEffect(() => {
+    // Expired or revoked token (e.g. after a role change): log in again
+    const interceptor = axios.interceptors.response.use(undefined, (error) => {
+      if (error.response?.status === 401) {
+        logout();
+      }
+      return Promise.reject(error);
+    });
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   const fetchUser = async () => {
     try {
       const response = await axios.get(`${API}/auth/me`);
@@ -93,7 +124,7 @@ const Navbar = () => {
               <Link to="/profile" className="modern-button btn-secondary">
                 {user.skin_url && (
                   <img 
-                    src={user.skin_url} 
+                    src={`${API}/skins/${user.uuid}?size=32`} 
                     alt="Skin" 
                     className="w-6 h-6 rounded-sm mr-2 inline-block"
                   />
@@ -478,7 +509,7 @@ const Profile = () => {
             <div className="flex flex-col items-center">
               {user.skin_url ? (
                 <img 
-                  src={user.skin_url} 
+                  src={`${API}/skins/${user.uuid}?size=128`} 
                   alt="Skin Minecraft" 
                   className="profile-avatar"
                 />
@@ -569,9 +600,11 @@ const Admin = () => {
   const [users, setUsers] = useState([]);
   const [activity, setActivity] = useState(null);
   const [serverLogs, setServerLogs] = useState(null);
+  const [serverEvents, setServerEvents] = useState([]);
   const [purchases, setPurchases] = useState([]);
   const [loading, setLoading] = useState(true);
   const [activeTab, setActiveTab] = useState('dashboard');
+  const syncCursor = useRef(null);
 
   useEffect(() => {
     if (user?.is_admin) {
@@ -581,18 +614,22 @@ const Admin = () => {
 
   const fetchAdminData = async () => {
     try {
-      const [statsResponse, usersResponse, activityResponse, logsResponse, purchasesResponse] = await Promise.all([
+      const [syncResponse, statsResponse, usersResponse, activityResponse, logsResponse, purchasesResponse, eventsResponse] = await Promise.all([
+        axios.get(`${API}/admin/sync`),
         axios.get(`${API}/admin/stats`),
-        axios.get(`${API}/users`),
-        axios.get(`${API}/admin/users/activity`),
+        axios.get(`${API}/users`, { params: { fields: ADMIN_USER_FIELDS } }),
+        axios.get(`${API}/admin/users/activity`, { params: { fields: ADMIN_LOGIN_FIELDS } }),
         axios.get(`${API}/admin/server/logs`),
-        axios.get(`${API}/admin/shop/purchases`)
+        axios.get(`${API}/admin/shop/purchases`, { params: { fields: ADMIN_PURCHASE_FIELDS } }),
+        axios.get(`${API}/admin/server/events`, { params: { limit: 20 } })
       ]);
       setStats(statsResponse.data);
       setUsers(usersResponse.data);
       setActivity(activityResponse.data);
       setServerLogs(logsResponse.data);
       setPurchases(purchasesResponse.data);
+      setServerEvents(eventsResponse.data.events);
+      syncCursor.current = syncResponse.data.cursor;
     } catch (error) {
       console.error('Error fetching admin data:', error);
     } finally {
@@ -600,10 +637,37 @@ const Admin = () => {
     }
   };
 
+  // Fetch only what changed since the last load or sync
+  const syncAdminData = async () => {
+    try {
+      const [syncResponse, statsResponse] = await Promise.all([
+        axios.get(`${API}/admin/sync`, { params: { cursor: syncCursor.current } }),
+        axios.get(`${API}/admin/stats`)
+      ]);
+      const { reset, has_more, cursor, changes, deleted } = syncResponse.data;
+      if (reset || has_more) {
+        // Too old or too much changed: reloading is cheaper
+        return fetchAdminData();
+      }
+      setStats(statsResponse.data);
+      setUsers(current => applyChanges(current, changes.users, deleted.users));
+      setPurchases(current => applyChanges(current, changes.purchases, deleted.purchases).sort(newestFirst('created_at')));
+      setActivity(current => current && {
+        ...current,
+        login_logs: applyChanges(current.login_logs, changes.login_logs, deleted.login_logs)
+          .sort(newestFirst('login_time'))
+          .slice(0, 50)
+      });
+      syncCursor.current = cursor;
+    } catch (error) {
+      console.error('Error syncing admin data:', error);
+    }
+  };
+
   const toggleAdmin = async (userId) => {
     try {
       await axios.put(`${API}/users/${userId}/admin`);
-      fetchAdminData(); // Refresh data
+      syncAdminData();
     } catch (error) {
       console.error('Error toggling admin:', error);
     }
@@ -613,7 +677,7 @@ const Admin = () => {
     if (window.confirm('Êtes-vous sûr de vouloir supprimer cet utilisateur ?')) {
       try {
         await axios.delete(`${API}/users/${userId}`);
-        fetchAdminData(); // Refresh data
+        syncAdminData();
       } catch (error) {
         console.error('Error deleting user:', error);
       }
@@ -668,7 +732,7 @@ const Admin = () => {
         {activeTab === 'dashboard' && stats && (
           <div className="admin-stats">
             <div className="stat-card">
-              <div className="stat-number">{stats.total_users}</div>
+              <div className="stat-number">{stats.total_users ?? '—'}</div>
               <div className="stat-label">Utilisateurs totaux</div>
             </div>
             <div className="stat-card">
@@ -680,7 +744,7 @@ const Admin = () => {
               <div className="stat-label">Joueurs connectés</div>
             </div>
             <div className="stat-card">
-              <div className="stat-number">{stats.total_revenue.toFixed(2)}€</div>
+              <div className="stat-number">{stats.total_revenue != null ? `${stats.total_revenue.toFixed(2)}€` : '—'}</div>
               <div className="stat-label">Revenus boutique</div>
             </div>
           </div>
@@ -709,7 +773,7 @@ const Admin = () => {
                         <div className="flex items-center gap-3">
                           {userData.skin_url && (
                             <img 
-                              src={userData.skin_url} 
+                              src={`${API}/skins/${userData.uuid}?size=64`} 
                               alt="Skin" 
                               className="w-8 h-8 rounded-lg"
                             />
@@ -778,7 +842,7 @@ const Admin = () => {
                   <h4 className="text-lg font-semibold mb-4">Utilisateurs les plus actifs</h4>
                   <div className="space-y-2">
                     {activity.user_stats.slice(0, 10).map(userStat => (
-                      <div key={userStat._id} className="info-item">
+                      <div key={userStat.id} className="info-item">
                         <span>{userStat.minecraft_username}</span>
                         <span className="text-sm text-secondary">
                           {userStat.login_count} connexions
@@ -810,6 +874,26 @@ const Admin = () => {
                 <div className="stat-label">Logs enregistrés</div>
               </div>
             </div>
+            {serverEvents.length > 0 && (
+              <div className="mb-6">
+                <h4 className="text-lg font-semibold mb-4">Incidents détectés</h4>
+                <div className="space-y-2">
+                  {serverEvents.map(event => (
+                    <div key={event.id} className="info-item">
+                      <span>
+                        {SERVER_EVENT_LABELS[event.kind] || event.kind}
+                        {event.kind === 'latency_spike' && ` (${Math.round(event.peak_ms)}ms, habituellement ${Math.round(event.expected_ms)}ms)`}
+                        {event.kind === 'player_drop' && ` (${event.players_before} → ${event.players_after} joueurs)`}
+                      </span>
+                      <span className="text-sm text-secondary">
+                        {new Date(event.started_at).toLocaleString('fr-FR')}
+                        {event.ended_at === null && ' · en cours'}
+                      </span>
+                    </div>
+                  ))}
+                </div>
+              </div>
+            )}
             <div className="modern-table">
               <table>
                 <thead>
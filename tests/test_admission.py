@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionMiddleware, AdmissionRejected, Budget
+
+
+def test_waiters_are_admitted_in_order_as_slots_free():
+    async def scenario():
+        budget = Budget("public", max_concurrent=1, max_queue=2, queue_timeout_seconds=5)
+        assert await budget.acquire() == 0
+        admitted = []
+
+        async def wait(name):
+            await budget.acquire()
+            admitted.append(name)
+
+        waiters = [asyncio.create_task(wait(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        assert budget.queued == 2
+        budget.release()
+        await asyncio.sleep(0)
+        assert admitted == ["first"]
+        budget.release()
+        await asyncio.gather(*waiters)
+        assert admitted == ["first", "second"]
+        # Slots were handed over, never freed in between
+        assert budget.active == 1
+        budget.release()
+        assert budget.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_and_deadline_reject():
+    async def scenario():
+        budget = Budget("public", max_concurrent=1, max_queue=1, queue_timeout_seconds=0.01)
+        await budget.acquire()
+        queued = asyncio.create_task(budget.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await budget.acquire()
+        assert rejected.value.reason == "queue_full"
+        with pytest.raises(AdmissionRejected) as rejected:
+            await queued
+        assert rejected.value.reason == "timeout"
+        assert rejected.value.retry_after_seconds >= 1
+        assert budget.metrics == {"admitted": 1, "queue_full": 1, "timeout": 1}
+        assert budget.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        budget = Budget("public", max_concurrent=1, max_queue=2, queue_timeout_seconds=5)
+        await budget.acquire()
+        waiter = asyncio.create_task(budget.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert budget.queued == 0
+        budget.release()
+        assert budget.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_budgets_are_independent():
+    async def scenario():
+        controller = AdmissionController({
+            "public": Budget("public", max_concurrent=1, max_queue=0, queue_timeout_seconds=1),
+            "admin": Budget("admin", max_concurrent=1, max_queue=0, queue_timeout_seconds=1),
+        })
+        waits = []
+        controller.wait_observer = lambda budget, waited: waits.append(budget)
+        async with controller.slot("public"):
+            with pytest.raises(AdmissionRejected):
+                await controller.acquire("public")
+            async with controller.slot("admin"):
+                pass
+        assert waits == ["public", "admin"]
+        assert controller.budgets["public"].active == 0
+
+    asyncio.run(scenario())
+
+
+def test_middleware_sheds_with_503_and_bypasses_unclassified():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def scenario():
+        controller = AdmissionController({"public": Budget("public", max_concurrent=1, max_queue=0, queue_timeout_seconds=2)})
+        middleware = AdmissionMiddleware(app, controller, lambda scope: None if scope["path"] == "/metrics" else "public")
+
+        async def request(path):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await middleware({"type": "http", "path": path}, None, send)
+            return messages[0]["status"], dict(messages[0]["headers"])
+
+        assert (await request("/api/shop"))[0] == 200
+        await controller.acquire("public")
+        status, headers = await request("/api/shop")
+        assert status == 503
+        assert headers[b"retry-after"] == b"2"
+        assert (await request("/metrics"))[0] == 200
+
+    asyncio.run(scenario())
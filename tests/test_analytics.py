@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from pymongo.errors import ExecutionTimeout, OperationFailure
+
+from analytics import AnalyticsReads
+
+
+def over_budget(max_time_ms):
+    async def query(budget):
+        assert budget == max_time_ms
+        raise ExecutionTimeout("operation exceeded time limit", 50)
+    return query
+
+
+def answer(value):
+    async def query(budget):
+        return value
+    return query
+
+
+def test_budget_is_passed_to_the_query():
+    reads = AnalyticsReads(max_time_ms=250)
+    budgets = []
+
+    async def query(budget):
+        budgets.append(budget)
+        return 42
+
+    assert asyncio.run(reads.read("total_users", query)) == (42, None)
+    assert budgets == [250]
+    assert reads.metrics[("total_users", "success")] == 1
+
+
+def test_over_budget_falls_back_or_defaults():
+    reads = AnalyticsReads(max_time_ms=250)
+
+    async def estimate():
+        return 1000
+
+    async def scenario():
+        assert await reads.read("total_users", over_budget(250), fallback=estimate) == (1000, "fallback")
+        assert await reads.read("recent_logins", over_budget(250), default=[]) == ([], "fallback")
+
+    asyncio.run(scenario())
+    assert reads.metrics[("total_users", "fallback")] == 1
+
+
+def test_over_budget_prefers_a_recent_good_result():
+    reads = AnalyticsReads(max_time_ms=250, max_stale_seconds=60)
+
+    async def scenario():
+        await reads.read("total_users", answer(10))
+        assert await reads.read("total_users", over_budget(250), default=0) == (10, "stale")
+        # Variants of one read don't share results
+        assert await reads.read("total_users", over_budget(250), default=0, key="admins") == (0, "fallback")
+
+        reads.max_stale_seconds = 0
+        assert await reads.read("total_users", over_budget(250), default=0) == (0, "fallback")
+
+    asyncio.run(scenario())
+
+
+def test_slow_reads_are_cut_off_client_side():
+    reads = AnalyticsReads(max_time_ms=10, client_slack_seconds=0.02)
+
+    async def stuck_in_the_pool(budget):
+        await asyncio.sleep(5)
+
+    async def scenario():
+        started = asyncio.get_running_loop().time()
+        result = await reads.read("server_logs", stuck_in_the_pool, default=[])
+        return result, asyncio.get_running_loop().time() - started
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == ([], "fallback")
+    assert elapsed < 1
+
+
+def test_other_errors_propagate():
+    reads = AnalyticsReads(max_time_ms=250)
+
+    async def broken(budget):
+        raise OperationFailure("unauthorized")
+
+    with pytest.raises(OperationFailure):
+        asyncio.run(reads.read("total_users", broken, default=0))
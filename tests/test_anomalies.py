@@ -0,0 +1,155 @@
+import asyncio
+import math
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+from anomalies import EwmaStats, ServerMonitor
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+START = datetime(2024, 1, 1)
+
+
+def test_ewma_follows_a_steady_series():
+    stats = EwmaStats(0.1)
+    for _ in range(200):
+        stats.update(40)
+    assert stats.mean == 40
+    assert stats.variance == 0
+    assert stats.zscore(40) == 0
+    assert stats.zscore(41) == math.inf
+    assert stats.zscore(39) == -math.inf
+
+
+def test_ewma_tracks_mean_and_spread():
+    stats = EwmaStats(0.05)
+    samples = [40 + (i % 5) * 2 for i in range(1000)]
+    for value in samples:
+        stats.update(value)
+    assert stats.mean == pytest.approx(statistics.mean(samples), abs=1)
+    assert stats.std == pytest.approx(statistics.pstdev(samples), rel=0.2)
+    assert stats.count == 1000
+
+
+def test_ewma_round_trips_through_a_dict():
+    stats = EwmaStats(0.1)
+    for value in (10, 12, 11):
+        stats.update(value)
+    restored = EwmaStats.from_dict(0.1, stats.to_dict())
+    assert (restored.mean, restored.variance, restored.count) == (stats.mean, stats.variance, stats.count)
+    assert EwmaStats.from_dict(0.1, None).count == 0
+
+
+def monitor_db():
+    return mongomock_motor.AsyncMongoMockClient()["anomalies"]
+
+
+async def warm_up(monitor, polls=30, players=20, at=START):
+    for i in range(polls):
+        assert await monitor.observe(40 + i % 3, players, at + timedelta(minutes=i)) == []
+    return at + timedelta(minutes=polls)
+
+
+def test_latency_spike_opens_once_and_closes():
+    db = monitor_db()
+
+    async def scenario():
+        monitor = ServerMonitor(db, "lobby", warmup_samples=20)
+        at = await warm_up(monitor)
+        opened = await monitor.observe(400, 20, at)
+        assert [event["kind"] for event in opened] == ["latency_spike"]
+        # An ongoing spike only raises the recorded peak
+        assert await monitor.observe(600, 20, at + timedelta(minutes=1)) == []
+        assert await monitor.observe(41, 20, at + timedelta(minutes=2)) == []
+
+        event = await db.server_events.find_one({"id": opened[0]["id"]})
+        assert event["peak_ms"] == 600
+        assert event["ended_at"] == at + timedelta(minutes=2)
+        assert monitor.metrics["latency_spike"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_small_deviations_are_not_spikes():
+    db = monitor_db()
+
+    async def scenario():
+        monitor = ServerMonitor(db, "lobby", warmup_samples=20, latency_min_ms=50)
+        at = await warm_up(monitor)
+        # Far outside the spread of 40-42ms, but within latency_min_ms of the mean
+        assert await monitor.observe(80, 20, at) == []
+
+    asyncio.run(scenario())
+
+
+def test_nothing_is_flagged_while_warming_up():
+    db = monitor_db()
+
+    async def scenario():
+        monitor = ServerMonitor(db, "lobby", warmup_samples=20)
+        await warm_up(monitor, polls=5)
+        assert await monitor.observe(1000, 0, START + timedelta(minutes=5)) == []
+
+    asyncio.run(scenario())
+
+
+def test_player_drop_is_a_single_event():
+    db = monitor_db()
+
+    async def scenario():
+        monitor = ServerMonitor(db, "lobby", warmup_samples=20, drop_fraction=0.5, drop_min=3)
+        at = await warm_up(monitor)
+        opened = await monitor.observe(40, 5, at)
+        assert [event["kind"] for event in opened] == ["player_drop"]
+        assert (opened[0]["players_before"], opened[0]["players_after"]) == (20, 5)
+        assert opened[0]["ended_at"] == at
+        assert "player_drop" not in monitor.open
+        # Staying low isn't another drop
+        assert await monitor.observe(40, 5, at + timedelta(minutes=1)) == []
+
+    asyncio.run(scenario())
+
+
+def test_outage_opens_offline_and_skips_the_drop_after_it():
+    db = monitor_db()
+
+    async def scenario():
+        monitor = ServerMonitor(db, "lobby", warmup_samples=20)
+        at = await warm_up(monitor)
+        opened = await monitor.observe(None, None, at)
+        assert [event["kind"] for event in opened] == ["offline"]
+        assert await monitor.observe(None, None, at + timedelta(minutes=1)) == []
+        # Coming back empty is part of the outage, not a drop
+        assert await monitor.observe(40, 0, at + timedelta(minutes=2)) == []
+
+        event = await db.server_events.find_one({"id": opened[0]["id"]})
+        assert event["ended_at"] == at + timedelta(minutes=2)
+        assert monitor.open == {}
+
+    asyncio.run(scenario())
+
+
+def test_a_new_leader_resumes_from_saved_state():
+    db = monitor_db()
+
+    async def scenario():
+        first = ServerMonitor(db, "lobby", warmup_samples=20)
+        at = await warm_up(first)
+        spike = await first.observe(400, 20, at)
+
+        second = ServerMonitor(db, "lobby", warmup_samples=20)
+        await second.load()
+        assert second.latency.count == first.latency.count
+        assert second.latency.mean == pytest.approx(first.latency.mean)
+        assert second.open == {"latency_spike": spike[0]["id"]}
+        # No new warmup, and the spike opened by the old leader is closed
+        assert [event["kind"] for event in await second.observe(40, 5, at + timedelta(minutes=1))] == ["player_drop"]
+        assert (await db.server_events.find_one({"id": spike[0]["id"]}))["ended_at"] is not None
+
+        baseline = await second.baseline()
+        assert baseline["latency"]["samples"] == 32
+        assert baseline["observed_at"] == at + timedelta(minutes=1)
+
+    asyncio.run(scenario())
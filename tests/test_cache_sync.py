@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from cache_sync import CacheInvalidator
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_instances_flush_on_version_bumps():
+    db = mongomock_motor.AsyncMongoMockClient()["cache_sync"]
+    flushed = []
+    handlers = {
+        "shop_items": lambda change: flushed.append(("shop_items", change)),
+        "users": lambda change: flushed.append(("users", change)),
+    }
+
+    async def wait_for_flushes(count):
+        for _ in range(100):
+            if len(flushed) >= count:
+                return
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        writer = CacheInvalidator(db, {}, poll_interval_seconds=0.01)
+        reader = CacheInvalidator(db, handlers, poll_interval_seconds=0.01)
+        # Versions bumped before the reader started are its baseline
+        await writer.bump("shop_items")
+        reader.start()
+        try:
+            await asyncio.sleep(0.05)
+            assert reader.mode == "polling"
+            assert flushed == []
+
+            await writer.bump("shop_items")
+            await wait_for_flushes(1)
+            assert flushed == [("shop_items", None)]
+
+            # A collection bumped for the first time counts as moved too
+            await writer.bump("users")
+            await wait_for_flushes(2)
+            assert flushed == [("shop_items", None), ("users", None)]
+            await asyncio.sleep(0.05)
+            assert len(flushed) == 2
+            assert reader.metrics["flushes"] == 2
+        finally:
+            await reader.stop()
+
+    asyncio.run(scenario())
+
+
+def test_bump_is_a_no_op_with_change_streams():
+    db = mongomock_motor.AsyncMongoMockClient()["cache_sync"]
+
+    async def scenario():
+        invalidator = CacheInvalidator(db, {})
+        invalidator.mode = "change_stream"
+        await invalidator.bump("shop_items")
+        return await db.cache_versions.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = changes
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            # Stay open like a real stream with nothing new
+            await asyncio.sleep(3600)
+        change = self.changes.pop(0)
+        self.resume_token = {"_data": change["_id"]}
+        return change
+
+
+class ReplicaSetDb:
+    """Just enough of a replica set database to follow a change stream"""
+
+    def __init__(self, changes):
+        self.stream = FakeStream(changes)
+        self.client = self
+
+    @property
+    def admin(self):
+        return self
+
+    async def command(self, name):
+        return {"setName": "rs0"}
+
+    def watch(self, pipeline, resume_after=None):
+        return self.stream
+
+
+def test_change_stream_events_reach_their_handlers():
+    db = ReplicaSetDb([
+        {"_id": "1", "operationType": "update", "ns": {"coll": "shop_items"}, "documentKey": {"_id": "a"}},
+        {"_id": "2", "operationType": "drop", "ns": {"coll": "users"}},
+    ])
+    received = []
+    handlers = {
+        "shop_items": lambda change: received.append(("shop_items", change and change["documentKey"])),
+        "users": lambda change: received.append(("users", change)),
+    }
+
+    async def scenario():
+        invalidator = CacheInvalidator(db, handlers)
+        invalidator.start()
+        try:
+            for _ in range(100):
+                if len(received) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert invalidator.mode == "change_stream"
+            assert invalidator.resume_token == {"_data": "2"}
+        finally:
+            await invalidator.stop()
+
+    asyncio.run(scenario())
+    # A drop can't say which entries changed, so the collection is flushed
+    assert received == [("shop_items", {"_id": "a"}), ("users", None)]
@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from fieldsets import Fieldset, partial_model
+
+
+class Player(BaseModel):
+    id: str
+    name: str
+    level: int = 1
+    last_seen: Optional[datetime] = None
+
+
+def test_no_selection_means_every_field():
+    fieldset = Fieldset.parse(Player, None)
+    assert fieldset.fields is None
+    assert fieldset.projection is None
+    assert fieldset.model is Player
+    assert Fieldset.parse(Player, "").fields is None
+
+
+def test_selection_builds_projection_and_model():
+    fieldset = Fieldset.parse(Player, " name , level,")
+    # The id is always included
+    assert fieldset.fields == {"id", "name", "level"}
+    assert fieldset.projection == {"_id": 0, "id": 1, "name": 1, "level": 1}
+
+    model = fieldset.model
+    assert set(model.model_fields) == {"id", "name", "level"}
+    player = model(id="p1", name="Steve", last_seen=datetime(2024, 1, 1))
+    # Declared defaults are kept, and unselected fields dropped
+    assert player.model_dump() == {"id": "p1", "name": "Steve", "level": 1}
+    # The same selection reuses the same model
+    assert Fieldset.parse(Player, "level,name").model is model
+
+
+def test_always_fields_are_configurable():
+    fieldset = Fieldset.parse(Player, "level", always=())
+    assert fieldset.projection == {"_id": 0, "level": 1}
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError) as rejected:
+        Fieldset.parse(Player, "name,password,email")
+    assert "email, password" in str(rejected.value)
+    assert "allowed: id, name, level, last_seen" in str(rejected.value)
+
+
+def test_partial_model_accepts_any_subset():
+    model = partial_model(Player)
+    assert model is partial_model(Player)
+    assert model(name="Steve").model_dump(exclude_unset=True) == {"name": "Steve"}
+    assert model().model_dump() == {"id": None, "name": None, "level": None, "last_seen": None}
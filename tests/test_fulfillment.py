@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from fulfillment import FulfillmentWorker, LeaseLostError, ManualDeliveryRequired, PermanentDeliveryError
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def purchases_collection():
+    return mongomock_motor.AsyncMongoMockClient()["fulfillment"]["purchases"]
+
+
+async def add_purchases(purchases, count):
+    await purchases.insert_many([
+        {"id": f"p{i}", "status": "pending", "attempts": 0, "created_at": datetime(2024, 1, 1) + timedelta(seconds=i)}
+        for i in range(count)
+    ])
+
+
+async def statuses(purchases):
+    return {doc["id"]: doc["status"] for doc in await purchases.find().to_list(None)}
+
+
+def test_claims_are_exclusive_and_complete():
+    purchases = purchases_collection()
+    delivered = []
+
+    async def deliver(purchase):
+        delivered.append(purchase["id"])
+
+    async def scenario():
+        await add_purchases(purchases, 5)
+        first = FulfillmentWorker(purchases, deliver, batch_size=3)
+        second = FulfillmentWorker(purchases, deliver, batch_size=3)
+        claimed = await first.claim_batch()
+        assert [p["id"] for p in claimed] == ["p0", "p1", "p2"]
+        assert [p["id"] for p in await second.claim_batch()] == ["p3", "p4"]
+        assert await first.claim_batch() == []
+
+        completed = []
+        first.on_completed = lambda purchase: asyncio.sleep(0, completed.append(purchase["id"]))
+        await asyncio.gather(*(first._fulfill(purchase) for purchase in claimed))
+        assert sorted(delivered) == ["p0", "p1", "p2"]
+        assert sorted(completed) == ["p0", "p1", "p2"]
+        done = await purchases.find_one({"id": "p0"})
+        assert done["status"] == "completed"
+        assert "lease_owner" not in done and "lease_expires_at" not in done
+        assert first.metrics["completed"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_expired_leases_are_reclaimed():
+    purchases = purchases_collection()
+
+    async def scenario():
+        await add_purchases(purchases, 1)
+        crashed = FulfillmentWorker(purchases, None)
+        (stale,) = await crashed.claim_batch()
+        await purchases.update_one({"id": "p0"}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+        delivered = []
+        worker = FulfillmentWorker(purchases, lambda purchase: asyncio.sleep(0, delivered.append(purchase["attempts"])))
+        assert await worker.process_batch() == 1
+        assert delivered == [2]
+        assert (await purchases.find_one({"id": "p0"}))["status"] == "completed"
+
+        # The crashed worker's lease no longer counts
+        await crashed._complete(stale)
+        assert crashed.metrics["lease_lost"] == 1
+        with pytest.raises(LeaseLostError):
+            await crashed.checkpoint(stale, {"commands_sent": 1})
+
+    asyncio.run(scenario())
+
+
+def test_queued_purchase_reclaimed_meanwhile_is_skipped():
+    purchases = purchases_collection()
+    delivered = []
+
+    async def deliver(purchase):
+        delivered.append(purchase["id"])
+
+    async def scenario():
+        await add_purchases(purchases, 1)
+        slow = FulfillmentWorker(purchases, deliver)
+        (purchase,) = await slow.claim_batch()
+        # Waiting for a delivery slot outlasted the lease, and another worker took over
+        await purchases.update_one({"id": "p0"}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+        other = FulfillmentWorker(purchases, deliver)
+        assert len(await other.claim_batch()) == 1
+
+        await slow._fulfill(purchase)
+        assert delivered == []
+        assert slow.metrics["lease_lost"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_lease_is_renewed_at_start_and_while_delivering():
+    purchases = purchases_collection()
+
+    async def scenario():
+        await add_purchases(purchases, 1)
+        expiries = []
+
+        async def deliver(purchase):
+            for _ in range(3):
+                expiries.append((await purchases.find_one({"id": "p0"}))["lease_expires_at"])
+                await asyncio.sleep(0.08)
+
+        worker = FulfillmentWorker(purchases, deliver, lease_seconds=0.3)
+        (purchase,) = await worker.claim_batch()
+        # Expired while queued but still held by this worker
+        await purchases.update_one({"id": "p0"}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+        await worker._fulfill(purchase)
+
+        assert expiries[0] > datetime.utcnow() - timedelta(seconds=1)
+        assert expiries[-1] > expiries[0]
+        assert (await purchases.find_one({"id": "p0"}))["status"] == "completed"
+
+    asyncio.run(scenario())
+
+
+def test_failures_retry_then_dead_letter():
+    purchases = purchases_collection()
+
+    async def deliver(purchase):
+        raise ConnectionError("server offline")
+
+    async def scenario():
+        await add_purchases(purchases, 1)
+        worker = FulfillmentWorker(purchases, deliver, max_attempts=2, backoff_base_seconds=60)
+        await worker.process_batch()
+        retried = await purchases.find_one({"id": "p0"})
+        assert retried["status"] == "pending"
+        assert retried["last_error"] == "server offline"
+        assert retried["next_attempt_at"] > datetime.utcnow() + timedelta(seconds=40)
+        # Backing off until next_attempt_at
+        assert await worker.claim_batch() == []
+
+        await purchases.update_one({"id": "p0"}, {"$set": {"next_attempt_at": datetime.utcnow()}})
+        await worker.process_batch()
+        failed = await purchases.find_one({"id": "p0"})
+        assert failed["status"] == "failed"
+        assert failed["attempts"] == 2
+        assert (worker.metrics["retried"], worker.metrics["dead_lettered"]) == (1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_permanent_failures_and_hand_offs_skip_retries():
+    purchases = purchases_collection()
+
+    async def deliver(purchase):
+        if purchase["id"] == "p0":
+            raise PermanentDeliveryError("command was sent but never confirmed")
+        raise ManualDeliveryRequired("item has no delivery commands")
+
+    async def scenario():
+        await add_purchases(purchases, 2)
+        worker = FulfillmentWorker(purchases, deliver)
+        await worker.process_batch()
+        assert await statuses(purchases) == {"p0": "failed", "p1": "manual"}
+        assert (await purchases.find_one({"id": "p1"}))["last_error"] == "item has no delivery commands"
+        assert await worker.queue_counts() == {"failed": 1, "manual": 1}
+
+    asyncio.run(scenario())
+
+
+def test_checkpoints_save_progress_for_the_lease_holder():
+    purchases = purchases_collection()
+
+    async def scenario():
+        await add_purchases(purchases, 1)
+        worker = FulfillmentWorker(purchases, None)
+        (purchase,) = await worker.claim_batch()
+        await worker.checkpoint(purchase, {"commands": ["say hi"], "sending_command": 0})
+        await worker.checkpoint(purchase, {"commands_sent": 1}, unset=["sending_command"])
+        saved = await purchases.find_one({"id": "p0"})
+        assert saved["commands_sent"] == 1
+        assert "sending_command" not in saved
+
+        await purchases.update_one({"id": "p0"}, {"$set": {"lease_owner": "someone-else"}})
+        with pytest.raises(LeaseLostError):
+            await worker.checkpoint(purchase, {"commands_sent": 2})
+        assert (await purchases.find_one({"id": "p0"}))["commands_sent"] == 1
+
+    asyncio.run(scenario())
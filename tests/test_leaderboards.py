@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from leaderboards import Leaderboards, TopK
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def entry(entry_id, score, name=None):
+    return {"id": entry_id, "name": name or entry_id, "kills": score}
+
+
+def test_keeps_the_highest_scores_in_order():
+    board = TopK(3, "kills")
+    for i, score in enumerate([5, 1, 9, 7, 3]):
+        board.offer(entry(f"u{i}", score))
+    assert [e["kills"] for e in board.page(0, 10)] == [9, 7, 5]
+    assert len(board) == 3
+    # Dropped entries are forgotten entirely
+    assert board.get("u1") is None
+    assert board.rank_of("u1") is None
+
+
+def test_ties_break_by_name():
+    board = TopK(3, "kills")
+    board.offer(entry("b", 5, "bravo"))
+    board.offer(entry("a", 5, "alpha"))
+    assert [e["name"] for e in board.page(0, 3)] == ["alpha", "bravo"]
+
+
+def test_offer_updates_an_existing_entry():
+    board = TopK(3, "kills")
+    for i, score in enumerate([5, 4, 3]):
+        board.offer(entry(f"u{i}", score))
+    board.offer(entry("u2", 10))
+    assert board.rank_of("u2") == 1
+    assert board.get("u2")["kills"] == 10
+    assert len(board) == 3
+    # Entries pushed out by others are dropped and a lowered score re-ranks
+    board.offer(entry("u3", 8))
+    assert board.get("u1") is None
+    board.offer(entry("u2", 0))
+    assert [e["id"] for e in board.page(0, 3)] == ["u3", "u0", "u2"]
+
+
+def test_remove_and_pages():
+    board = TopK(5, "kills")
+    board.replace([entry(f"u{i}", i) for i in range(10)])
+    assert [e["id"] for e in board.page(0, 5)] == ["u9", "u8", "u7", "u6", "u5"]
+    assert board.remove("u8")
+    assert not board.remove("u8")
+    page = board.page(1, 2)
+    assert [(e["id"], e["rank"]) for e in page] == [("u7", 2), ("u6", 3)]
+    assert board.rank_of("u5") == 4
+
+
+def test_boards_seed_and_update_from_users():
+    users = mongomock_motor.AsyncMongoMockClient()["leaderboards"]["users"]
+
+    async def scenario():
+        await users.insert_many([
+            {"id": f"u{i}", "minecraft_username": f"player{i}", "kills": i, "deaths": 10 - i}
+            for i in range(10)
+        ])
+        boards = Leaderboards(users, {"kills": "kills", "deaths": "deaths"}, size=3)
+        await boards.refresh()
+        assert [e["id"] for e in boards.boards["kills"].page(0, 3)] == ["u9", "u8", "u7"]
+        assert [e["id"] for e in boards.boards["deaths"].page(0, 3)] == ["u0", "u1", "u2"]
+
+        boards.update({"id": "u0", "minecraft_username": "player0", "kills": 50, "deaths": 10}, ["kills"])
+        assert boards.boards["kills"].rank_of("u0") == 1
+        # Boards whose counters didn't change are left alone
+        assert boards.boards["deaths"].get("u0")["kills"] == 0
+
+        # Removing a user refreshes the boards it was on from the collection
+        await users.delete_one({"id": "u9"})
+        boards.remove("u9")
+        await boards._refresh_task
+        assert [e["id"] for e in boards.boards["kills"].page(0, 3)] == ["u8", "u7", "u6"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from loaders import DataLoader, Loaders
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class FailingCollection:
+    def find(self, *args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+
+def users_collection():
+    return mongomock_motor.AsyncMongoMockClient()["loaders"]["users"]
+
+
+def test_loads_in_one_tick_share_a_query():
+    users = users_collection()
+
+    async def scenario():
+        await users.insert_many([{"id": f"u{i}", "name": f"player{i}"} for i in range(5)])
+        loader = DataLoader(users, projection={"_id": 0})
+        documents = await loader.load_many(["u0", "u3", "missing", "u3"])
+        assert [d and d["name"] for d in documents] == ["player0", "player3", None, "player3"]
+        assert loader.queries == 1
+
+        first, second = await asyncio.gather(loader.load("u1"), loader.load("u2"))
+        assert (first["name"], second["name"]) == ("player1", "player2")
+        assert loader.queries == 2
+
+    asyncio.run(scenario())
+
+
+def test_results_are_memoized_until_cleared():
+    users = users_collection()
+
+    async def scenario():
+        await users.insert_one({"id": "u0", "name": "steve"})
+        loader = DataLoader(users, projection={"_id": 0})
+        assert (await loader.load("u0"))["name"] == "steve"
+        await users.update_one({"id": "u0"}, {"$set": {"name": "alex"}})
+        assert (await loader.load("u0"))["name"] == "steve"
+        assert loader.queries == 1
+
+        loader.clear("u0")
+        assert (await loader.load("u0"))["name"] == "alex"
+        assert loader.queries == 2
+
+        loader.prime("u1", {"id": "u1", "name": "primed"})
+        assert (await loader.load("u1"))["name"] == "primed"
+        assert loader.queries == 2
+
+        loader.clear()
+        assert await loader.load("u1") is None
+        assert loader.queries == 3
+
+    asyncio.run(scenario())
+
+
+def test_failures_reach_every_caller_and_are_not_cached():
+    async def scenario():
+        loader = DataLoader(FailingCollection())
+        results = await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert loader.queries == 1
+        with pytest.raises(RuntimeError):
+            await loader.load("a")
+        assert loader.queries == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_does_not_cancel_the_batch():
+    users = users_collection()
+
+    async def scenario():
+        await users.insert_one({"id": "u0", "name": "steve"})
+        loader = DataLoader(users)
+        cancelled = asyncio.ensure_future(loader.load("u0"))
+        kept = asyncio.ensure_future(loader.load("u0"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        assert (await kept)["name"] == "steve"
+        assert loader.queries == 1
+
+    asyncio.run(scenario())
+
+
+def test_loaders_are_created_once_per_collection():
+    db = mongomock_motor.AsyncMongoMockClient()["loaders"]
+    loaders = Loaders(db)
+    assert loaders.users is loaders.users
+    assert loaders.users is not loaders.purchases
+    assert loaders.shop_items.collection.name == "shop_items"
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import json
+import logging
+
+import pytest
+
+from logs import BackgroundLogHandler, JsonFormatter, RequestLogMiddleware, add_request_id, request_id
+
+
+@pytest.fixture
+def output():
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def records(output):
+    return [json.loads(line) for line in output.stream.getvalue().splitlines()]
+
+
+def test_background_handler_writes_json_records(output):
+    background = BackgroundLogHandler(output)
+    background.addFilter(add_request_id)
+    logger = make_logger("test.logs.background", background)
+    background.start()
+    try:
+        token = request_id.set("req-1")
+        details = {"purchase": "p1"}
+        logger.info("Delivered %s", details, extra={"attempt": 2})
+        # Arguments are resolved when logged, not when written
+        details["purchase"] = "changed"
+        request_id.reset(token)
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logger.exception("Delivery failed")
+    finally:
+        background.stop()
+
+    delivered, failed = records(output)
+    assert delivered["message"] == "Delivered {'purchase': 'p1'}"
+    assert (delivered["level"], delivered["logger"]) == ("INFO", "test.logs.background")
+    assert (delivered["attempt"], delivered["request_id"]) == (2, "req-1")
+    assert delivered["time"].endswith("+00:00")
+    assert "request_id" not in failed
+    assert "RuntimeError: boom" in failed["exception"]
+    assert background.metrics == {"queued": 2}
+
+
+def test_full_queue_drops_instead_of_blocking(output):
+    background = BackgroundLogHandler(output, max_queued=2)
+    logger = make_logger("test.logs.full", background)
+    # The writer isn't running, so nothing drains the queue
+    for i in range(5):
+        logger.info(f"record {i}")
+    assert background.depth == 2
+    assert background.metrics == {"queued": 2, "dropped": 3}
+
+    background.start()
+    background.stop()
+    assert [record["message"] for record in records(output)] == ["record 0", "record 1"]
+
+
+class Route:
+    path = "/api/users/{user_id}"
+
+
+def request(middleware, status, headers=()):
+    sent = []
+
+    async def app(scope, receive, send):
+        assert request_id.get() is not None
+        await send({"type": "http.response.start", "status": status, "headers": []})
+
+    async def send(message):
+        sent.append(message)
+
+    middleware.app = app
+    scope = {"type": "http", "method": "GET", "path": "/api/users/u1", "route": Route(), "headers": list(headers)}
+    asyncio.run(middleware(scope, None, send))
+    return dict(sent[0]["headers"])[b"x-request-id"].decode()
+
+
+def test_requests_get_ids_and_are_logged_by_outcome(output):
+    logger = make_logger("test.logs.access", output)
+    output.addFilter(add_request_id)
+    middleware = RequestLogMiddleware(None, sample_rate=0, slow_ms=1000, logger_name=logger.name)
+
+    assert request(middleware, 200, [(b"x-request-id", b"client-id.1")]) == "client-id.1"
+    generated = request(middleware, 404, [(b"x-request-id", b"not valid!")])
+    assert generated != "not valid!" and len(generated) == 32
+    request(middleware, 503)
+
+    # Successes are sampled out at rate 0, failures always logged
+    assert middleware.metrics == {"sampled_out": 1, "logged": 2}
+    not_found, unavailable = records(output)
+    assert not_found["request_id"] == generated
+    assert (not_found["level"], not_found["status"], not_found["route"]) == ("INFO", 404, "/api/users/{user_id}")
+    assert unavailable["level"] == "ERROR"
+    assert request_id.get() is None
@@ -0,0 +1,55 @@
+import sys
+import threading
+
+from metrics import Histogram, Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, ("/a",))
+    assert list(histogram.samples()) == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 6.05',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_histogram_counts_every_observation_across_threads():
+    histogram = Histogram("wait_seconds", "Wait", ("pool",))
+    barrier = threading.Barrier(8)
+
+    def observe(pool):
+        barrier.wait()
+        for _ in range(20000):
+            histogram.observe(0.001, (pool,))
+
+    threads = [threading.Thread(target=observe, args=(f"pool{i % 2}",)) for i in range(8)]
+    # Switch threads as often as possible, to interleave the updates
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    counts = sorted(line for line in histogram.samples() if line.startswith("wait_seconds_count"))
+    assert counts == ['wait_seconds_count{pool="pool0"} 80000', 'wait_seconds_count{pool="pool1"} 80000']
+
+
+def test_registry_renders_callbacks_and_escapes_labels():
+    registry = Registry()
+    registry.counter("jobs_total", "Jobs", ("kind",), callback=lambda: {('say "hi"',): 2})
+    registry.gauge("leader", "Leader", callback=lambda: 1)
+    assert registry.render() == (
+        "# HELP jobs_total Jobs\n"
+        "# TYPE jobs_total counter\n"
+        'jobs_total{kind="say \\"hi\\""} 2\n'
+        "# HELP leader Leader\n"
+        "# TYPE leader gauge\n"
+        "leader 1\n"
+    )
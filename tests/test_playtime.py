@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from playtime import PlaytimeTracker, parse_player_list
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+START = datetime(2024, 1, 1, 12)
+
+
+def players(*names):
+    return [{"name": name, "uuid": f"uuid-{name}"} for name in names]
+
+
+def at(minutes):
+    return START + timedelta(minutes=minutes)
+
+
+def test_parse_player_list():
+    assert parse_player_list("There are 2 of a max of 20 players online: Steve, Alex") == ["Steve", "Alex"]
+    assert parse_player_list("There are 0 of a max of 20 players online: ") == []
+    # Grouped per line, with formatting codes
+    assert parse_player_list("§6default§r: Steve, Alex\n§cadmin§r: Notch") == ["Steve", "Alex", "Notch"]
+
+
+def test_sessions_accumulate_into_playtime():
+    db = mongomock_motor.AsyncMongoMockClient()["playtime"]
+
+    async def scenario():
+        tracker = PlaytimeTracker(db, max_gap_seconds=600)
+        assert await tracker.observe(players("Steve", "Alex"), at(0)) == (["Steve", "Alex"], [])
+        # Unchanged snapshots write nothing but the checkpoint
+        assert await tracker.observe(players("Steve", "Alex"), at(5)) == ([], [])
+        assert await tracker.observe(players("Steve"), at(10)) == ([], ["Alex"])
+        await tracker.observe(players("Steve", "Alex"), at(20))
+        await tracker.observe([], at(30))
+
+        steve = await db.player_playtime.find_one({"player": "Steve"})
+        alex = await db.player_playtime.find_one({"player": "Alex"})
+        assert (steve["total_seconds"], steve["sessions"]) == (1800, 1)
+        assert (alex["total_seconds"], alex["sessions"]) == (1200, 2)
+        assert "online_since" not in alex
+        assert alex["first_seen"] == at(0) and alex["last_seen"] == at(30)
+
+        sessions = await db.player_sessions.find({"player": "Alex"}).sort("started_at", 1).to_list(None)
+        assert [(s["started_at"], s["ended_at"], s["duration_seconds"]) for s in sessions] == [(at(0), at(10), 600), (at(20), at(30), 600)]
+        events = await db.player_events.find({"player": "Alex"}).sort("at", 1).to_list(None)
+        assert [event["type"] for event in events] == ["join", "leave", "join", "leave"]
+        assert tracker.metrics == {"joins": 3, "leaves": 3}
+
+    asyncio.run(scenario())
+
+
+def test_new_tracker_resumes_open_sessions():
+    db = mongomock_motor.AsyncMongoMockClient()["playtime"]
+
+    async def scenario():
+        now = datetime.utcnow()
+        first = PlaytimeTracker(db, max_gap_seconds=600)
+        await first.observe(players("Steve"), now - timedelta(minutes=2))
+
+        second = PlaytimeTracker(db, max_gap_seconds=600)
+        await second.load()
+        assert list(second.online) == ["Steve"]
+        # Steve was there all along, so his session continues
+        assert await second.observe(players("Steve"), now) == ([], [])
+        await second.observe([], now + timedelta(minutes=1))
+        steve = await db.player_playtime.find_one({"player": "Steve"})
+        assert steve["total_seconds"] == pytest.approx(180, abs=1)
+        assert steve["sessions"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_sessions_end_when_last_observed_after_a_gap():
+    db = mongomock_motor.AsyncMongoMockClient()["playtime"]
+
+    async def scenario():
+        last_seen = datetime.utcnow() - timedelta(hours=2)
+        crashed = PlaytimeTracker(db, max_gap_seconds=600)
+        await crashed.observe(players("Steve"), last_seen - timedelta(minutes=30))
+        await crashed.observe(players("Steve"), last_seen)
+
+        tracker = PlaytimeTracker(db, max_gap_seconds=600)
+        await tracker.load()
+        assert tracker.online == {}
+        steve = await db.player_playtime.find_one({"player": "Steve"})
+        # Nobody watched for two hours; those don't count
+        assert steve["total_seconds"] == pytest.approx(1800, abs=1)
+
+    asyncio.run(scenario())
+
+
+def test_leaderboard_counts_sessions_in_progress():
+    db = mongomock_motor.AsyncMongoMockClient()["playtime"]
+
+    async def scenario():
+        now = datetime.utcnow()
+        tracker = PlaytimeTracker(db, max_gap_seconds=600)
+        await tracker.observe(players("Steve", "Alex", "Notch"), now - timedelta(hours=3))
+        await tracker.observe(players("Notch"), now - timedelta(hours=2))
+        await tracker.observe(players("Notch", "Herobrine"), now - timedelta(minutes=1))
+        return await tracker.leaderboard(limit=2), await tracker.leaderboard(limit=5, offset=2)
+
+    top, rest = asyncio.run(scenario())
+    assert [(entry["rank"], entry["player"], entry["online"]) for entry in top] == [(1, "Notch", True), (2, "Alex", False)]
+    assert top[0]["total_seconds"] == pytest.approx(3 * 3600, abs=2)
+    assert top[0]["sessions"] == 1
+    assert [(entry["rank"], entry["player"]) for entry in rest] == [(3, "Steve"), (4, "Herobrine")]
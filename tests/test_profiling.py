@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from profiling import PROFILE_HEADER, ProfilingMiddleware, RequestProfile, SamplingProfiler
+
+
+@pytest.fixture
+def profiler():
+    profiler = SamplingProfiler(interval_seconds=0.001, max_profiles=3)
+    yield profiler
+    profiler.configure(enabled=False, sample_rate=0)
+
+
+def test_selection(profiler):
+    assert profiler.select([]) is None
+    profiler.configure(enabled=True, sample_rate=0)
+    assert profiler.select([]) is None
+    assert profiler.select([(PROFILE_HEADER, b"guessed")]) is None
+    assert profiler.select([(PROFILE_HEADER, profiler.header_token.encode())]) == "header"
+    profiler.configure(enabled=True, sample_rate=1)
+    assert profiler.select([]) == "sampled"
+
+    # Turning profiling off invalidates the header token
+    token = profiler.header_token
+    profiler.configure(enabled=False, sample_rate=1)
+    assert profiler.header_token is None
+    profiler.configure(enabled=True, sample_rate=0)
+    assert profiler.header_token != token
+
+
+async def awaiting_handler():
+    await asyncio.sleep(0.05)
+
+
+def busy_handler():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+
+
+def profiled_request(profiler, handler):
+    async def app(scope, receive, send):
+        if asyncio.iscoroutinefunction(handler):
+            await handler()
+        else:
+            handler()
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    middleware = ProfilingMiddleware(app, profiler)
+    scope = {"type": "http", "method": "POST", "path": "/api/shop/purchase", "headers": [(PROFILE_HEADER, profiler.header_token.encode())]}
+    asyncio.run(middleware(scope, None, send))
+    return profiler.profiles[-1]
+
+
+def test_suspended_requests_record_what_they_await(profiler):
+    profiler.configure(enabled=True, sample_rate=0)
+    profile = profiled_request(profiler, awaiting_handler)
+    summary = profile.summary()
+    assert (summary["method"], summary["path"], summary["trigger"], summary["status"]) == ("POST", "/api/shop/purchase", "header", 201)
+    assert summary["duration_ms"] >= 50
+    assert summary["sample_count"] > 0
+    stack, _ = profile.samples.most_common(1)[0]
+    assert "awaiting_handler" in stack
+    assert stack.endswith("[waiting]")
+
+
+def test_running_requests_record_the_thread_stack(profiler):
+    profiler.configure(enabled=True, sample_rate=0)
+    profile = profiled_request(profiler, busy_handler)
+    stack, _ = profile.samples.most_common(1)[0]
+    assert "busy_handler" in stack
+    assert not stack.endswith("[waiting]")
+
+
+def test_unselected_requests_are_not_profiled(profiler):
+    profiler.configure(enabled=True, sample_rate=0)
+
+    async def app(scope, receive, send):
+        pass
+
+    asyncio.run(ProfilingMiddleware(app, profiler)({"type": "http", "method": "GET", "path": "/", "headers": []}, None, None))
+    assert len(profiler.profiles) == 0
+
+
+def test_profiles_are_bounded_and_folded(profiler):
+    profiles = [RequestProfile("GET", f"/{i}", "sampled") for i in range(5)]
+    for profile in profiles:
+        profile.samples["handler;find_one;[waiting]"] += 3
+        profile.samples["handler"] += 1
+        profiler.end(profile, 0.01, 200)
+    assert [profile.path for profile in profiler.profiles] == ["/2", "/3", "/4"]
+    assert profiler.get(profiles[0].id) is None
+    assert profiler.get(profiles[4].id) is profiles[4]
+    assert profiles[4].folded() == "handler;find_one;[waiting] 3\nhandler 1\n"
+
+    profiler.configure(enabled=False, sample_rate=0, max_profiles=2)
+    assert [profile.path for profile in profiler.profiles] == ["/3", "/4"]
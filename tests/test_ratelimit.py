@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from ratelimit import RateLimited, RateLimiter, Rule, TokenBuckets, address_in, client_address, parse_networks
+
+
+def test_bucket_allows_burst_then_refills():
+    buckets = TokenBuckets(Rule(rate_per_second=2, burst=3))
+    assert [buckets.take("a", now=0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a", now=0) == pytest.approx(0.5)
+    # Half a second refills one token
+    assert buckets.take("a", now=0.5) == 0
+    assert buckets.take("a", now=0.5) > 0
+    # Never more than the burst, however long the bucket sat idle
+    assert [buckets.take("a", now=100) for _ in range(4)][-1] > 0
+
+
+def test_buckets_are_per_key():
+    buckets = TokenBuckets(Rule(rate_per_second=1, burst=1))
+    assert buckets.take("a", now=0) == 0
+    assert buckets.take("a", now=0) > 0
+    assert buckets.take("b", now=0) == 0
+
+
+def test_sweep_drops_full_buckets_and_caps_keys():
+    buckets = TokenBuckets(Rule(rate_per_second=1, burst=10), max_keys=4)
+    buckets.take("old", now=0)
+    buckets.take("recent", now=15)
+    buckets.sweep(now=15)
+    assert len(buckets) == 1
+
+    for i in range(10):
+        buckets.take(f"client{i}", now=16 + i)
+    assert len(buckets) <= 4
+    # The most recently seen clients keep their buckets
+    assert buckets.take("client9", now=25) == 0
+    assert buckets._buckets["client9"][0] == 8
+
+
+def test_rate_limiter_raises_with_retry_after():
+    limiter = RateLimiter({"login_ip": Rule(rate_per_second=1, burst=1)})
+
+    async def scenario():
+        await limiter.check("login_ip", "1.2.3.4")
+        with pytest.raises(RateLimited) as raised:
+            await limiter.check("login_ip", "1.2.3.4")
+        return raised.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.rule == "login_ip"
+    assert 0 < rejected.retry_after_seconds <= 1
+    assert limiter.metrics == {("login_ip", "allowed"): 1, ("login_ip", "rejected"): 1}
+
+
+PROXIES = parse_networks(["127.0.0.1", "10.0.0.0/8", " "])
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    assert client_address("203.0.113.7", "198.51.100.1", PROXIES) == "203.0.113.7"
+
+
+def test_client_is_first_untrusted_hop_from_the_right():
+    # Whatever the client put in the header itself is left of its address
+    assert client_address("127.0.0.1", "1.1.1.1, 198.51.100.1, 10.0.0.5", PROXIES) == "198.51.100.1"
+
+
+def test_trusted_peer_without_header_is_the_client():
+    assert client_address("127.0.0.1", None, PROXIES) == "127.0.0.1"
+    assert client_address(None, "198.51.100.1", PROXIES) == "unknown"
+
+
+def test_no_trusted_proxies_by_default():
+    assert client_address("127.0.0.1", "198.51.100.1", parse_networks([""])) == "127.0.0.1"
+
+
+def test_address_in_networks():
+    assert address_in("10.20.30.40", PROXIES)
+    assert address_in("127.0.0.1", PROXIES)
+    assert not address_in("192.168.0.1", PROXIES)
+    assert not address_in("unknown", PROXIES)
+    assert not address_in("127.0.0.1", [])
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from fakes import FakeMinecraftServer
+from rcon import MAX_FRAGMENT_SIZE, RconAuthError, RconConnection, RconPool, RconTimeout, RconUnavailable
+
+
+@pytest.fixture
+def minecraft():
+    server = FakeMinecraftServer(rcon_password="secret").start()
+    yield server
+    server.stop()
+
+
+def test_execute_many_pipelines_commands(minecraft):
+    async def scenario():
+        pool = RconPool(minecraft.host, minecraft.rcon_port, "secret", size=1)
+        try:
+            return await pool.execute_many(["echo one", "echo two", "echo three"])
+        finally:
+            await pool.close()
+
+    assert asyncio.run(scenario()) == ["one", "two", "three"]
+    assert minecraft.rcon_connections == 1
+
+
+def test_bad_password_is_rejected(minecraft):
+    async def scenario():
+        connection = RconConnection(minecraft.host, minecraft.rcon_port, "wrong")
+        with pytest.raises(RconAuthError):
+            await connection.connect()
+
+        pool = RconPool(minecraft.host, minecraft.rcon_port, "wrong")
+        with pytest.raises(RconUnavailable):
+            await pool.execute("list")
+
+    asyncio.run(scenario())
+    assert minecraft.rcon_commands == 0
+
+
+def test_unreachable_server_is_unavailable():
+    async def scenario():
+        pool = RconPool("127.0.0.1", 1, "secret", timeout=1)
+        with pytest.raises(RconUnavailable):
+            await pool.execute("list")
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("length", [10, MAX_FRAGMENT_SIZE, MAX_FRAGMENT_SIZE * 2, MAX_FRAGMENT_SIZE * 2 + 10])
+def test_fragmented_response_is_reassembled(minecraft, length):
+    body = "".join(chr(ord("a") + i % 26) for i in range(length))
+
+    async def scenario():
+        pool = RconPool(minecraft.host, minecraft.rcon_port, "secret", size=1)
+        try:
+            # A full-size last fragment is only known to be the last one once
+            # the answer to the type 200 sentinel arrives
+            alone = await pool.execute(f"echo {body}")
+            # Followed by another command, the next answer ends it instead
+            pipelined = await pool.execute_many([f"echo {body}", "echo after"])
+            return alone, pipelined
+        finally:
+            await pool.close()
+
+    assert asyncio.run(scenario()) == (body, [body, "after"])
+
+
+def test_timeout_retires_the_connection(minecraft):
+    minecraft.stalled_commands.add("stall")
+
+    async def scenario():
+        pool = RconPool(minecraft.host, minecraft.rcon_port, "secret", size=1, timeout=0.2)
+        try:
+            with pytest.raises(RconTimeout) as raised:
+                await pool.execute("stall")
+            assert not isinstance(raised.value, RconUnavailable)
+            stalled_connection = pool._connections[0]
+            assert stalled_connection.retired and stalled_connection.closed
+
+            # Later commands don't queue up behind the unanswered one
+            assert await pool.execute("echo next") == "next"
+            assert pool._connections[0] is not stalled_connection
+            assert pool.metrics["timeouts"] == 1
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+    assert minecraft.rcon_connections == 2
+
+
+def test_each_pipelined_command_gets_its_own_deadline(minecraft):
+    minecraft.stalled_commands.add("stall")
+
+    async def scenario():
+        pool = RconPool(minecraft.host, minecraft.rcon_port, "secret", size=1, timeout=0.3)
+        try:
+            # Together well over the timeout, but each answered within it
+            assert await pool.execute_many(["sleep 0.15"] * 4 + ["echo done"]) == ["Executed: sleep 0.15"] * 4 + ["done"]
+            assert pool.metrics["timeouts"] == 0
+            with pytest.raises(RconTimeout):
+                await pool.execute_many(["echo first", "stall"])
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_reconnects_after_server_drops_the_connection(minecraft):
+    async def scenario():
+        pool = RconPool(minecraft.host, minecraft.rcon_port, "secret", size=1)
+        try:
+            assert await pool.execute("echo before") == "before"
+            minecraft.drop_rcon_connections()
+            for _ in range(50):
+                if pool._connections[0].closed:
+                    break
+                await asyncio.sleep(0.01)
+            assert pool._connections[0].closed
+
+            assert await pool.execute("echo after") == "after"
+            assert pool.metrics["reconnects"] == 2
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
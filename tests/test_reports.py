@@ -0,0 +1,149 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from reports import REPORTS, FunnelParams, ReportJobs, RetentionParams, RevenueParams, purchase_funnel, retention_cohorts, revenue_by_category
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+MONDAY = datetime(2024, 1, 1)
+
+
+def columns(rows, fields):
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+def data(**sources):
+    """Columns of every field any report reads, in the shape ReportJobs loads them"""
+    fields = {}
+    for report in REPORTS.values():
+        for collection, names in report.sources.items():
+            fields.setdefault(collection, {}).update(dict.fromkeys(names))
+    return {collection: columns(sources.get(collection, []), names) for collection, names in fields.items()}
+
+
+def params(model, **values):
+    return model(**values).model_dump()
+
+
+USERS = [
+    {"id": "u1", "created_at": MONDAY},
+    {"id": "u2", "created_at": MONDAY + timedelta(days=2)},
+    {"id": "u3", "created_at": MONDAY + timedelta(days=8)},
+]
+LOGINS = [
+    {"user_id": "u1", "login_time": MONDAY + timedelta(hours=1)},
+    {"user_id": "u1", "login_time": MONDAY + timedelta(days=7)},
+    {"user_id": "u1", "login_time": MONDAY + timedelta(days=8)},
+    {"user_id": "u2", "login_time": MONDAY + timedelta(days=15)},
+    {"user_id": "u3", "login_time": MONDAY + timedelta(days=9)},
+]
+ITEMS = [{"id": "sword", "category": "Weapons"}, {"id": "rank", "category": "Ranks"}]
+PURCHASES = [
+    {"user_id": "u1", "item_id": "sword", "price": 5.0, "status": "completed", "created_at": MONDAY, "completed_at": MONDAY},
+    {"user_id": "u1", "item_id": "rank", "price": 20.0, "status": "completed", "created_at": MONDAY + timedelta(days=1), "completed_at": None},
+    {"user_id": "u2", "item_id": "deleted", "price": 1.5, "status": "completed", "created_at": MONDAY + timedelta(days=7), "completed_at": MONDAY + timedelta(days=14)},
+    {"user_id": "u3", "item_id": "sword", "price": 5.0, "status": "failed", "created_at": MONDAY + timedelta(days=9), "completed_at": None},
+]
+
+
+def test_retention_cohorts():
+    result = retention_cohorts(data(users=USERS, login_logs=LOGINS), params(RetentionParams, weeks=3, as_of=date(2024, 1, 8)))
+    assert result["as_of"] == "2024-01-08"
+    first, second = result["cohorts"]
+    assert (first["cohort"], first["users"]) == ("2024-01-01", 2)
+    # Only weeks that have started are reported, counting each user once a week
+    assert first["active"] == [1, 1]
+    assert first["retention"] == [0.5, 0.5]
+    assert (second["cohort"], second["active"], second["retention"]) == ("2024-01-08", [1], [1.0])
+
+
+def test_retention_cohorts_without_data():
+    result = retention_cohorts(data(), params(RetentionParams, weeks=4, as_of=date(2024, 1, 8)))
+    assert result == {"weeks": 4, "as_of": "2024-01-08", "cohorts": []}
+
+
+def test_revenue_by_category():
+    completed = [purchase for purchase in PURCHASES if purchase["status"] == "completed"]
+    result = revenue_by_category(data(purchases=completed, shop_items=ITEMS), params(RevenueParams, interval="week"))
+    assert result["periods"] == ["2024-01-01", "2024-01-08", "2024-01-15"]
+    by_category = {category["category"]: category for category in result["categories"]}
+    assert [category["category"] for category in result["categories"]] == ["Ranks", "Weapons", "Unknown"]
+    # Counted when completed, or when made if that wasn't recorded
+    assert by_category["Ranks"]["revenue"] == [20.0, 0.0, 0.0]
+    assert by_category["Unknown"]["purchases"] == [0, 0, 1]
+    assert (result["total_revenue"], result["total_purchases"]) == (26.5, 3)
+
+    in_range = revenue_by_category(data(purchases=completed, shop_items=ITEMS), params(RevenueParams, interval="day", end=MONDAY + timedelta(days=1)))
+    assert in_range["periods"] == ["2024-01-01"]
+    assert in_range["total_revenue"] == 5.0
+
+
+def test_revenue_by_category_without_data():
+    result = revenue_by_category(data(shop_items=ITEMS), params(RevenueParams, interval="month"))
+    assert result == {"interval": "month", "periods": [], "categories": [], "total_revenue": 0.0, "total_purchases": 0}
+
+
+def test_purchase_funnel():
+    result = purchase_funnel(data(users=USERS, purchases=PURCHASES), params(FunnelParams))
+    assert [(stage["stage"], stage["users"]) for stage in result["stages"]] == [
+        ("registered", 3), ("ordered", 3), ("purchased", 2), ("repeat_purchased", 1)
+    ]
+    assert result["stages"][2]["rate"] == 0.6667
+    assert result["stages"][3]["from_previous"] == 0.5
+    assert result["purchases_by_status"] == {"completed": 3, "failed": 1}
+
+
+def test_purchase_funnel_without_data():
+    result = purchase_funnel(data(), params(FunnelParams))
+    assert [(stage["users"], stage["rate"]) for stage in result["stages"]] == [(0, 0.0)] * 4
+    assert result["purchases_by_status"] == {}
+
+
+def test_parse_validates_params():
+    jobs = ReportJobs(None, None, REPORTS)
+    with pytest.raises(ValueError, match="Unknown report"):
+        jobs.parse("churn", {})
+    with pytest.raises(ValueError, match="weeks"):
+        jobs.parse("retention_cohorts", {"weeks": 0})
+    # Retention defaults to this week
+    assert jobs.parse("retention_cohorts", {}).as_of.weekday() == 0
+
+
+def test_jobs_run_in_workers_and_are_reused_until_the_data_changes():
+    db = mongomock_motor.AsyncMongoMockClient()["reports"]
+    jobs = ReportJobs(db.report_jobs, db, REPORTS, stamped=("users", "purchases"), max_workers=1)
+
+    async def wait(job_id):
+        for _ in range(600):
+            job = await jobs.get(job_id)
+            if job["status"] in ("completed", "failed"):
+                return job
+            await asyncio.sleep(0.05)
+        raise AssertionError("report did not finish")
+
+    async def scenario():
+        await db.users.insert_many([{**user, "sync_seq": index} for index, user in enumerate(USERS)])
+        await db.purchases.insert_many([dict(purchase) for purchase in PURCHASES])
+        try:
+            job = await jobs.submit("purchase_funnel", {}, submitted_by="admin")
+            done = await wait(job["id"])
+            assert done["status"] == "completed", done.get("error")
+            assert done["result"]["stages"][0]["users"] == 3
+            assert done["current"]
+
+            again = await jobs.submit("purchase_funnel", {})
+            assert again["id"] == job["id"]
+
+            await db.users.insert_one({"id": "u4", "created_at": MONDAY, "sync_seq": 10})
+            assert not (await jobs.get(job["id"]))["current"]
+            fresh = await jobs.submit("purchase_funnel", {})
+            assert fresh["id"] != job["id"]
+            assert (await wait(fresh["id"]))["result"]["stages"][0]["users"] == 4
+        finally:
+            await jobs.stop()
+
+    asyncio.run(scenario())
+    assert jobs.metrics[("purchase_funnel", "reused")] == 1
+    assert jobs.metrics[("purchase_funnel", "completed")] == 2
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from shared_state import FileSharedStore, LeaderElector, MongoSharedStore, RedisSharedStore, SharedStore, create_shared_store
+
+
+@pytest.fixture(params=["file", "mongo", "redis"])
+def store(request, tmp_path):
+    """Every backend, to run the same contract against"""
+    if request.param == "file":
+        return FileSharedStore(str(tmp_path))
+    if request.param == "mongo":
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        return MongoSharedStore(mongomock_motor.AsyncMongoMockClient()["shared"]["shared_state"])
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisSharedStore(fakeredis.FakeAsyncRedis())
+
+
+def run(store, scenario):
+    async def wrapped():
+        await store.setup()
+        try:
+            await scenario()
+        finally:
+            await store.close()
+
+    asyncio.run(wrapped())
+
+
+def test_shared_store_is_abstract():
+    with pytest.raises(TypeError):
+        SharedStore()
+
+
+def test_values(store):
+    async def scenario():
+        await store.set("status", {"online": True, "players": ["Steve"]})
+        assert await store.get("status") == {"online": True, "players": ["Steve"]}
+        await store.set("status", 3)
+        assert await store.get("status") == 3
+        await store.delete("status")
+        assert await store.get("status") is None
+        await store.delete("status")
+        assert await store.get("missing") is None
+
+        await store.set("short", "lived", ttl_seconds=0.05)
+        assert await store.get("short") == "lived"
+        await asyncio.sleep(0.1)
+        assert await store.get("short") is None
+
+    run(store, scenario)
+
+
+def test_leases(store):
+    async def scenario():
+        assert await store.acquire_lease("leader", "a", 10)
+        assert not await store.acquire_lease("leader", "b", 10)
+        # Renewing a held lease succeeds
+        assert await store.acquire_lease("leader", "a", 10)
+        # Only the holder can release it
+        await store.release_lease("leader", "b")
+        assert not await store.acquire_lease("leader", "b", 10)
+        await store.release_lease("leader", "a")
+        assert await store.acquire_lease("leader", "b", 10)
+        # Leases are independent of each other
+        assert await store.acquire_lease("reports", "a", 10)
+
+        # An expired lease is free for anyone
+        assert await store.acquire_lease("brief", "a", 0.05)
+        await asyncio.sleep(0.1)
+        assert await store.acquire_lease("brief", "b", 10)
+        assert not await store.acquire_lease("brief", "a", 10)
+
+    run(store, scenario)
+
+
+def test_token_buckets(store):
+    async def scenario():
+        assert await store.take_tokens("ip", rate=20, burst=2) == 0
+        assert await store.take_tokens("ip", rate=20, burst=2) == 0
+        wait = await store.take_tokens("ip", rate=20, burst=2)
+        assert 0 < wait <= 0.05
+        # Refused takes cost nothing, and buckets are per key
+        assert await store.take_tokens("other", rate=20, burst=2, cost=2) == 0
+        await asyncio.sleep(0.06)
+        assert await store.take_tokens("ip", rate=20, burst=2) == 0
+
+        # Never more than the burst, however long the bucket sat idle
+        await asyncio.sleep(0.2)
+        assert await store.take_tokens("ip", rate=20, burst=2, cost=2) == 0
+        assert await store.take_tokens("ip", rate=20, burst=2) > 0
+        # A cost above the burst can never be met right away
+        assert await store.take_tokens("big", rate=20, burst=2, cost=3) > 0
+
+        await store.sweep_tokens()
+
+    run(store, scenario)
+
+
+def test_concurrent_takes_never_overdraw(store):
+    async def scenario():
+        waits = await asyncio.gather(*(store.take_tokens("login", rate=0.01, burst=5) for _ in range(12)))
+        assert sum(1 for wait in waits if wait == 0) == 5
+
+    run(store, scenario)
+
+
+def test_store_is_picked_by_url(tmp_path):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["shared"]
+    assert isinstance(create_shared_store("mongo", db), MongoSharedStore)
+    assert isinstance(create_shared_store(f"file://{tmp_path}", db), FileSharedStore)
+    with pytest.raises(ValueError):
+        create_shared_store("memcached://localhost", db)
+
+
+def test_leader_restarts_crashed_jobs(tmp_path):
+    runs = []
+
+    async def flaky_job():
+        runs.append(len(runs))
+        if len(runs) < 3:
+            raise RuntimeError("boom")
+        await asyncio.sleep(3600)
+
+    leader = LeaderElector(FileSharedStore(str(tmp_path)), ttl_seconds=3, restart_backoff_seconds=0.01)
+    leader.add_job(flaky_job)
+
+    async def scenario():
+        leader.start()
+        for _ in range(100):
+            if len(runs) == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert leader.is_leader
+        await leader.stop()
+
+    asyncio.run(scenario())
+    assert len(runs) == 3
+    assert leader.crashes == {"test_leader_restarts_crashed_jobs.<locals>.flaky_job": 2}
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+from sketches import ActiveUserSketches, HyperLogLog
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def sketch_of(items, precision=12) -> HyperLogLog:
+    sketch = HyperLogLog(precision)
+    for item in items:
+        sketch.add(item)
+    return sketch
+
+
+@pytest.mark.parametrize("n", [0, 1, 100, 5000, 100000])
+def test_estimate_within_error(n):
+    estimate = sketch_of(f"user{i}" for i in range(n)).count()
+    # About 1.6% standard error at precision 12; allow four of them
+    assert abs(estimate - n) <= max(1, 0.065 * n)
+
+
+def test_duplicates_do_not_count():
+    sketch = sketch_of(["steve"] * 1000)
+    assert sketch.count() == 1
+    assert not sketch.add("steve")
+
+
+def test_merge_estimates_the_union():
+    first = sketch_of(f"user{i}" for i in range(0, 6000))
+    second = sketch_of(f"user{i}" for i in range(4000, 10000))
+    first.merge(second)
+    assert abs(first.count() - 10000) <= 650
+    # Merging is idempotent and matches adding everything to one sketch
+    registers = bytes(first.registers)
+    first.merge(second)
+    assert bytes(first.registers) == registers
+    assert registers == bytes(sketch_of(f"user{i}" for i in range(10000)).registers)
+
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+    with pytest.raises(ValueError):
+        HyperLogLog(12, registers=b"\x00" * 10)
+
+
+def test_workers_merge_days_into_the_store():
+    collection = mongomock_motor.AsyncMongoMockClient()["sketches"]["activity_sketches"]
+    workers = [ActiveUserSketches(collection) for _ in range(2)]
+    monday, tuesday = datetime(2024, 1, 1, 12), datetime(2024, 1, 2, 12)
+
+    async def scenario():
+        for i in range(300):
+            workers[i % 2].record(f"user{i}", monday)
+        for i in range(200, 400):
+            workers[i % 2].record(f"user{i}", tuesday)
+        # Unflushed activity counts for this worker's own estimates
+        unflushed = await workers[0].estimate([monday.date()])
+        for worker in workers:
+            await worker.flush()
+        return unflushed, (
+            await workers[0].estimate([monday.date()]),
+            await workers[1].window(date(2024, 1, 2), 2),
+            await collection.count_documents({}),
+        )
+
+    unflushed, (monday_count, both_days, documents) = asyncio.run(scenario())
+    assert abs(unflushed - 150) <= 5
+    assert abs(monday_count - 300) <= 10
+    assert abs(both_days - 400) <= 15
+    assert documents == 2
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from skins import SkinError, SkinStore, decode_skin, render_head, texture_hash_from_url
+
+FACE = (200, 150, 100, 255)
+HAT = (0, 0, 255, 255)
+
+
+def png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def skin_image(width=64, height=64, hat=True) -> Image.Image:
+    scale = width // 64
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    image.paste(FACE, (8 * scale, 8 * scale, 16 * scale, 16 * scale))
+    if hat:
+        # Hat covers the top half of the face only
+        image.paste(HAT, (40 * scale, 8 * scale, 48 * scale, 12 * scale))
+    return image
+
+
+def test_head_is_face_with_hat_on_top():
+    head = render_head(decode_skin(png(skin_image())), 32)
+    assert head.size == (32, 32)
+    assert head.getpixel((0, 0)) == HAT
+    assert head.getpixel((31, 31)) == FACE
+
+
+@pytest.mark.parametrize("width,height", [(64, 32), (128, 128)])
+def test_legacy_and_high_resolution_skins(width, height):
+    head = render_head(decode_skin(png(skin_image(width, height))), 16)
+    assert head.getpixel((0, 15)) == FACE
+
+
+def test_palette_skins_are_converted():
+    head = render_head(decode_skin(png(skin_image(hat=False).convert("P"))), 8)
+    assert head.getpixel((4, 4)) == FACE
+
+
+def test_rejects_non_png():
+    buffer = io.BytesIO()
+    skin_image().convert("RGB").save(buffer, "JPEG")
+    with pytest.raises(SkinError):
+        decode_skin(buffer.getvalue())
+    with pytest.raises(SkinError):
+        decode_skin(b"definitely not an image")
+
+
+def test_rejects_truncated_png():
+    data = png(skin_image())
+    with pytest.raises(SkinError):
+        decode_skin(data[:len(data) // 2])
+
+
+def test_rejects_bad_crc():
+    data = bytearray(png(skin_image()))
+    # Flip a byte of the IHDR body; its CRC no longer matches
+    data[16] ^= 0xFF
+    with pytest.raises(SkinError):
+        decode_skin(bytes(data))
+
+
+def test_rejects_oversized_dimensions_before_inflating():
+    # A 4096x4096 image of zeros compresses to a few kilobytes
+    width = height = 4096
+    raw = zlib.compress(b"\x00" * ((width * 4 + 1) * height), 9)
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    bomb = (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", raw)
+        + chunk(b"IEND", b"")
+    )
+    assert len(bomb) < 100000
+    with pytest.raises(SkinError, match="too large"):
+        decode_skin(bomb)
+
+
+def test_rejects_images_too_small_for_a_skin():
+    with pytest.raises(SkinError):
+        render_head(decode_skin(png(Image.new("RGBA", (16, 16)))), 16)
+
+
+def test_texture_hash_from_url():
+    assert texture_hash_from_url("http://textures.minecraft.net/texture/ABCDEF0123456789") == "abcdef0123456789"
+    assert texture_hash_from_url("http://textures.minecraft.net/texture/../etc/passwd") is None
+
+
+def test_store_writes_heads_and_evicts(tmp_path):
+    data = png(skin_image())
+    store = SkinStore(str(tmp_path), max_bytes=10 ** 6, head_sizes=(8, 16))
+    store.load()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return data
+
+    async def scenario():
+        await asyncio.gather(*(store.ensure("a" * 16, fetch) for _ in range(3)))
+        await store.ensure("a" * 16, fetch)
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert Image.open(store.path("a" * 16, "head-16.png")).size == (16, 16)
+
+    store.max_bytes = store.total_bytes
+    asyncio.run(store.ensure("b" * 16, fetch))
+    assert not store.path("a" * 16, "skin.png").exists()
+    assert store.metrics["evicted"] == 1
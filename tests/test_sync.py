@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from sync import ChangeFeed
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def make_feed(settle_seconds=0):
+    db = mongomock_motor.AsyncMongoMockClient()["sync"]
+    return db, ChangeFeed(db, {"users": {"_id": 0}, "purchases": {"_id": 0, "id": 1, "status": 1}}, settle_seconds=settle_seconds)
+
+
+def test_stamps_increase_without_touching_the_database():
+    db, feed = make_feed()
+
+    async def scenario():
+        stamps = [await feed.stamp() for _ in range(1000)]
+        return stamps, await db.list_collection_names()
+
+    stamps, collections = asyncio.run(scenario())
+    seqs = [stamp["sync_seq"] for stamp in stamps]
+    assert seqs == sorted(set(seqs))
+    assert collections == []
+
+
+def test_changes_and_tombstones_after_cursor():
+    db, feed = make_feed()
+
+    async def scenario():
+        await feed.setup()
+        await db.users.insert_one({"id": "u1", "name": "Steve", **await feed.stamp()})
+        await db.users.insert_one({"id": "u2", "name": "Alex", **await feed.stamp()})
+        cursor = await feed.cursor()
+
+        await db.users.update_one({"id": "u1"}, {"$set": {"name": "Notch", **await feed.stamp()}})
+        await db.purchases.insert_one({"id": "p1", "status": "pending", "price": 5, **await feed.stamp()})
+        await db.users.delete_one({"id": "u2"})
+        await feed.tombstone("users", "u2")
+        return await feed.changes(cursor)
+
+    result = asyncio.run(scenario())
+    assert not result["reset"]
+    assert result["changes"]["users"] == [{"id": "u1", "name": "Notch"}]
+    # Projections apply to the documents sent
+    assert result["changes"]["purchases"] == [{"id": "p1", "status": "pending"}]
+    assert result["deleted"] == {"users": ["u2"], "purchases": []}
+    assert not result["has_more"]
+
+
+def test_cursor_stays_before_unsettled_changes():
+    db, feed = make_feed(settle_seconds=60)
+
+    async def scenario():
+        start = feed.encode_cursor(0, datetime.utcnow())
+        await db.users.insert_one({"id": "u1", **await feed.stamp()})
+        first = await feed.changes(start)
+        again = await feed.changes(first["cursor"])
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert first["changes"]["users"] == [{"id": "u1"}]
+    # Too recent to rule out an earlier-numbered write still landing
+    assert again["changes"]["users"] == [{"id": "u1"}]
+
+
+def test_paging_and_reset():
+    db, feed = make_feed()
+
+    async def scenario():
+        for i in range(5):
+            await db.users.insert_one({"id": f"u{i}", **await feed.stamp()})
+        cursor = feed.encode_cursor(0, datetime.utcnow())
+        pages = []
+        while True:
+            page = await feed.changes(cursor, limit=2)
+            pages.append([user["id"] for user in page["changes"]["users"]])
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                break
+        expired = feed.encode_cursor(0, datetime.utcnow() - timedelta(seconds=feed.tombstone_ttl_seconds + 1))
+        return pages, await feed.changes(expired)
+
+    pages, expired = asyncio.run(scenario())
+    assert pages == [["u0", "u1"], ["u2", "u3"], ["u4"]]
+    assert expired["reset"]
+
+
+def test_malformed_cursor():
+    with pytest.raises(ValueError):
+        ChangeFeed.decode_cursor("not a cursor")
+
+
+def test_pages_take_whole_writes():
+    db, feed = make_feed()
+
+    async def scenario():
+        # One update_many stamps every document it touches alike
+        stamp = await feed.stamp()
+        await db.purchases.insert_many([{"id": f"p{i}", "status": "completed", **stamp} for i in range(5)])
+        await db.users.insert_one({"id": "u1", **await feed.stamp()})
+        cursor = feed.encode_cursor(0, datetime.utcnow())
+        pages = []
+        for _ in range(5):
+            page = await feed.changes(cursor, limit=2)
+            pages.append([doc["id"] for docs in page["changes"].values() for doc in docs])
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                break
+        return pages
+
+    assert asyncio.run(scenario()) == [["p0", "p1", "p2", "p3", "p4"], ["u1"]]
+
+
+def test_has_more_clears_when_the_cursor_cannot_advance():
+    db, feed = make_feed(settle_seconds=60)
+
+    async def scenario():
+        for i in range(3):
+            await db.users.insert_one({"id": f"u{i}", **await feed.stamp()})
+        start = feed.encode_cursor(0, datetime.utcnow())
+        return start, await feed.changes(start, limit=1)
+
+    start, page = asyncio.run(scenario())
+    assert [user["id"] for user in page["changes"]["users"]] == ["u0"]
+    assert ChangeFeed.decode_cursor(page["cursor"])[0] == ChangeFeed.decode_cursor(start)[0]
+    # Asking again would only return the same unsettled page
+    assert not page["has_more"]
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+from tokens import TokenRevocations, TokenVerifier
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+SECRET = "test-secret-at-least-32-bytes-long"
+
+
+def token(expires_in=60, **claims):
+    return jwt.encode({"sub": "u1", "exp": int(time.time()) + expires_in, **claims}, SECRET, algorithm="HS256")
+
+
+def test_verified_tokens_are_cached():
+    verifier = TokenVerifier(SECRET, "HS256")
+    raw = token()
+    assert verifier.verify(raw)["sub"] == "u1"
+    assert verifier.verify(raw)["sub"] == "u1"
+    assert (verifier.hits, verifier.misses) == (1, 1)
+
+
+def test_invalid_tokens_are_rejected_and_not_cached():
+    verifier = TokenVerifier(SECRET, "HS256")
+    forged = jwt.encode({"sub": "u1", "exp": int(time.time()) + 60}, "another-secret-at-least-32-bytes-long", algorithm="HS256")
+    for bad in (forged, "not-a-token", token(expires_in=-1), jwt.encode({"sub": "u1"}, SECRET, algorithm="HS256")):
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.verify(bad)
+    assert len(verifier) == 0
+
+
+def test_cached_tokens_still_expire():
+    verifier = TokenVerifier(SECRET, "HS256")
+    raw = token()
+    verifier.verify(raw)
+    verifier._verified[raw]["exp"] = time.time() - 1
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.verify(raw)
+    assert len(verifier) == 0
+
+
+def test_cache_is_bounded_lru():
+    verifier = TokenVerifier(SECRET, "HS256", max_entries=2)
+    first, second, third = (token(jti=str(i)) for i in range(3))
+    verifier.verify(first)
+    verifier.verify(second)
+    verifier.verify(first)
+    verifier.verify(third)
+    assert len(verifier) == 2
+    assert second not in verifier._verified
+    assert first in verifier._verified
+
+
+def revocations_collection():
+    return mongomock_motor.AsyncMongoMockClient()["tokens"]["token_revocations"]
+
+
+def test_revocations_reject_older_versions_or_everything():
+    collection = revocations_collection()
+
+    async def scenario():
+        revocations = TokenRevocations(collection, token_ttl_seconds=3600)
+        await revocations.revoke("u1", min_version=3)
+        await revocations.revoke("u2")
+        assert revocations.is_revoked("u1", 2)
+        assert not revocations.is_revoked("u1", 3)
+        assert revocations.is_revoked("u2", 100)
+        assert not revocations.is_revoked("u3", 0)
+
+    asyncio.run(scenario())
+
+
+def test_revocations_expire_after_a_token_lifetime():
+    collection = revocations_collection()
+
+    async def scenario():
+        revocations = TokenRevocations(collection, token_ttl_seconds=3600)
+        await revocations.revoke("u1")
+        revocations._revoked["u1"] = (None, datetime.utcnow() - timedelta(seconds=1))
+        assert not revocations.is_revoked("u1", 0)
+        assert len(revocations) == 0
+
+    asyncio.run(scenario())
+
+
+def test_instances_share_revocations_through_the_collection():
+    collection = revocations_collection()
+
+    async def scenario():
+        first = TokenRevocations(collection, token_ttl_seconds=3600)
+        second = TokenRevocations(collection, token_ttl_seconds=3600)
+        await first.revoke("u1", min_version=2)
+        assert not second.is_revoked("u1", 1)
+        second.reload_soon()
+        await second._reload_task
+        assert second.is_revoked("u1", 1)
+
+        # A later revocation wins over the one already held
+        await first.revoke("u1", min_version=5)
+        await second.load()
+        assert second.is_revoked("u1", 4)
+
+        # Expired documents are not loaded
+        await collection.insert_one({"_id": "u2", "min_version": None, "expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        await second.load()
+        assert not second.is_revoked("u2", 0)
+
+    asyncio.run(scenario())